@@ -6,7 +6,10 @@ from datetime import datetime
 from utils.minio_client import minio_client
 from typing import List, Optional
 
-from io import BytesIO
+from backend.services.telegram_file_cache import telegram_file_cache
+from backend.services.storage import storage, UploadTooLarge
+# Версия контента бота - из модуля кэша, который читает bot_main
+from services.bot_content_cache import BOT_CONTENT_VERSION
 
 import uuid
 import os
@@ -16,6 +19,7 @@ import os
 router = APIRouter(prefix="/api/bot-content", tags=["bot-content"])
 
 db = None
+bot = None
 
 
 
@@ -54,15 +58,11 @@ async def upload_image(
                 detail=f"Неподдерживаемый формат. Разрешены: {', '.join(allowed_extensions)}"
             )
         
-        # Проверяем размер файла (макс 10MB)
+        # Проверяем размер файла (макс 10MB): заранее, если размер известен, и при загрузке потоком
         max_size = 10 * 1024 * 1024
-        file_content = await image.read()
-        if len(file_content) > max_size:
+        if image.size is not None and image.size > max_size:
             raise HTTPException(status_code=400, detail="Файл слишком большой (макс 10MB)")
         
-        # 🔥 ВОЗВРАЩАЕМ КУРСОР НА НАЧАЛО ДЛЯ ПОВТОРНОГО ЧТЕНИЯ
-        image_stream = BytesIO(file_content)
-        
         # Проверяем/создаем контент
         content = await db.fetch_one(
             "SELECT * FROM bot_content WHERE content_type = %s",
@@ -87,13 +87,19 @@ async def upload_image(
         
         print(f"🔄 Загрузка в MinIO: {object_name}")
         
-        minio_client.put_object(
-            "bot-content",
-            object_name,
-            image_stream,  # ← объект с методом read()
-            length=len(file_content),  # ← явно указываем размер
-            content_type=image.content_type
-        )
+        # Потоком из временного файла запроса в MinIO (в пуле потоков хранилища)
+        try:
+            uploaded = await storage.put_stream(
+                minio_client,
+                "bot-content",
+                object_name,
+                image.file,
+                content_type=image.content_type,
+                max_size=max_size
+            )
+        except UploadTooLarge:
+            raise HTTPException(status_code=400, detail="Файл слишком большой (макс 10MB)")
+        print(f"📦 {uploaded.size} bytes, sha256 {uploaded.sha256}")
         
         image_url = f"https://dismally-familiar-sharksucker.cloudpub.ru/fast_bot_content/{object_name}"
         print(f"✅ Изображение загружено: {image_url}")
@@ -103,13 +109,19 @@ async def upload_image(
             "INSERT INTO bot_images (content_id, image_url, is_main) VALUES (%s, %s, FALSE)",
             (content_id, image_url)
         )
+        await db.bump_version(BOT_CONTENT_VERSION)
         
         print("✅ Изображение сохранено в БД")
         
+        # Заранее получаем file_id в Telegram (в фоне)
+        telegram_file_cache.preupload_in_background(bot, image_url, filename=image.filename)
+        
         return JSONResponse({
             "success": True, 
             "message": "Image uploaded successfully",
-            "image_url": image_url
+            "image_url": image_url,
+            "size": uploaded.size,
+            "sha256": uploaded.sha256
         })
         
     except HTTPException:
@@ -166,7 +178,7 @@ async def delete_image(
         print(f"🔍 Bucket: {bucket_name}, Object: {object_path}")
         
         try:
-            minio_client.remove_object(bucket_name, object_path)
+            await storage.remove_object(minio_client, bucket_name, object_path)
             print(f"✅ Deleted from MinIO: {object_path}")
         except Exception as e:
             print(f"⚠️ MinIO deletion error (maybe already deleted): {e}")
@@ -176,6 +188,8 @@ async def delete_image(
             "DELETE FROM bot_images WHERE id = %s",
             (image_id,)
         )
+        await db.bump_version(BOT_CONTENT_VERSION)
+        await telegram_file_cache.invalidate(image_url)
         
         print("✅ Deleted from database")
         return JSONResponse({"success": True, "message": "Image deleted"})
@@ -225,6 +239,7 @@ async def set_main_image(
             "UPDATE bot_images SET is_main = TRUE WHERE id = %s",
             (image_id,)
         )
+        await db.bump_version(BOT_CONTENT_VERSION)
         
         return JSONResponse({"success": True, "message": "Main image set"})
         
@@ -330,6 +345,9 @@ async def update_bot_content_api(
                             )
                             inserted_count += 1
                     print(f"✅ Inserted {inserted_count} new buttons")
+            
+            # Бот перечитает описание/контакты
+            await db.bump_version(BOT_CONTENT_VERSION, cursor=cursor)
         
         return JSONResponse({"success": True})
         
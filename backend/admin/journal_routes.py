@@ -5,8 +5,12 @@ from fastapi.templating import Jinja2Templates
 from typing import List, Optional
 
 from backend.services.minio_service import minio_service
+from backend.services.storage import storage, HashingReader, UploadTooLarge
+from backend.services.image_service import image_variants
+from backend.services.telegram_file_cache import telegram_file_cache
 
 import aiomysql
+import asyncio
 
 
 
@@ -14,6 +18,7 @@ router = APIRouter(prefix="/journal", tags=["journal"])
 
 templates: Jinja2Templates = None
 db = None
+bot = None
 
 
 
@@ -118,6 +123,7 @@ async def add_journal(
             VALUES (%s, %s, %s, %s, %s, %s)""",
             (journal_id, title, description, price, year, quantity)
         )
+        await db.bump_version('catalog')
         
         return RedirectResponse(url="/journal/list", status_code=303)
         
@@ -163,20 +169,28 @@ async def edit_journal_form(
     from datetime import datetime
     current_year = datetime.now().year
     
-    # Загружаем изображения
+    # Загружаем изображения мини-приложения (только для бота - в списке бота)
     journal_images = await db.fetch_all(
-        "SELECT * FROM journal_images WHERE journal_id = %s ORDER BY is_main DESC, id",
+        "SELECT * FROM journal_images WHERE journal_id = %s AND show_in_app ORDER BY is_main DESC, id",
         (journal_id,)
     )
     journal['images'] = journal_images
     
-    # Загружаем изображения бота
+    # Загружаем изображения бота (роли канонических изображений - с их текущим URL)
     journal_bot_images = await db.fetch_all(
-        "SELECT * FROM journal_bot_images WHERE journal_id = %s ORDER BY is_main DESC, id",
+        """SELECT b.id, b.journal_id, COALESCE(i.image_url, b.image_url) AS image_url,
+                  b.is_main, b.source_image_id
+        FROM journal_bot_images b
+        LEFT JOIN journal_images i ON i.id = b.source_image_id
+        WHERE b.journal_id = %s ORDER BY b.is_main DESC, b.id""",
         (journal_id,)
     )
     journal['bot_images'] = journal_bot_images
     
+    bot_source_ids = {image['source_image_id'] for image in journal_bot_images if image['source_image_id']}
+    for image in journal_images:
+        image['in_bot'] = image['id'] in bot_source_ids
+    
     return templates.TemplateResponse(
         "journals/edit_journal.html", 
         {
@@ -189,6 +203,99 @@ async def edit_journal_form(
 
 
 
+def bot_object_path(image_url: str) -> str:
+    """Путь объекта в bucket journals-bot по публичному URL (старые строки journal_bot_images)"""
+    return image_url.split('fast_image_bot/')[1]
+
+
+
+BOT_BUCKET = "journals-bot"
+
+
+
+def telegram_photo_url(image_url: str) -> str:
+    """URL канонического изображения для бота: вариант telegram через кэширующий роут"""
+    return f"{image_url.replace('minio_proxy/journals/', 'fast_image/')}?size=telegram"
+
+
+
+async def upload_journal_images(journal_id: str, files: List[UploadFile]) -> List[dict]:
+    """
+    Параллельно загружает файлы в MinIO (до транзакции) - одна каноническая
+    копия в bucket journals, варианты для бота и мини-приложения строятся
+    из нее. Если хотя бы одна загрузка упала с исключением, уже
+    загруженные объекты удаляются.
+    """
+    files = [(i, f) for i, f in enumerate(files) if f and f.filename]
+    if not files:
+        return []
+    
+    async def upload_one(index: int, image_file: UploadFile) -> dict:
+        print(f"📤 Processing image: {image_file.filename}")
+        # Поток из временного файла запроса прямо в MinIO: размер и хэш считаются на лету
+        reader = HashingReader(image_file.file)
+        image_url, filename = await storage.run(
+            'upload_image', minio_service.upload_image, journal_id, reader, image_file.filename,
+            # Имя объекта генерируется в потоке - дошедшую после таймаута загрузку удаляем по результату
+            cleanup=lambda uploaded: uploaded[1] and minio_service.delete_image(journal_id, uploaded[1])
+        )
+        
+        variants = {}
+        if image_url:
+            print(f"✅ Uploaded {image_file.filename}: {reader.size} bytes, sha256 {reader.sha256[:12]}")
+            
+            # Варианты (thumb/card/full/telegram) - в пуле процессов, рядом с оригиналом;
+            # процесс пула читает копию загрузки с диска, а не bytes из памяти
+            variants = await image_variants.create(
+                minio_service.client,
+                minio_service.bucket_name,
+                f"journal_{journal_id}/{filename}",
+                image_file.file
+            )
+        return {
+            'index': index,
+            'url': image_url,
+            'filename': filename,
+            'variants': variants,
+            'size': reader.size,
+            'sha256': reader.sha256,
+            'original_filename': image_file.filename
+        }
+    
+    results = await asyncio.gather(*(upload_one(i, f) for i, f in files), return_exceptions=True)
+    uploaded = [r for r in results if isinstance(r, dict) and r['url']]
+    
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        await remove_uploaded_images(journal_id, uploaded)
+        raise errors[0]
+    
+    return uploaded
+
+
+
+async def remove_uploaded_images(journal_id: str, images: List[dict]):
+    """Компенсация: удаляет из MinIO объекты, которые не попали в БД"""
+    if not images:
+        return
+    
+    results = await asyncio.gather(
+        *(storage.run('delete_image', minio_service.delete_image, journal_id, image['filename']) for image in images),
+        return_exceptions=True
+    )
+    await asyncio.gather(
+        *(image_variants.delete(minio_service.client, minio_service.bucket_name, f"journal_{journal_id}/{image['filename']}")
+          for image in images if image['variants'])
+    )
+    
+    failed = [r for r in results if r is not True]
+    if failed:
+        print(f"⚠️ Orphaned objects not removed: {len(failed)} of {len(results)}")
+    else:
+        print(f"🧹 Removed {len(results)} orphaned uploads")
+
+
+
 @router.post("/{journal_id}/edit")
 async def edit_journal(
     request: Request,
@@ -201,7 +308,9 @@ async def edit_journal(
     quantity: int = Form(0),
     new_images: Optional[List[UploadFile]] = File(None),
     new_bot_images: Optional[List[UploadFile]] = File(None),
+    use_for_bot: Optional[bool] = Form(False),
     set_first_bot_as_main: Optional[bool] = Form(False),
+    add_to_bot: Optional[List[str]] = Form(None),
     delete_images: Optional[List[str]] = Form(None),
     delete_bot_images: Optional[List[str]] = Form(None),
     main_image: Optional[str] = Form(None),
@@ -213,6 +322,30 @@ async def edit_journal(
     if not current_user.get('is_staff', False):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
     
+    # 📤 ЗАГРУЖАЕМ НОВЫЕ ИЗОБРАЖЕНИЯ ДО ТРАНЗАКЦИИ (ПАРАЛЛЕЛЬНО, БЕЗ БЛОКИРОВКИ СТРОКИ)
+    # Каждый файл хранится один раз; new_bot_images (старая форма) - те же
+    # канонические изображения, сразу с ролью в боте, но без показа в мини-приложении
+    original_id = journal_id
+    target_id = new_id or journal_id
+    app_files = [f for f in (new_images or []) if f and f.filename]
+    bot_files = [f for f in (new_bot_images or []) if f and f.filename]
+    try:
+        uploaded_images = await upload_journal_images(target_id, app_files + bot_files)
+    except Exception as e:
+        print(f"❌ Error uploading images: {e}")
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Error uploading images: {str(e)}")
+    
+    # Роль в боте: все новые, если отмечено use_for_bot, иначе только из new_bot_images
+    bot_role_images = [
+        image for image in uploaded_images
+        if use_for_bot or image['index'] >= len(app_files)
+    ]
+    
+    # Объекты, которые удаляем из MinIO только после коммита
+    removed_images, removed_bot_images = [], []
+    
     try:
         async with db.transaction() as cursor:
             # 🔒 БЛОКИРУЕМ ТЕКУЩИЙ ЖУРНАЛ НА ЗАПИСЬ
@@ -254,70 +387,96 @@ async def edit_journal(
             )
             print(f"✅ Updated journal data: {journal_id}")
             
-            # 🖼️ ОБРАБОТКА ИЗОБРАЖЕНИЙ
-            if new_images:
-                for image_file in new_images:
-                    if image_file and image_file.filename:
-                        print(f"📤 Processing image: {image_file.filename}")
-                        contents = await image_file.read()
-                        
-                        image_url, filename = minio_service.upload_image(
-                            journal_id, contents, image_file.filename
-                        )
-                        if image_url:
-                            await cursor.execute(
-                                "INSERT INTO journal_images (journal_id, image_path, image_url) VALUES (%s, %s, %s)",
-                                (journal_id, filename, image_url)
-                            )
-                            print(f"✅ Image uploaded: {image_url}")
+            # 🖼️ МЕТАДАННЫЕ ЗАГРУЖЕННЫХ ИЗОБРАЖЕНИЙ - ОДНИМ ЗАПРОСОМ НА ТАБЛИЦУ
+            if uploaded_images:
+                await cursor.executemany(
+                    """INSERT INTO journal_images (journal_id, image_path, image_url, show_in_app)
+                    VALUES (%s, %s, %s, %s)""",
+                    [
+                        (journal_id, image['filename'], image['url'], image['index'] < len(app_files))
+                        for image in uploaded_images
+                    ]
+                )
+                print(f"✅ Images saved: {len(uploaded_images)}")
             
-            if new_bot_images:
-                for i, image_file in enumerate(new_bot_images):
-                    if image_file and image_file.filename:
-                        print(f"📤 Processing bot image: {image_file.filename}")
-                        contents = await image_file.read()
-                        
-                        image_url, filename = minio_service.upload_bot_image(
-                            journal_id, contents, image_file.filename
-                        )
-                        if image_url:
-                            is_main = set_first_bot_as_main and i == 0
-                            await cursor.execute(
-                                "INSERT INTO journal_bot_images (journal_id, image_url, is_main) VALUES (%s, %s, %s)",
-                                (journal_id, image_url, is_main)
-                            )
-                            print(f"✅ Bot image uploaded: {image_url}")
+            # 🤖 РОЛЬ В БОТЕ - ССЫЛКА НА КАНОНИЧЕСКОЕ ИЗОБРАЖЕНИЕ, БЕЗ ВТОРОЙ КОПИИ
+            if bot_role_images:
+                await cursor.executemany(
+                    """INSERT INTO journal_bot_images (journal_id, image_url, is_main, source_image_id)
+                    SELECT journal_id, image_url, %s, id FROM journal_images
+                    WHERE journal_id = %s AND image_path = %s""",
+                    [
+                        (bool(set_first_bot_as_main and image is bot_role_images[0]), journal_id, image['filename'])
+                        for image in bot_role_images
+                    ]
+                )
+                print(f"✅ Bot roles saved: {len(bot_role_images)}")
             
-            # 🗑️ УДАЛЕНИЕ ИЗОБРАЖЕНИЙ
+            if add_to_bot:
+                await cursor.execute(
+                    f"""INSERT INTO journal_bot_images (journal_id, image_url, is_main, source_image_id)
+                    SELECT i.journal_id, i.image_url, FALSE, i.id FROM journal_images i
+                    WHERE i.journal_id = %s AND i.id IN ({', '.join(['%s'] * len(add_to_bot))})
+                    AND NOT EXISTS (SELECT 1 FROM journal_bot_images b WHERE b.source_image_id = i.id)""",
+                    (journal_id, *add_to_bot)
+                )
+                print(f"✅ Existing images added to bot: {cursor.rowcount}")
+            
+            # 🗑️ УДАЛЕНИЕ ИЗОБРАЖЕНИЙ (В ТРАНЗАКЦИИ - ТОЛЬКО СТРОКИ)
             if delete_images:
-                for image_id in delete_images:
+                await cursor.execute(
+                    f"""SELECT id, image_path, image_url FROM journal_images
+                    WHERE journal_id = %s AND id IN ({', '.join(['%s'] * len(delete_images))})""",
+                    (journal_id, *delete_images)
+                )
+                removed_images = await cursor.fetchall()
+                if removed_images:
+                    # Роли удаляемых изображений уходят вместе с ними
                     await cursor.execute(
-                        "SELECT image_path FROM journal_images WHERE id = %s AND journal_id = %s",
-                        (image_id, journal_id)
+                        f"""DELETE FROM journal_bot_images
+                        WHERE source_image_id IN ({', '.join(['%s'] * len(removed_images))})""",
+                        tuple(image['id'] for image in removed_images)
                     )
-                    image = await cursor.fetchone()
-                    if image:
-                        minio_service.delete_image(journal_id, image['image_path'])
-                        await cursor.execute(
-                            "DELETE FROM journal_images WHERE id = %s", (image_id,)
-                        )
-                        print(f"🗑️ Deleted image: {image_id}")
+                    await cursor.executemany(
+                        "DELETE FROM journal_images WHERE id = %s",
+                        [(image['id'],) for image in removed_images]
+                    )
+                    print(f"🗑️ Deleted images: {[image['id'] for image in removed_images]}")
             
             if delete_bot_images:
-                for image_id in delete_bot_images:
+                await cursor.execute(
+                    f"""SELECT id, image_url, source_image_id FROM journal_bot_images
+                    WHERE id IN ({', '.join(['%s'] * len(delete_bot_images))})""",
+                    tuple(delete_bot_images)
+                )
+                removed_bot_images = await cursor.fetchall()
+                if removed_bot_images:
+                    await cursor.executemany(
+                        "DELETE FROM journal_bot_images WHERE id = %s",
+                        [(image['id'],) for image in removed_bot_images]
+                    )
+                    print(f"🗑️ Deleted bot images: {[image['id'] for image in removed_bot_images]}")
+                
+                # Изображение только для бота без ролей больше никому не нужно - удаляем целиком
+                source_ids = [image['source_image_id'] for image in removed_bot_images if image['source_image_id']]
+                if source_ids:
                     await cursor.execute(
-                        "SELECT image_url FROM journal_bot_images WHERE id = %s",
-                        (image_id,)
+                        f"""SELECT i.id, i.image_path, i.image_url FROM journal_images i
+                        WHERE i.id IN ({', '.join(['%s'] * len(source_ids))}) AND NOT i.show_in_app
+                        AND NOT EXISTS (SELECT 1 FROM journal_bot_images b WHERE b.source_image_id = i.id)""",
+                        tuple(source_ids)
                     )
-                    image = await cursor.fetchone()
-                    if image:
-                        object_path = image['image_url'].split('fast_image_bot/')[1]
-                        minio_service.delete_bot_image(object_path)
-                        await cursor.execute(
-                            "DELETE FROM journal_bot_images WHERE id = %s",
-                            (image_id,)
+                    bot_only_images = await cursor.fetchall()
+                    if bot_only_images:
+                        await cursor.executemany(
+                            "DELETE FROM journal_images WHERE id = %s",
+                            [(image['id'],) for image in bot_only_images]
                         )
-                        print(f"🗑️ Deleted bot image: {image_id}")
+                        removed_images = [*removed_images, *bot_only_images]
+                        print(f"🗑️ Deleted bot-only images: {[image['id'] for image in bot_only_images]}")
+                
+                # Роль снята - объект остается у изображения журнала; удаляем только свои копии
+                removed_bot_images = [image for image in removed_bot_images if not image['source_image_id']]
             
             # ⭐ ГЛАВНЫЕ ИЗОБРАЖЕНИЯ
             if main_image:
@@ -341,17 +500,49 @@ async def edit_journal(
                     (main_bot_image, journal_id)
                 )
                 print(f"⭐ Set main bot image: {main_bot_image}")
+            
+            # 🔄 КАТАЛОГ ИЗМЕНИЛСЯ - СНИМКИ В БОТЕ И API ПЕРЕЗАГРУЗЯТСЯ
+            await db.bump_version('catalog', cursor)
         
-        return RedirectResponse(url="/journal/list", status_code=303)
-        
-    except HTTPException:
-        raise
-    
     except Exception as e:
+        # 🧹 КОМПЕНСАЦИЯ: ТРАНЗАКЦИЯ ОТКАЧЕНА - ЗАГРУЖЕННЫЕ ОБЪЕКТЫ НИКОМУ НЕ НУЖНЫ
+        await remove_uploaded_images(target_id, uploaded_images)
+        
+        if isinstance(e, HTTPException):
+            raise
         print(f"❌ Error updating journal: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error updating journal: {str(e)}")
+    
+    # 🗑️ ПОСЛЕ КОММИТА: УДАЛЯЕМ ОБЪЕКТЫ ИЗ MINIO (ПАРАЛЛЕЛЬНО)
+    await asyncio.gather(
+        *(
+            storage.run('delete_image', minio_service.delete_image, original_id, image['image_path'])
+            for image in removed_images
+        ),
+        *(
+            storage.run('delete_bot_image', minio_service.delete_bot_image, bot_object_path(image['image_url']))
+            for image in removed_bot_images
+        ),
+        *(
+            image_variants.delete(minio_service.client, minio_service.bucket_name, f"journal_{original_id}/{image['image_path']}")
+            for image in removed_images
+        ),
+        *(
+            image_variants.delete(minio_service.client, BOT_BUCKET, bot_object_path(image['image_url']))
+            for image in removed_bot_images
+        ),
+        *(telegram_file_cache.invalidate(image['image_url']) for image in (*removed_images, *removed_bot_images)),
+        return_exceptions=True
+    )
+    
+    # Заранее получаем file_id в Telegram (в фоне, вариант telegram - если построен)
+    for image in bot_role_images:
+        photo_url = telegram_photo_url(image['url']) if 'telegram' in image['variants'] else image['url']
+        telegram_file_cache.preupload_in_background(bot, photo_url, filename=image['original_filename'])
+    
+    return RedirectResponse(url="/journal/list", status_code=303)
         
         
 
@@ -369,6 +560,7 @@ async def delete_journal(
     
     try:
         await db.execute("DELETE FROM journals WHERE id = %s", (journal_id,))
+        await db.bump_version('catalog')
         return RedirectResponse(url="/journal/list", status_code=303)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting journal: {str(e)}")
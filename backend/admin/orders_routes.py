@@ -6,7 +6,8 @@ from typing import Optional, List
 from authentication.jwt_auth.decorators import jwt_required
 from backend.services.bot_notifications import send_delivery_update_notification, send_tracking_update_notification
 
-from backend.services.email_service import EmailService
+# Тот же модуль, что у bot_notifications: один экземпляр и один пул SMTP на процесс
+from services.email_service import email_service
 
 import logging
 
@@ -19,8 +20,6 @@ templates: Jinja2Templates = None
 bot = None
 db = None
 
-email_service = EmailService() 
-
 logger = logging.getLogger(__name__)
 
 
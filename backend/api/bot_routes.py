@@ -3,8 +3,16 @@ from flask import Blueprint, request, jsonify, current_app
 from database import db
 from utils.minio_client import minio_client
 
+from services.telegram_file_cache import telegram_file_cache
+from services.storage import HashingReader, UploadTooLarge, PART_SIZE
+from services.image_service import image_variants
+from services.catalog_snapshot import catalog
+from services.journal_views import journal_photo_url
+
 from authentication.jwt_auth.decorators import jwt_required
 
+from typing import Any, Dict, Optional
+
 import logging
 import os
 
@@ -15,6 +23,10 @@ bot_bp = Blueprint('bot', __name__)
 logger = logging.getLogger(__name__)
 
 
+# Предел размера изображения бота
+BOT_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+
+
 
 
 def run_async(coro):
@@ -27,11 +39,8 @@ def run_async(coro):
 def get_journal_bot_images(journal_id):
     """Возвращает быстрые URL для изображений бота"""
     try:
-        # Получаем пути изображений из БД ДЛЯ БОТА
-        images = run_async(db.fetch_all(
-            "SELECT image_url FROM journal_bot_images WHERE journal_id = %s ORDER BY is_main DESC, id",
-            (journal_id,)
-        ))
+        # Получаем пути изображений ДЛЯ БОТА из снимка каталога
+        images = run_async(catalog.get_bot_images(journal_id))
         
         if not images:
             return jsonify({"images": []})
@@ -40,7 +49,10 @@ def get_journal_bot_images(journal_id):
         for img in images:
             image_url = img['image_url']
             
-            if 'fast_image_bot/' in image_url:
+            if img.get('source_image_id'):
+                # Роль канонического изображения: тот же объект и варианты, что у мини-приложения
+                fast_urls.append(journal_photo_url(journal_id, img))
+            elif 'fast_image_bot/' in image_url:
                 # Уже правильный формат
                 fast_urls.append(image_url)
             else:
@@ -59,6 +71,61 @@ def get_journal_bot_images(journal_id):
     
     
     
+async def add_bot_role_image(journal_id, image_path: str, image_url: str) -> int:
+    """
+    Каноническое изображение журнала (только для бота - в мини-приложении
+    не показывается) и его роль в боте - одной транзакцией
+    """
+    async with db.transaction() as cursor:
+        await cursor.execute(
+            """INSERT INTO journal_images (journal_id, image_path, image_url, show_in_app)
+            VALUES (%s, %s, %s, FALSE)""",
+            (journal_id, image_path, image_url)
+        )
+        image_id = cursor.lastrowid
+        await cursor.execute(
+            """INSERT INTO journal_bot_images (journal_id, image_url, is_main, source_image_id)
+            VALUES (%s, %s, FALSE, %s)""",
+            (journal_id, image_url, image_id)
+        )
+        await db.bump_version('catalog', cursor)
+    return image_id
+
+
+
+async def remove_bot_role(image_id, source_image_id) -> Optional[Dict[str, Any]]:
+    """
+    Снимает роль в боте. Изображение только для бота, на которое больше
+    не ссылается ни одна роль, удаляется из БД - его строка возвращается,
+    чтобы удалить объект.
+    """
+    async with db.transaction() as cursor:
+        await cursor.execute("DELETE FROM journal_bot_images WHERE id = %s", (image_id,))
+        await cursor.execute(
+            """SELECT i.id, i.journal_id, i.image_path, i.image_url FROM journal_images i
+            WHERE i.id = %s AND NOT i.show_in_app
+            AND NOT EXISTS (SELECT 1 FROM journal_bot_images b WHERE b.source_image_id = i.id)""",
+            (source_image_id,)
+        )
+        source = await cursor.fetchone()
+        if source:
+            await cursor.execute("DELETE FROM journal_images WHERE id = %s", (source['id'],))
+        await db.bump_version('catalog', cursor)
+    return source
+
+
+
+def remove_uploaded_image(bucket: str, object_name: str):
+    """Удаляет из MinIO оригинал и варианты (компенсация или изображение без строк в БД)"""
+    try:
+        minio_client.remove_object(bucket, object_name)
+        print(f"🧹 Removed orphaned upload {bucket}/{object_name}")
+    except Exception as e:
+        print(f"⚠️ Orphaned object not removed: {bucket}/{object_name}: {e}")
+    image_variants.delete_blocking(minio_client, bucket, object_name)
+
+
+
 @bot_bp.route('/upload_bot_image', methods=['POST'])
 @jwt_required
 def upload_bot_image():
@@ -90,26 +157,39 @@ def upload_bot_image():
         
         object_name = f"journal_{journal_id}/{unique_filename}"
         
-        # Загружаем в MinIO
-        minio_client.put_object(
-            "journals-bot",
-            object_name,
-            image_file,
-            length=-1,
-            part_size=10*1024*1024,
-            content_type=image_file.content_type
-        )
+        # Одна каноническая копия в journals: бот и мини-приложение используют ее варианты.
+        # Загружаем в MinIO потоком: размер ограничивается и хэш считается по ходу чтения
+        reader = HashingReader(image_file.stream, max_size=BOT_IMAGE_MAX_SIZE)
+        try:
+            minio_client.put_object(
+                "journals",
+                object_name,
+                reader,
+                length=-1,
+                part_size=PART_SIZE,
+                content_type=image_file.content_type
+            )
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        print(f"📦 {reader.size} bytes, sha256 {reader.sha256}")
         
-        # Сохраняем URL в БД
-        image_url = f"https://dismally-familiar-sharksucker.cloudpub.ru/fast_image_bot/{object_name}"
+        # Варианты для бота и мини-приложения (в пуле процессов)
+        image_variants.create_blocking(minio_client, "journals", object_name, image_file.stream)
         
-        run_async(db.execute(
-            "INSERT INTO journal_bot_images (journal_id, image_url, is_main) VALUES (%s, %s, %s)",
-            (journal_id, image_url, False)
-        ))
+        # Сохраняем изображение журнала и его роль в боте
+        image_url = f"https://dismally-familiar-sharksucker.cloudpub.ru/minio_proxy/journals/{object_name}"
+        try:
+            image_id = run_async(add_bot_role_image(journal_id, unique_filename, image_url))
+        except Exception:
+            remove_uploaded_image("journals", object_name)
+            raise
         
         print(f"✅ Uploaded bot image: {image_url}")
-        return jsonify({"success": True, "image_url": image_url})
+        return jsonify({
+            "success": True,
+            "image_id": image_id,
+            "image_url": journal_photo_url(journal_id, {'image_url': image_url, 'source_image_id': image_id})
+        })
         
     except Exception as e:
         print(f"❌ Error uploading bot image: {e}")
@@ -149,6 +229,7 @@ def set_main_bot_image():
         )
         
         connection.commit()
+        run_async(db.bump_version('catalog'))
         return jsonify({"success": True})
             
     except Exception as e:
@@ -178,11 +259,19 @@ def delete_bot_image():
         
         # Получаем информацию об изображении
         image = run_async(db.fetch_one(
-            "SELECT image_url FROM journal_bot_images WHERE id = %s",
+            "SELECT image_url, source_image_id FROM journal_bot_images WHERE id = %s",
             (image_id,)
         ))
         
-        if image:
+        if image and image['source_image_id']:
+            # Роль канонического изображения: объект остается у journal_images,
+            # если только изображение не было загружено для одного бота
+            source = run_async(remove_bot_role(image_id, image['source_image_id']))
+            print(f"🗑️ Removed bot role of image {image['source_image_id']}")
+            if source:
+                remove_uploaded_image("journals", f"journal_{source['journal_id']}/{source['image_path']}")
+                run_async(telegram_file_cache.invalidate(source['image_url']))
+        elif image:
             # 🔥 ПРАВИЛЬНОЕ ИЗВЛЕЧЕНИЕ ПУТИ ИЗ URL
             image_url = image['image_url']
             if 'fast_image_bot/' in image_url:
@@ -205,6 +294,8 @@ def delete_bot_image():
                 "DELETE FROM journal_bot_images WHERE id = %s",
                 (image_id,)
             ))
+            run_async(telegram_file_cache.invalidate(image_url))
+            run_async(db.bump_version('catalog'))
         
         return jsonify({"success": True})
         
@@ -220,7 +311,7 @@ def get_bot_images_info(journal_id):
     """Получает полную информацию о изображениях бота"""
     try:
         images = run_async(db.fetch_all(
-            "SELECT id, image_url, is_main, created_at FROM journal_bot_images WHERE journal_id = %s ORDER BY is_main DESC, created_at DESC",
+            "SELECT id, image_url, is_main, source_image_id, created_at FROM journal_bot_images WHERE journal_id = %s ORDER BY is_main DESC, created_at DESC",
             (journal_id,)
         ))
         
@@ -236,23 +327,17 @@ def get_bot_images_info(journal_id):
 def get_main_bot_image(journal_id):
     """Получает главное изображение бота для журнала"""
     try:
-        image = run_async(db.fetch_one(
-            "SELECT image_url FROM journal_bot_images WHERE journal_id = %s AND is_main = TRUE",
-            (journal_id,)
-        ))
+        # Главное изображение идет первым, иначе - первое по id
+        images = run_async(catalog.get_bot_images(journal_id))
         
-        if image:
-            return jsonify({"main_image": image['image_url']})
+        if images:
+            main_image = images[0]
+            if main_image.get('source_image_id'):
+                # Роль канонического изображения - вариант telegram, как в остальных роутах бота
+                return jsonify({"main_image": journal_photo_url(journal_id, main_image)})
+            return jsonify({"main_image": main_image['image_url']})
         else:
-            # Если нет главного, возвращаем первое изображение
-            first_image = run_async(db.fetch_one(
-                "SELECT image_url FROM journal_bot_images WHERE journal_id = %s ORDER BY id LIMIT 1",
-                (journal_id,)
-            ))
-            if first_image:
-                return jsonify({"main_image": first_image['image_url']})
-            else:
-                return jsonify({"main_image": None})
+            return jsonify({"main_image": None})
                 
     except Exception as e:
         print(f"❌ Error getting main bot image: {e}")
@@ -5,6 +5,8 @@ from datetime import timedelta
 from database import db
 from utils.minio_client import minio_client
 
+from services.catalog_snapshot import catalog
+
 from authentication.jwt_auth.decorators import jwt_required
 
 import logging
@@ -46,14 +48,11 @@ def get_journal_images():
         if not journal_id:
             return jsonify({"error": "Journal ID is required"}), 400
         
-        # Получаем все изображения журнала из БД
-        images = run_async(db.fetch_all(
-            "SELECT image_url FROM journal_images WHERE journal_id = %s ORDER BY is_main DESC, id",
-            (journal_id,)
-        ))
+        # Получаем все изображения журнала из снимка каталога
+        images = run_async(catalog.get_journal_images(journal_id))
         
         response = jsonify({
-            'images': [img['image_url'] for img in images],
+            'images': images,
             'count': len(images)
         })
         
@@ -77,11 +76,8 @@ def get_journal():
         if not journal_id:
             return jsonify({"error": "Journal ID is required"}), 400
         
-        # Получаем все данные из БД
-        journal_data = run_async(db.fetch_one(
-            "SELECT id, title, year, description, price, quantity FROM journals WHERE id = %s", 
-            (journal_id,)
-        ))
+        # Получаем данные из снимка каталога (остаток - с коротким TTL)
+        journal_data = run_async(catalog.get_journal(journal_id))
         
         if not journal_data:
             return jsonify({"error": "Journal not found"}), 404
@@ -141,18 +137,14 @@ def get_presigned_url():
 def get_journal_images_presigned(journal_id):
     """Возвращает быстрые URL для обычных изображений журнала (для мини-приложения)"""
     try:
-        # Получаем пути изображений из БД
-        images = run_async(db.fetch_all(
-            "SELECT image_url FROM journal_images WHERE journal_id = %s ORDER BY is_main DESC, id",
-            (journal_id,)
-        ))
+        # Получаем пути изображений из снимка каталога
+        images = run_async(catalog.get_journal_images(journal_id))
         
         if not images:
             return jsonify({"images": []})
         
         fast_urls = []
-        for img in images:
-            image_url = img['image_url']
+        for image_url in images:
             
             # ПРЕОБРАЗУЕМ В БЫСТРЫЕ URL ДЛЯ ОБЫЧНЫХ ИЗОБРАЖЕНИЙ
             if 'minio_proxy/journals/' in image_url:
@@ -239,6 +231,7 @@ def fix_journal_images(journal_id):
             
             # 🔥 КОММИТИМ ТРАНЗАКЦИЮ
             connection.commit()
+            run_async(db.bump_version('catalog'))
             return jsonify({
                 "success": True, 
                 "updated": updated_count,
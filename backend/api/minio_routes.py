@@ -2,14 +2,20 @@ from flask import Blueprint, request, jsonify, Response, current_app, send_file
 
 from datetime import timedelta
 
+from minio.error import S3Error
+
 from utils.minio_client import minio_client
+from utils.metrics import registry, metrics_authorized
+
+from services.image_cache import image_cache, ObjectNotFound
+from services.image_service import pick_variant, variant_key
 
 from database import db
 
 import logging
 import requests
-import hashlib
 import os
+import time
 
 
 
@@ -20,9 +26,19 @@ logger = logging.getLogger(__name__)
 
 
 
-# Папка для кэша
-CACHE_DIR = "/tmp/minio_cache"
-os.makedirs(CACHE_DIR, exist_ok=True)
+variant_fallbacks = registry.counter("image_variant_fallbacks_total", "Запрошен вариант, которого нет - отдан оригинал")
+
+# Варианты, которых нет в MinIO (загружены до появления вариантов): ключ -> время проверки
+MISSING_VARIANT_TTL = 300
+missing_variants = {}
+
+
+# Бакет -> таймаут загрузки из MinIO при промахе кэша
+FETCH_TIMEOUTS = {
+    "journals": 10,
+    "journals-bot": 5,
+    "bot-content": 3,
+}
 
 
 
@@ -175,51 +191,117 @@ def image_proxy(image_path):
     
     
     
+
+def _guess_content_type(image_path: str, header_value: str = None) -> str:
+    """Content-Type из заголовков MinIO, fallback по расширению"""
+    if header_value and header_value.startswith('image/'):
+        return header_value
+    
+    if image_path.lower().endswith('.png'):
+        return 'image/png'
+    elif image_path.lower().endswith('.gif'):
+        return 'image/gif'
+    elif image_path.lower().endswith('.webp'):
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+
+def _fetch_from_minio(bucket: str, image_path: str):
+    """Загружает объект из MinIO по presigned URL (для кэша)"""
+    presigned_url = minio_client.presigned_get_object(
+        bucket,
+        image_path,
+        expires=timedelta(hours=24)
+    )
+    
+    response = requests.get(presigned_url, timeout=FETCH_TIMEOUTS.get(bucket, 10), stream=True)
+    print(f"📡 Minio response status: {response.status_code}")
+    
+    if response.status_code != 200:
+        response.close()
+        raise ObjectNotFound(f"{bucket}/{image_path}")
+    
+    def chunks():
+        with response:
+            yield from response.iter_content(chunk_size=65536)
+    
+    etag = (response.headers.get('ETag') or '').strip('"') or None
+    return chunks(), _guess_content_type(image_path, response.headers.get('Content-Type')), etag
+
+
+
+def _stat_minio(bucket: str, image_path: str):
+    """Текущий etag объекта в MinIO (для ревалидации кэша)"""
+    try:
+        return minio_client.stat_object(bucket, image_path).etag.strip('"')
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchObject'):
+            raise ObjectNotFound(f"{bucket}/{image_path}")
+        raise
+
+
+
+def requested_variant():
+    """Вариант изображения из ?size=thumb|card|full|telegram или ?w=<ширина>"""
+    return pick_variant(request.args.get('w', type=int), request.args.get('size'))
+
+
+
+def cached_entry(bucket: str, image_path: str, variant: str = None):
+    """
+    Запись дискового кэша для объекта или его варианта -> (ключ, запись).
+    Если запрошен вариант, а его нет (старая загрузка) - оригинал.
+    """
+    key = variant_key(image_path, variant) if variant else None
+    if key and time.time() - missing_variants.get((bucket, key), 0) > MISSING_VARIANT_TTL:
+        try:
+            return key, image_cache.get(bucket, key, _fetch_from_minio, _stat_minio)
+        except ObjectNotFound:
+            if len(missing_variants) > 10000:
+                missing_variants.clear()
+            missing_variants[(bucket, key)] = time.time()
+    if variant:
+        variant_fallbacks.inc(bucket=bucket, size=variant)
+    return image_path, image_cache.get(bucket, image_path, _fetch_from_minio, _stat_minio)
+
+
+
+def serve_cached_image(bucket: str, image_path: str, max_age: int = 86400, variant: str = None):
+    """
+    Отдает объект из дискового кэша (sendfile), при промахе - загружает из MinIO.
+    Если запрошен вариант, а его нет (старая загрузка) - отдается оригинал.
+    """
+    try:
+        for attempt in range(2):
+            key, entry = cached_entry(bucket, image_path, variant)
+            try:
+                response = send_file(entry.path, mimetype=entry.content_type, conditional=True, etag=entry.etag or True)
+                break
+            except FileNotFoundError:
+                # Папка кэша общая: файл мог вытеснить другой воркер - загружаем заново
+                image_cache.forget(bucket, key)
+                if attempt:
+                    raise
+    except ObjectNotFound:
+        return jsonify({"error": "Image not found"}), 404
+    except requests.exceptions.Timeout:
+        print(f"⏰ Timeout fetching image: {bucket}/{image_path}")
+        return jsonify({"error": "Timeout"}), 504
+    
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.headers['CDN-Cache-Control'] = f'public, max-age={max_age}'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+
 @minio_bp.route('/fast_image/<path:image_path>')
 def fast_image(image_path):
     """Ускоренный прокси для изображений журналов"""
     try:
         print(f"🚀 Fast image requested: {image_path}")
-        
-        # Генерируем presigned URL
-        presigned_url = minio_client.presigned_get_object(
-            "journals", 
-            image_path, 
-            expires=timedelta(hours=24) 
-        )
-        
-        # Скачиваем изображение с увеличенным таймаутом
-        response = requests.get(presigned_url, timeout=10, stream=True)
-        
-        if response.status_code == 200:
-            # ОПТИМИЗАЦИЯ: используем content-type из headers MinIO (как в fast_image_bot)
-            content_type = response.headers.get('Content-Type', 'image/jpeg')
-            
-            # Fallback по расширению только если не определился
-            if not content_type.startswith('image/'):
-                if image_path.lower().endswith('.png'):
-                    content_type = 'image/png'
-                elif image_path.lower().endswith('.gif'):
-                    content_type = 'image/gif'
-                else:
-                    content_type = 'image/jpeg'
-            
-            # Увеличиваем chunk size для большей скорости
-            return Response(
-                response.iter_content(chunk_size=32768),  # 32KB вместо 8KB
-                content_type=content_type,
-                headers={
-                    'Cache-Control': 'public, max-age=86400',
-                    'Access-Control-Allow-Origin': '*',
-                    'CDN-Cache-Control': 'public, max-age=86400'
-                }
-            )
-        else:
-            return jsonify({"error": "Image not found"}), 404
-            
-    except requests.exceptions.Timeout:
-        print(f"⏰ Timeout fetching image: {image_path}")
-        return jsonify({"error": "Timeout"}), 504
+        return serve_cached_image("journals", image_path, variant=requested_variant())
     except Exception as e:
         print(f"💥 Fast image error: {e}")
         return jsonify({"error": str(e)}), 500   
@@ -231,46 +313,7 @@ def fast_image_bot(image_path):
     """Супер-быстрый прокси для бота"""
     try:
         print(f"🚀 Fast BOT image requested: {image_path}")
-        
-        # Генерируем presigned URL
-        presigned_url = minio_client.presigned_get_object(
-            "journals-bot", 
-            image_path, 
-            expires=timedelta(hours=24)
-        )
-        
-        # Скачиваем изображение
-        response = requests.get(presigned_url, timeout=3, stream=True)
-        
-        print(f"📡 Minio response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            # Определяем content type
-            content_type = response.headers.get('Content-Type', 'image/jpeg')
-            if not content_type.startswith('image/'):
-                if image_path.lower().endswith('.png'):
-                    content_type = 'image/png'
-                elif image_path.lower().endswith(('.jpg', '.jpeg')):
-                    content_type = 'image/jpeg'
-                elif image_path.lower().endswith('.gif'):
-                    content_type = 'image/gif'
-                else:
-                    content_type = 'image/jpeg'
-            
-            # Возвращаем с агрессивным кэшированием
-            return Response(
-                response.iter_content(chunk_size=8192),
-                content_type=content_type,
-                headers={
-                    'Cache-Control': 'public, max-age=86400',
-                    'Access-Control-Allow-Origin': '*',
-                    'CDN-Cache-Control': 'public, max-age=86400'
-                }
-            )
-        else:
-            print(f"❌ Minio error: {response.text}")
-            return jsonify({"error": "Image not found"}), 404
-            
+        return serve_cached_image("journals-bot", image_path, variant=requested_variant())
     except Exception as e:
         print(f"💥 Fast BOT image error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -301,52 +344,14 @@ def list_objects_in_folder(folder_path):
     
     
     
+    
 
 @minio_bp.route('/fast_bot_content/<path:image_path>')
 def fast_bot_content(image_path):
     """Супер-быстрый прокси для контента бота (описание, контакты)"""
     try:
         print(f"🚀 Fast BOT CONTENT image requested: {image_path}")
-        
-        # Генерируем presigned URL для бакета bot-content
-        presigned_url = minio_client.presigned_get_object(
-            "bot-content", 
-            image_path, 
-            expires=timedelta(hours=24)
-        )
-        
-        # Скачиваем изображение
-        response = requests.get(presigned_url, timeout=3, stream=True)
-        
-        print(f"📡 Minio response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            # Определяем content type
-            content_type = response.headers.get('Content-Type', 'image/jpeg')
-            if not content_type.startswith('image/'):
-                if image_path.lower().endswith('.png'):
-                    content_type = 'image/png'
-                elif image_path.lower().endswith(('.jpg', '.jpeg')):
-                    content_type = 'image/jpeg'
-                elif image_path.lower().endswith('.gif'):
-                    content_type = 'image/gif'
-                else:
-                    content_type = 'image/jpeg'
-            
-            # Возвращаем с агрессивным кэшированием
-            return Response(
-                response.iter_content(chunk_size=8192),
-                content_type=content_type,
-                headers={
-                    'Cache-Control': 'public, max-age=86400',
-                    'Access-Control-Allow-Origin': '*',
-                    'CDN-Cache-Control': 'public, max-age=86400'
-                }
-            )
-        else:
-            print(f"❌ Minio error: {response.text}")
-            return jsonify({"error": "Image not found"}), 404
-            
+        return serve_cached_image("bot-content", image_path)
     except Exception as e:
         print(f"💥 Fast BOT CONTENT image error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -359,50 +364,16 @@ def fast_bot_journal(image_path):
     """Упрощенный быстрый прокси для журналов"""
     try:
         print(f"🚀 Fast BOT JOURNAL: {image_path}")
-        
-        # Генерируем presigned URL - БЕЗ КЭША НА ДИСКЕ
-        presigned_url = minio_client.presigned_get_object(
-            "journals-bot", 
-            image_path, 
-            expires=timedelta(hours=24)
-        )
-        
-        # Скачиваем изображение с коротким таймаутом
-        response = requests.get(presigned_url, timeout=5, stream=True)
-        
-        print(f"📡 Minio response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            # Определяем Content-Type по расширению (быстрее чем headers)
-            if image_path.lower().endswith('.png'):
-                content_type = 'image/png'
-            elif image_path.lower().endswith(('.jpg', '.jpeg')):
-                content_type = 'image/jpeg'
-            elif image_path.lower().endswith('.gif'):
-                content_type = 'image/gif'
-            else:
-                content_type = 'image/jpeg'
-            
-            # Возвращаем сразу без кэширования на диске
-            return Response(
-                response.iter_content(chunk_size=16384),
-                content_type=content_type,
-                headers={
-                    'Cache-Control': 'public, max-age=3600', 
-                    'Access-Control-Allow-Origin': '*'
-                }
-            )
-        else:
-            print(f"❌ Minio error: {response.status_code}")
-            return jsonify({"error": "Image not found"}), 404
-            
-    except requests.exceptions.Timeout:
-        print(f"⏰ Timeout fetching image: {image_path}")
-        return jsonify({"error": "Timeout"}), 504
+        return serve_cached_image("journals-bot", image_path, max_age=3600, variant=requested_variant())
     except Exception as e:
         print(f"💥 Fast BOT JOURNAL error: {e}")
         return jsonify({"error": str(e)}), 500
-    
-    
-    
-    
+
+
+
+@minio_bp.route('/metrics')
+def metrics():
+    """Метрики процесса (кэш изображений и т.д.) - по METRICS_TOKEN"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return Response("Not found", status=404, content_type='text/plain')
+    return Response(registry.render(), content_type='text/plain; version=0.0.4')
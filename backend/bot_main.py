@@ -5,17 +5,28 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.utils.keyboard import *
 from aiogram.types import *
 from aiogram import types, F
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from dotenv import load_dotenv
 
 from database import db 
 
+from services.telegram_file_cache import telegram_file_cache, cache_key_for_url
+from services.catalog_snapshot import catalog
+from services.journal_views import journal_views
+from services.bot_content_cache import bot_content_cache
+from services.bot_webhook import WebhookReceiver, start_updates
+from services.update_scheduler import setup_update_scheduler
+from services.fsm_storage import create_fsm_storage
+from utils.metrics import registry, metrics_authorized
+
 from pathlib import Path
 
 from fastapi.middleware.cors import CORSMiddleware
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 
 import aiohttp
 import os 
@@ -36,14 +47,30 @@ load_dotenv()
 app = FastAPI()
 
 
+# Свой адрес Bot API (локальный сервер или заглушка dev_tools/fake_bot_api.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
 bot = Bot(
     token=os.getenv('BOT_TOKEN'),
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
 )
 
-storage = MemoryStorage()
+# FSM: memory / mysql / redis (FSM_STORAGE)
+storage = create_fsm_storage(db)
 dp = Dispatcher(bot=bot, storage=storage)
 
+# Параллельная обработка апдейтов: общий лимит, порядок внутри чата, защита от двойных нажатий
+update_scheduler = setup_update_scheduler(dp)
+
+
+# Доставка апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # полный публичный URL, оканчивающийся на WEBHOOK_PATH
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+
+webhook_receiver = WebhookReceiver.from_env(dp, bot)
+
 
 logger = logging.getLogger(__name__)
 
@@ -72,6 +99,7 @@ async def on_startup():
     try:
         
         await db.connect(
+            service='bot',
             unix_socket=os.getenv('DB_UNIX_SOCKET'),
             user=os.getenv('DB_USER'),
             password=os.getenv('PASSWORD'),
@@ -84,9 +112,9 @@ async def on_startup():
         test_result = await db.fetch_one("SELECT 1")
         logger.info(f"Тест запроса к БД: {test_result}")
         
-        # Запуск бота в фоне
-        asyncio.create_task(dp.start_polling(bot))
-        logger.info("🤖 Бот запущен")
+        # Запуск бота: webhook, при ошибке или без настройки - polling в фоне
+        mode = await start_updates(dp, bot, BOT_MODE, WEBHOOK_URL, webhook_receiver.secret)
+        webhook_receiver.enabled = mode == 'webhook'
         
     except Exception as e:
         logger.critical(f"❌ Критическая ошибка подключения к БД: {e}")
@@ -95,6 +123,30 @@ async def on_startup():
     
     
 
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Апдейты Telegram в режиме webhook"""
+    return await webhook_receiver.handle(request)
+
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Метрики бота (очередь апдейтов, время хендлеров, кэши) - по METRICS_TOKEN"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return PlainTextResponse("Not found", status_code=404)
+    return PlainTextResponse(registry.render())
+
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await webhook_receiver.drain()
+    await storage.close()
+    
+    
+
+
 @dp.message(Command("start"))
 async def start(message: types.Message):
     if not message.text.startswith('/start payment_success_'):
@@ -127,25 +179,12 @@ async def show_journals(message: types.Message):
             await message.answer("⚠️ Нет подключения к БД")
             return
             
-        journals = await db.get_all_journals()
+        # Готовая клавиатура (пересобирается только при изменении каталога)
+        kb = await journal_views.journals_keyboard()
         
-        if not journals:
+        if kb is None:
             await message.answer("📭 Журналы временно отсутствуют")
             return
-
-        kb = types.InlineKeyboardMarkup(inline_keyboard=[])
-        
-        for journal in journals:
-            kb.inline_keyboard.append([
-                types.InlineKeyboardButton(
-                    text=f"{journal['title']} ({journal['year']}) - {journal['price']}₽",
-                    callback_data=f"journal_{journal['id']}"
-                )
-            ])
-        
-        kb.inline_keyboard.append([
-            types.InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main")
-        ])
         
         await message.answer(
             "📚 <b>Доступные выпуски:</b>",
@@ -166,94 +205,26 @@ async def handle_journal_selection(callback: types.CallbackQuery):
         await callback.answer("⏳ Загружаем журнал...")
         
         journal_id = int(callback.data.split("_")[1])
-        journal = await db.get_journal_by_id(journal_id)
+        card = await journal_views.card(journal_id)
         
-        if not journal:
+        if not card:
             await callback.message.answer("❌ Журнал не найден")
             return
 
-        # Получаем актуальное количество
-        quantity = journal.get('quantity', 0)
-        available_text = f"🛒 В наличии: {quantity} шт." if quantity > 0 else "❌ Нет в наличии"
-        
-        # Формируем сообщение
-        message_text = (
-            f"<b>{journal['title']}</b>\n"
-            f"Год: {journal['year']}\n"
-            f"Цена: {float(journal['price'])}₽\n"
-            f"{available_text}\n\n"
-        )
-        
-        # Создаем кнопки
-        kb = InlineKeyboardMarkup(inline_keyboard=[])
-        
-        if quantity > 0:
-            kb.inline_keyboard.append([
-                InlineKeyboardButton(
-                    text="🛒 Купить сейчас", 
-                    web_app=WebAppInfo(
-                        url=f"https://tottotdanetot.github.io/iglaboq/frontend/templates/miniapp/shop.html?"
-                        f"journal={journal_id}&"
-                        f"title={urllib.parse.quote(journal.get('title', ''))}&"
-                        f"year={journal.get('year', '')}&"
-                        f"price={journal.get('price', '')}&"
-                        f"description={urllib.parse.quote(journal.get('description', ''))}&"
-                        f"quantity={quantity}&"
-                        f"v={int(time.time())}"
-                    )
-                )
-            ])
-        
-        kb.inline_keyboard.append([
-            InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_journals")
-        ])
-        
-        # Получаем изображения для бота из API
-        photo_url = None
-        try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-                async with session.get(f'https://dismally-familiar-sharksucker.cloudpub.ru/get_journal_bot_images/{journal_id}') as response:
-                    if response.status == 200:
-                        response_text = await response.text()
-                        
-                        try:
-                            # Пытаемся распарсить JSON
-                            if isinstance(response_text, str):
-                                bot_images_data = json.loads(response_text)
-                            else:
-                                bot_images_data = response_text
-                            
-                            if isinstance(bot_images_data, dict):
-                                bot_images = bot_images_data.get('images', [])
-                            else:
-                                bot_images = []
-                                
-                        except json.JSONDecodeError:
-                            bot_images = []
-                        
-                        if bot_images:
-                            # Ищем главное изображение или берем первое
-                            if isinstance(bot_images[0], dict):
-                                main_image = next((img for img in bot_images if img.get('is_main')), bot_images[0])
-                                # ИСПОЛЬЗУЕМ РОУТ ДЛЯ ЖУРНАЛОВ С КЭШЕМ!
-                                image_filename = main_image['image_url'].split('/')[-1]
-                                photo_url = f'https://dismally-familiar-sharksucker.cloudpub.ru/fast_bot_journal/journal_{journal_id}/{image_filename}'
-                            else:
-                                # ИСПОЛЬЗУЕМ РОУТ ДЛЯ ЖУРНАЛОВ С КЭШЕМ!
-                                image_filename = bot_images[0].split('/')[-1]
-                                photo_url = f'https://dismally-familiar-sharksucker.cloudpub.ru/fast_bot_journal/journal_{journal_id}/{image_filename}'
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении изображений бота: {str(e)}")
+        # Готовая карточка + актуальное количество
+        quantity = await catalog.get_stock(journal_id)
+        message_text, kb = card.render(quantity)
+        photo_url = card.photo_url
         
         # Пытаемся отправить с фото - ИСПОЛЬЗУЕМ ПРЯМОЙ URL К НОВОМУ РОУТУ
         if photo_url:
             try:
                 logger.info(f"🚀 Trying to send photo with cached URL: {photo_url}")
                 
-                # ОТПРАВЛЯЕМ ПРЯМО ПО URL К НОВОМУ КЭШИРУЮЩЕМУ РОУТУ
-                await callback.message.answer_photo(
-                    photo=photo_url,  # ← URL к кэшированному роуту!
+                # ОТПРАВЛЯЕМ ПО file_id (ИЛИ ПО URL ПРИ ПЕРВОЙ ОТПРАВКЕ)
+                await telegram_file_cache.answer_photo(
+                    callback.message,
+                    photo_url,
                     caption=message_text,
                     reply_markup=kb,
                     parse_mode="HTML"
@@ -272,12 +243,13 @@ async def handle_journal_selection(callback: types.CallbackQuery):
                             if resp.status == 200:
                                 image_data = await resp.read()
                                 
-                                await callback.message.answer_photo(
+                                sent = await callback.message.answer_photo(
                                     photo=types.BufferedInputFile(image_data, filename="journal.jpg"),
                                     caption=message_text,
                                     reply_markup=kb,
                                     parse_mode="HTML"
                                 )
+                                await telegram_file_cache.remember(cache_key_for_url(photo_url), sent)
                                 logger.info("✅ Photo sent via fallback method")
                                 return
                             else:
@@ -324,8 +296,9 @@ async def show_description(message: types.Message):
         if content_data['images']:
             main_image = next((img for img in content_data['images'] if img['is_main']), content_data['images'][0])
             
-            await message.answer_photo(
-                photo=main_image['image_url'],
+            await telegram_file_cache.answer_photo(
+                message,
+                main_image['image_url'],
                 caption=content_data['content']['text_content'] or "Описание журнала",
                 parse_mode="HTML"
             )
@@ -362,8 +335,9 @@ async def show_contacts(message: types.Message):
         if content_data['images']:
             main_image = next((img for img in content_data['images'] if img['is_main']), content_data['images'][0])
             
-            await message.answer_photo(
-                photo=main_image['image_url'],
+            await telegram_file_cache.answer_photo(
+                message,
+                main_image['image_url'],
                 caption=content_data['content']['text_content'] or "Наши контакты",
                 reply_markup=kb,
                 parse_mode="HTML"
@@ -381,34 +355,9 @@ async def show_contacts(message: types.Message):
 
 
 async def get_bot_content(content_type: str):
-    """Получить контент из базы"""
+    """Получить контент (из кэша в памяти, перечитывается после правок в админке)"""
     try:
-        content = await db.fetch_one(
-            "SELECT * FROM bot_content WHERE content_type = %s",
-            (content_type,)
-        )
-        
-        if not content:
-            return None
-        
-        images = await db.fetch_all(
-            "SELECT * FROM bot_images WHERE content_id = %s ORDER BY is_main DESC, id",
-            (content['id'],)
-        )
-        
-        buttons = []
-        if content_type == 'contacts':
-            buttons = await db.fetch_all(
-                "SELECT * FROM bot_buttons WHERE content_id = %s ORDER BY position",
-                (content['id'],)
-            )
-        
-        return {
-            "content": content,
-            "images": images,
-            "buttons": buttons
-        }
-        
+        return await bot_content_cache.get(content_type)
     except Exception as e:
         print(f"Error getting bot content: {e}")
         return None
@@ -458,5 +407,5 @@ async def back_to_main(callback: types.CallbackQuery):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    uvicorn.run(app, host=os.getenv('BOT_HOST', '127.0.0.1'), port=int(os.getenv('BOT_PORT', '8000')))
 
@@ -11,6 +11,8 @@ from aiogram.client.default import DefaultBotProperties
 
 from dotenv import load_dotenv
 
+from utils.db_pool import InstrumentedPool, PoolSettings
+
 
 
 load_dotenv()
@@ -20,28 +22,57 @@ load_dotenv()
 
 class Database:
     def __init__(self):
-        self.pool: Optional[aiomysql.Pool] = None
+        self.pool: Optional[InstrumentedPool] = None
+        self.pools: Dict[str, InstrumentedPool] = {}
         self.logger = logging.getLogger(__name__)
         
 
-    async def connect(self, **kwargs):
+    async def connect(self, service: Optional[str] = None, **kwargs):
+        """
+        Создает пул сервиса. Размеры/recycle - из DB_POOL_<SERVICE>_* / DB_POOL_*,
+        значения по умолчанию можно передать: minsize, maxsize, autocommit.
+        """
         try:
-            self.pool = await aiomysql.create_pool(
-                unix_socket=os.getenv('DB_UNIX_SOCKET'),
-                user=os.getenv('DB_USER'),
-                password=os.getenv('PASSWORD'),
-                db=os.getenv('DB_NAME'),
-                port=int(os.getenv('DB_PORT')),
-                autocommit=True,
-                minsize=1,
-                maxsize=5
-            )
+            self.pool = await self._create_pool(service or 'default', service, kwargs)
             self.logger.info("✅ Пул соединений с БД создан")
         except Exception as e:
             self.logger.error(f"❌ Ошибка подключения: {e}")
             raise
     
     
+    async def add_pool(self, name: str, **kwargs) -> InstrumentedPool:
+        """
+        Дополнительный именованный пул со своими лимитами и очередью
+        (DB_POOL_<NAME>_*), например checkout / webhook: нагрузка на один
+        не забирает соединения у другого.
+        """
+        self.pools[name] = await self._create_pool(name, name, kwargs)
+        return self.pools[name]
+    
+    
+    def get_pool(self, name: str) -> InstrumentedPool:
+        """Именованный пул (или основной, если такой не создан)"""
+        return self.pools.get(name, self.pool)
+    
+    
+    async def _create_pool(self, name: str, env_name: Optional[str], kwargs) -> InstrumentedPool:
+        defaults = {
+            k: kwargs[k]
+            for k in ('minsize', 'maxsize', 'autocommit', 'acquire_timeout', 'max_waiters')
+            if k in kwargs
+        }
+        return await InstrumentedPool.create(
+            name,
+            PoolSettings.from_env(env_name, **defaults),
+            unix_socket=os.getenv('DB_UNIX_SOCKET'),
+            host=os.getenv('DB_HOST', 'localhost'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('PASSWORD'),
+            db=os.getenv('DB_NAME'),
+            port=int(os.getenv('DB_PORT'))
+        )
+    
+    
     def transaction(self):
         """Контекстный менеджер для транзакций"""
         return DatabaseTransaction(self)
@@ -112,6 +143,30 @@ class Database:
         
     
     
+    ######### VERSIONS ##########
+    async def get_version(self, name: str) -> int:
+        """Текущая версия (0 если еще ни разу не менялась)"""
+        row = await self.fetch_one(
+            "SELECT version FROM content_versions WHERE name = %s",
+            (name,)
+        )
+        return int(row['version']) if row else 0
+
+
+
+    async def bump_version(self, name: str, cursor=None):
+        """Увеличивает версию; с cursor - внутри текущей транзакции"""
+        query = """
+            INSERT INTO content_versions (name, version) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """
+        if cursor is not None:
+            await cursor.execute(query, (name,))
+        else:
+            await self.execute(query, (name,))
+        
+    
+    
     async def update_order_status(self, order_id: str, status: str, payment_id: str = None):
         """Обновляет статус заказа"""
         query = """
@@ -259,9 +314,11 @@ class Database:
                   
 
     async def close(self):
-        if self.pool:
-            self.pool.close()
-            await self.pool.wait_closed()
+        for pool in [*self.pools.values(), self.pool]:
+            if pool:
+                pool.close()
+                await pool.wait_closed()
+        self.pools = {}
 
 
 
@@ -299,6 +356,12 @@ class DatabaseTransaction:
             if self.cursor:
                 await self.cursor.close()
             if self.conn:
+                # Возвращаем режим пула, иначе следующий db.execute на этом соединении не закоммитится
+                if self.db.pool.settings.autocommit:
+                    try:
+                        await self.conn.autocommit(True)
+                    except Exception:
+                        self.conn.close()
                 await self.db.pool.release(self.conn)
                 
                 
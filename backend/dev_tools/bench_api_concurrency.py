@@ -0,0 +1,79 @@
+"""
+Нагрузочный тест публичного API (start_api.py).
+
+Сравнение режимов:
+    API_LOOP_MODE=legacy   python backend/start_api.py
+    API_LOOP_MODE=threaded python backend/start_api.py
+
+    python backend/dev_tools/bench_api_concurrency.py --url "http://localhost:5007/get_journal?id=1" -c 50 -n 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+
+
+async def worker(session, url, counter, latencies, errors):
+    while True:
+        if counter['left'] <= 0:
+            return
+        counter['left'] -= 1
+
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                    continue
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+
+async def run_benchmark(url: str, concurrency: int, total: int, timeout: float):
+    counter = {'left': total}
+    latencies = []
+    errors = []
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(session, url, counter, latencies, errors)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"📊 URL: {url}")
+    print(f"   Конкурентность: {concurrency}, запросов: {total}")
+    print(f"   Время: {elapsed:.2f}s, успешных: {len(latencies)}, ошибок: {len(errors)}")
+    print(f"   Requests/sec: {len(latencies) / elapsed:.1f}")
+
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"   Latency p50: {statistics.median(latencies) * 1000:.1f}ms, p99: {p99 * 1000:.1f}ms")
+
+    if errors:
+        print(f"   Примеры ошибок: {errors[:5]}")
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrency benchmark for the public API")
+    parser.add_argument('--url', default='http://localhost:5007/get_journal?id=1')
+    parser.add_argument('-c', '--concurrency', type=int, default=50)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.url, args.concurrency, args.requests, args.timeout))
@@ -0,0 +1,71 @@
+"""
+Задержка операций FSM для выбранного хранилища (FSM_STORAGE=memory|mysql|redis).
+
+Имитирует типичный диалог: get_state + get_data на каждый апдейт,
+set_state/set_data на каждом шаге, для множества пользователей.
+
+    cd backend && FSM_STORAGE=mysql python dev_tools/bench_fsm_storage.py -n 5000 --users 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+
+from services.fsm_storage import create_fsm_storage
+
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * q) - 1)]
+
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="FSM storage latency")
+    parser.add_argument('-n', type=int, default=5000, help="шагов диалога")
+    parser.add_argument('--users', type=int, default=200)
+    args = parser.parse_args()
+
+    db = None
+    if os.getenv('FSM_STORAGE', 'memory').lower() == 'mysql':
+        from database import db
+        await db.connect()
+
+    storage = create_fsm_storage(db)
+    reads, writes = [], []
+
+    for step in range(args.n):
+        user_id = 100000 + step % args.users
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+        started = time.perf_counter()
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        reads.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await storage.set_state(key, f"Checkout:step{step % 4}")
+        await storage.set_data(key, {**data, 'step': step})
+        writes.append(time.perf_counter() - started)
+
+    await storage.close()
+
+    print(f"storage: {type(storage).__name__}, {args.n} steps, {args.users} users")
+    for name, values in (('read', reads), ('write', writes)):
+        print(f"{name:<6} p50={statistics.median(values) * 1e6:8.1f} us  "
+              f"p99={percentile(values, 0.99) * 1e6:8.1f} us")
+
+    if db is not None:
+        await db.close()
+
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Сравнение отправки email: соединение на каждое письмо (как было) и пул SmtpConnectionPool.
+
+Поднимает локальный SMTP сервер на aiosmtpd (pip install aiosmtpd) с
+искусственной задержкой рукопожатия, отправляет N писем и выводит
+писем/с, число соединений и максимальную задержку event loop
+(насколько отправка блокирует остальные корутины сервиса).
+
+    cd backend && python dev_tools/bench_smtp.py -n 200 --handshake 0.05
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiosmtpd.controller import Controller
+
+from services.smtp_pool import SmtpConnectionPool
+
+
+
+class SinkHandler:
+    def __init__(self, handshake_delay: float):
+        self.handshake_delay = handshake_delay
+        self.messages = 0
+        self.sessions = 0
+
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        # Имитация сетевой задержки TLS/LOGIN реального сервера
+        self.sessions += 1
+        await asyncio.sleep(self.handshake_delay)
+        session.host_name = hostname
+        return responses
+
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return '250 OK'
+
+
+
+def build_message(i: int) -> str:
+    return f"From: shop@example.com\r\nTo: user{i}@example.com\r\nSubject: Order {i}\r\n\r\nTest message {i}\r\n"
+
+
+
+async def loop_lag_probe(stop: asyncio.Event, result: dict):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        result['max_lag'] = max(result['max_lag'], time.perf_counter() - started - 0.01)
+
+
+
+async def run_legacy(host, port, total):
+    """Старое поведение: блокирующий smtplib прямо в корутине, новое соединение на письмо"""
+    for i in range(total):
+        with smtplib.SMTP(host, port, timeout=10) as server:
+            server.ehlo()
+            server.sendmail("shop@example.com", f"user{i}@example.com", build_message(i))
+        await asyncio.sleep(0)
+
+
+
+async def run_pooled(host, port, total, size, batch):
+    pool = SmtpConnectionPool(host, port, None, None, use_tls=False, size=size)
+    try:
+        if batch:
+            await pool.send_many([
+                ("shop@example.com", f"user{i}@example.com", build_message(i)) for i in range(total)
+            ])
+        else:
+            await asyncio.gather(*(
+                pool.send("shop@example.com", f"user{i}@example.com", build_message(i)) for i in range(total)
+            ))
+    finally:
+        pool.close()
+
+
+
+async def measure(name, handler, coro):
+    handler.messages = handler.sessions = 0
+    stop = asyncio.Event()
+    lag = {'max_lag': 0.0}
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+
+    started = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    print(f"{name:<22} {handler.messages / elapsed:8.1f} msg/s  "
+          f"connections={handler.sessions:<5} max loop lag={lag['max_lag'] * 1000:7.1f} ms")
+
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SMTP delivery benchmark")
+    parser.add_argument('-n', type=int, default=200, help="писем")
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--handshake', type=float, default=0.05, help="задержка EHLO, секунды")
+    args = parser.parse_args()
+
+    handler = SinkHandler(args.handshake)
+    controller = Controller(handler, hostname='127.0.0.1', port=8025)
+    controller.start()
+    try:
+        await measure("per-message connect", handler, run_legacy('127.0.0.1', 8025, args.n))
+        await measure("pool, concurrent send", handler, run_pooled('127.0.0.1', 8025, args.n, args.pool_size, False))
+        await measure("pool, send_many", handler, run_pooled('127.0.0.1', 8025, args.n, args.pool_size, True))
+    finally:
+        controller.stop()
+
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+Заглушка Telegram Bot API для офлайн-замера пропускной способности бота.
+
+Отдает N сгенерированных апдейтов (по умолчанию "/start" от разных чатов)
+через getUpdates (polling) или отправляет их POST-ом на webhook, который бот
+регистрирует через setWebhook. Ответы бота (sendMessage/sendPhoto) считаются,
+по ним считаются апдейты/с и задержка от доставки апдейта до ответа.
+
+    python backend/dev_tools/fake_bot_api.py --port 8081 -n 2000 --chats 200
+
+    # polling
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:abc python backend/bot_main.py
+
+    # webhook
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:abc BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8000/telegram/webhook WEBHOOK_SECRET=s3cret \\
+        python backend/bot_main.py
+"""
+import argparse
+import asyncio
+import collections
+import json
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+
+class FakeBotApi:
+    def __init__(self, total: int, chats: int, text: str, concurrency: int):
+        self.total = total
+        self.chats = chats
+        self.text = text
+        self.concurrency = concurrency
+
+        self.updates = [self._make_update(i) for i in range(total)]
+        self.next_offset = 0
+        self.new_updates = asyncio.Event()
+
+        self.delivered = collections.defaultdict(collections.deque)  # chat_id -> время доставки
+        self.latencies = []
+        self.replies = 0
+        self.started = None
+        self.finished = asyncio.Event()
+        self.message_id = 0
+        self.methods = collections.Counter()
+
+
+    def _make_update(self, i: int) -> dict:
+        chat_id = 100000 + i % self.chats
+        return {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                "text": self.text
+            }
+        }
+
+
+    def _mark_delivered(self, batch):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        for update in batch:
+            self.delivered[update['message']['chat']['id']].append(now)
+
+
+    def _message(self, chat_id, **extra) -> dict:
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **extra
+        }
+
+
+    def _record_reply(self, chat_id):
+        queue = self.delivered.get(int(chat_id))
+        if queue:
+            self.latencies.append(time.perf_counter() - queue.popleft())
+        self.replies += 1
+        if self.replies >= self.total:
+            self.finished.set()
+
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.methods[method] += 1
+
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        result = True
+        if method == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method == 'setWebhook':
+            asyncio.create_task(self._push_webhook(params['url'], params.get('secret_token')))
+        elif method == 'sendMessage':
+            result = self._message(params['chat_id'], text=params.get('text', ''))
+            self._record_reply(params['chat_id'])
+        elif method == 'sendPhoto':
+            result = self._message(params['chat_id'], photo=[{
+                "file_id": f"fake-{self.message_id}", "file_unique_id": f"u{self.message_id}",
+                "width": 1, "height": 1
+            }])
+            self._record_reply(params['chat_id'])
+
+        return web.json_response({"ok": True, "result": result})
+
+
+    async def _get_updates(self, params) -> list:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        if offset:
+            self.next_offset = max(self.next_offset, offset - 1)
+        pending = self.updates[self.next_offset:self.next_offset + limit]
+        if not pending and timeout:
+            try:
+                await asyncio.wait_for(self.finished.wait(), timeout=min(timeout, 1))
+            except asyncio.TimeoutError:
+                pass
+            return []
+
+        self._mark_delivered(pending)
+        return pending
+
+
+    async def _push_webhook(self, url: str, secret):
+        await asyncio.sleep(0.5)  # бот заканчивает startup
+        headers = {'Content-Type': 'application/json'}
+        if secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+        queue = asyncio.Queue()
+        for update in self.updates:
+            queue.put_nowait(update)
+
+        async def sender(session):
+            while not queue.empty():
+                update = queue.get_nowait()
+                self._mark_delivered([update])
+                try:
+                    async with session.post(url, data=json.dumps(update), headers=headers) as response:
+                        if response.status != 200:
+                            print(f"webhook answered {response.status}")
+                except aiohttp.ClientError as e:
+                    print(f"webhook error: {e}")
+
+        # Как Telegram: не больше max_connections одновременных запросов
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency)) as session:
+            await asyncio.gather(*(sender(session) for _ in range(self.concurrency)))
+
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"updates:     {self.total} from {self.chats} chats")
+        print(f"replies:     {self.replies} in {elapsed:.2f}s ({self.replies / elapsed:.1f}/s)")
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            print(f"latency p50: {statistics.median(ordered) * 1000:.1f} ms")
+            print(f"latency p99: {ordered[int(len(ordered) * 0.99) - 1] * 1000:.1f} ms")
+        print(f"methods:     {dict(self.methods)}")
+
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('-n', type=int, default=1000, help="апдейтов")
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--text', default="/start")
+    parser.add_argument('--concurrency', type=int, default=40, help="одновременных запросов к webhook")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.n, args.chats, args.text, args.concurrency)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', api.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+    print(f"Fake Bot API on http://127.0.0.1:{args.port}, waiting for the bot...")
+
+    await api.finished.wait()
+    api.report()
+    await runner.cleanup()
+
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Минимальный Redis-совместимый сервер (RESP2) для локальной проверки FSM_STORAGE=redis.
+
+Поддерживает команды, которых достаточно aiogram RedisStorage:
+PING, GET, SET (EX/PX/NX/XX), DEL, EXISTS, EXPIRE, TTL, FLUSHDB, SELECT.
+
+    python backend/dev_tools/fake_redis.py --port 6380
+    FSM_STORAGE=redis REDIS_URL=redis://127.0.0.1:6380/0 python backend/dev_tools/bench_fsm_storage.py
+"""
+import argparse
+import asyncio
+import time
+
+
+
+store = {}     # key -> value (bytes)
+expires = {}   # key -> monotonic deadline
+
+
+
+def _alive(key) -> bool:
+    deadline = expires.get(key)
+    if deadline is not None and time.monotonic() >= deadline:
+        store.pop(key, None)
+        expires.pop(key, None)
+    return key in store
+
+
+
+def _bulk(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+
+def _int(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+
+def execute(args) -> bytes:
+    command = args[0].upper()
+
+    if command == b"PING":
+        return b"+PONG\r\n"
+
+    if command == b"GET":
+        return _bulk(store.get(args[1]) if _alive(args[1]) else None)
+
+    if command == b"SET":
+        key, value = args[1], args[2]
+        ttl = None
+        options = [a.upper() for a in args[3:]]
+        if b"NX" in options and _alive(key):
+            return _bulk(None)
+        if b"XX" in options and not _alive(key):
+            return _bulk(None)
+        for i, option in enumerate(options):
+            if option == b"EX":
+                ttl = float(args[3 + i + 1])
+            elif option == b"PX":
+                ttl = float(args[3 + i + 1]) / 1000
+        store[key] = value
+        if ttl:
+            expires[key] = time.monotonic() + ttl
+        else:
+            expires.pop(key, None)
+        return b"+OK\r\n"
+
+    if command == b"DEL":
+        removed = 0
+        for key in args[1:]:
+            if _alive(key):
+                removed += 1
+            store.pop(key, None)
+            expires.pop(key, None)
+        return _int(removed)
+
+    if command == b"EXISTS":
+        return _int(sum(1 for key in args[1:] if _alive(key)))
+
+    if command == b"EXPIRE":
+        if not _alive(args[1]):
+            return _int(0)
+        expires[args[1]] = time.monotonic() + float(args[2])
+        return _int(1)
+
+    if command == b"TTL":
+        if not _alive(args[1]):
+            return _int(-2)
+        deadline = expires.get(args[1])
+        return _int(-1 if deadline is None else int(deadline - time.monotonic()))
+
+    if command == b"FLUSHDB":
+        store.clear()
+        expires.clear()
+        return b"+OK\r\n"
+
+    if command in (b"SELECT", b"CLIENT"):
+        return b"+OK\r\n"
+
+    return b"-ERR unknown command '%s'\r\n" % command
+
+
+
+async def read_command(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.strip().split()  # inline команда (redis-cli/telnet)
+
+    count = int(line[1:])
+    args = []
+    for _ in range(count):
+        header = await reader.readline()
+        length = int(header[1:])
+        data = await reader.readexactly(length + 2)
+        args.append(data[:-2])
+    return args
+
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            writer.write(execute(args))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake Redis (RESP2) server")
+    parser.add_argument('--port', type=int, default=6380)
+    args = parser.parse_args()
+
+    server = await asyncio.start_server(handle_client, '127.0.0.1', args.port)
+    print(f"Fake Redis on redis://127.0.0.1:{args.port}/0")
+    async with server:
+        await server.serve_forever()
+
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
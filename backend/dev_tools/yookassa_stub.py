@@ -0,0 +1,141 @@
+"""
+Локальная заглушка API ЮKassa для проверки платежного сервиса без сети.
+
+    python backend/dev_tools/yookassa_stub.py --port 8085 --latency 0.05 --fail-rate 0.1
+    YOOKASSA_API_URL=http://localhost:8085/v3 python backend/payment_handler.py
+
+Поддерживает POST /v3/payments, POST /v3/payments/{id}/capture и
+GET /v3/payments/{id}. Ответы кэшируются по Idempotence-Key, как в
+настоящем API. GET /stats показывает число запросов и новых TCP
+соединений (при keep-alive соединений должно быть намного меньше).
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+from aiohttp import web
+
+
+
+payments = {}
+idempotency = {}
+stats = {'requests': 0, 'connections': 0, 'failures': 0, 'replays': 0}
+seen_transports = set()
+
+
+
+def make_app(latency: float, fail_rate: float, two_stage: bool) -> web.Application:
+
+    @web.middleware
+    async def simulate(request, handler):
+        stats['requests'] += 1
+        transport = id(request.transport)
+        if transport not in seen_transports:
+            seen_transports.add(transport)
+            stats['connections'] += 1
+
+        if request.path.startswith('/v3/'):
+            if latency:
+                await asyncio.sleep(latency)
+            if fail_rate and random.random() < fail_rate:
+                stats['failures'] += 1
+                return web.json_response({"type": "error", "code": "internal_server_error"}, status=503)
+
+            key = request.headers.get('Idempotence-Key')
+            if request.method == 'POST':
+                if not key:
+                    return web.json_response({"type": "error", "code": "invalid_request",
+                                              "description": "Idempotence-Key header is required"}, status=400)
+                cache_key = (request.path, key)
+                if cache_key in idempotency:
+                    stats['replays'] += 1
+                    return web.Response(text=idempotency[cache_key], content_type='application/json')
+                response = await handler(request)
+                if response.status < 400:
+                    idempotency[cache_key] = response.text
+                return response
+
+        return await handler(request)
+
+
+    async def create(request):
+        data = await request.json()
+        payment_id = str(uuid.uuid4())
+        payments[payment_id] = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": data.get("amount"),
+            "metadata": data.get("metadata", {}),
+            "description": data.get("description"),
+            "confirmation": {
+                "type": "redirect",
+                "confirmation_url": f"http://localhost/checkout/{payment_id}"
+            },
+            "_two_stage": two_stage or not data.get("capture", False)
+        }
+        return web.json_response(_public(payments[payment_id]))
+
+
+    async def capture(request):
+        payment_id = request.match_info['payment_id']
+        payment = payments.get(payment_id)
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        payment["status"] = "succeeded"
+        payment["paid"] = True
+        return web.json_response(_public(payment))
+
+
+    async def get(request):
+        payment = payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(_public(payment))
+
+
+    async def pay(request):
+        """Имитация оплаты пользователем: pending -> waiting_for_capture/succeeded"""
+        payment = payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({"error": "not found"}, status=404)
+        payment["status"] = "waiting_for_capture" if payment["_two_stage"] else "succeeded"
+        payment["paid"] = True
+        return web.json_response({"type": "notification", "event": f"payment.{payment['status']}",
+                                  "object": _public(payment)})
+
+
+    async def get_stats(request):
+        return web.json_response({**stats, "payments": len(payments)})
+
+
+    app = web.Application(middlewares=[simulate])
+    app.router.add_post('/v3/payments', create)
+    app.router.add_post('/v3/payments/{payment_id}/capture', capture)
+    app.router.add_get('/v3/payments/{payment_id}', get)
+    app.router.add_post('/pay/{payment_id}', pay)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+
+def _public(payment: dict) -> dict:
+    return {k: v for k, v in payment.items() if not k.startswith('_')}
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YooKassa API stub")
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="доля ответов 503 (проверка повторов)")
+    parser.add_argument('--two-stage', action='store_true', help="платежи всегда ждут capture")
+    args = parser.parse_args()
+
+    web.run_app(make_app(args.latency, args.fail_rate, args.two_stage), port=args.port)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
 
 from pydantic import BaseModel
 
@@ -36,7 +36,7 @@ from bot_main import bot
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting up...")
-    await db.connect()
+    await db.connect(service='admin')
     print("✅ Database connected")
     
     # ⭐⭐⭐ УСТАНАВЛИВАЕМ DB ДЛЯ ВСЕХ МОДУЛЕЙ ⭐⭐⭐
@@ -54,6 +54,7 @@ async def lifespan(app: FastAPI):
     
     from admin import journal_routes  
     journal_routes.db = db
+    journal_routes.bot = bot
     
     from admin import orders_routes
     orders_routes.db = db
@@ -61,13 +62,21 @@ async def lifespan(app: FastAPI):
     
     from admin import bot_routes
     bot_routes.db = db
+    bot_routes.bot = bot
     
     from backend.services import bot_notifications
     bot_notifications.db = db
     
-    from backend.services import email_service
+    # Лимит токена бота общий с процессом платежей (через БД)
+    from services.telegram_sender import telegram_queue
+    telegram_queue.share_limit(db)
+    
+    from services import email_service
     email_service.db = db  
     
+    from backend.services import telegram_file_cache
+    telegram_file_cache.db = db
+    
     
     from authentication.auth.routes import router as auth_router
     from authentication.web_auth.routes import router as web_auth_router
@@ -104,6 +113,13 @@ async def lifespan(app: FastAPI):
     await db.close()
     print("✅ Database disconnected")
     
+    from backend.services.storage import storage
+    from backend.services.image_service import image_variants
+    from services.email_service import email_service
+    storage.close()
+    image_variants.close()
+    email_service.close()
+    
 
 
 
@@ -161,8 +177,8 @@ from fastapi.responses import RedirectResponse
 
 @app.middleware("http")
 async def jwt_middleware(request: Request, call_next):
-    # Пропускаем публичные эндпоинты
-    if request.url.path in ["/", "/web_auth/login", "/api/auth/login", "/health", "/debug-token"]:
+    # Пропускаем публичные эндпоинты (/metrics проверяет свой токен)
+    if request.url.path in ["/", "/web_auth/login", "/api/auth/login", "/health", "/debug-token", "/metrics"]:
         return await call_next(request)
     
     # Проверяем JWT токен из cookie
@@ -189,6 +205,16 @@ async def jwt_middleware(request: Request, call_next):
 
 
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Метрики админки (пулы БД, операции с хранилищем) - по METRICS_TOKEN"""
+    from utils.metrics import registry, metrics_authorized
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return PlainTextResponse("Not found", status_code=404)
+    return PlainTextResponse(registry.render())
+
+
+
 # ⭐⭐⭐ ЭНДПОИНТ ДЛЯ ОТЛАДКИ ТОКЕНА ⭐⭐⭐
 @app.get("/debug-token")
 async def debug_token(request: Request):
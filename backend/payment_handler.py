@@ -8,7 +8,6 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import *
-from aiogram.fsm.storage.memory import MemoryStorage
 
 import aiomysql
 import aiohttp
@@ -17,14 +16,26 @@ from aiohttp import web
 import asyncio
 
 
+from typing import List
+
+from database import Database
+from utils.admission import AdmissionLimiter, Overloaded
+from utils.circuit_breaker import CircuitOpen
+from utils.db_pool import PoolExhausted
 from services.email_service import email_service
 from services.bot_notifications import send_telegram_payment_async
+from services.telegram_sender import telegram_queue
+from services import stock_reservations
+from services import notification_outbox
+from services import payment_events
+from services.fsm_storage import create_fsm_storage
+from services.yookassa_client import yookassa_client, YooKassaError
+from utils.metrics import registry, metrics_authorized
 
 import logging
 import uuid
 import sys
 import os
-import requests
 
 
 
@@ -53,32 +64,69 @@ bot = Bot(
 )
 
 
-storage = MemoryStorage()
-dp = Dispatcher(bot=bot, storage=storage)
-
-
 # Пул соединений MySQL
 db_pool = None
 
 
-async_db_pool = None
+payment_db = Database()
+fsm_db = Database()    # FSM (FSM_STORAGE=mysql): свой пул с autocommit, пулы payment_db - без него
+async_db_pool = None   # фоновые задачи: outbox, просроченные резервы, debug
+checkout_pool = None   # create_payment до ЮKassa (резервирование): быстрый отказ при перегрузке
+record_pool = None     # create_payment после ЮKassa: запись платежа, без лимитов очереди
+webhook_pool = None    # прием и обработка вебхуков ЮKassa (резерв соединений)
 app = web.Application()
 
 
+# FSM: memory / mysql / redis (FSM_STORAGE)
+storage = create_fsm_storage(fsm_db)
+dp = Dispatcher(bot=bot, storage=storage)
+
+# Диспетчер outbox уведомлений (запускается в main)
+outbox_dispatcher = None
+
+# Воркеры событий ЮKassa (запускаются в main)
+event_processor = None
+
+# Допуск запросов на оплату: CHECKOUT_MAX_CONCURRENT / _MAX_QUEUE / _QUEUE_TIMEOUT
+checkout_limiter = AdmissionLimiter.from_env('checkout', max_concurrent=20, max_queue=50, queue_timeout=2.0)
+
+# Повторы записи платежа, уже созданного в ЮKassa
+PAYMENT_RECORD_ATTEMPTS = int(os.getenv('PAYMENT_RECORD_ATTEMPTS', '5'))
+PAYMENT_RECORD_RETRY_DELAY = float(os.getenv('PAYMENT_RECORD_RETRY_DELAY', '0.2'))
+
+
 
 async def init_async_db():
-    global async_db_pool
+    global async_db_pool, checkout_pool, record_pool, webhook_pool
     try:
-        async_db_pool = await aiomysql.create_pool(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('PASSWORD'),
-            db=os.getenv('DB_NAME'),
-            port=int(os.getenv('DB_PORT')),
-            minsize=5,
-            maxsize=10,
-            autocommit=False
+        # Общий слой Database: размеры из DB_POOL_<NAME>_*, метрики ожидания и утечек.
+        # Раздельные пулы: всплеск оформлений не забирает соединения у вебхуков,
+        # которые финализируют заказы и освобождают резервы.
+        await payment_db.connect(service='payment', minsize=1, maxsize=4, autocommit=False)
+        async_db_pool = payment_db.pool
+        
+        # Оформление: ограниченная очередь, при перегрузке - быстрый отказ (503)
+        checkout_pool = await payment_db.add_pool(
+            'checkout', minsize=2, maxsize=8, autocommit=False,
+            acquire_timeout=5, max_waiters=50
         )
+        
+        # Запись платежа, уже созданного в ЮKassa: ждет соединения, а не отбрасывается
+        record_pool = await payment_db.add_pool(
+            'payment_record', minsize=1, maxsize=4, autocommit=False
+        )
+        
+        # Вебхуки: воркеры событий + запас на сохранение входящих запросов
+        event_workers = int(os.getenv('PAYMENT_EVENT_WORKERS', '4'))
+        webhook_pool = await payment_db.add_pool(
+            'webhook', minsize=2, maxsize=event_workers + 2, autocommit=False
+        )
+        
+        # Лимит токена бота общий с админкой: окна отправок резервируются в БД
+        telegram_queue.share_limit(payment_db)
+        
+        if os.getenv('FSM_STORAGE', 'memory').lower() == 'mysql':
+            await fsm_db.connect(service='payment_fsm', minsize=1, maxsize=2)
         logger.info("✅ Успешное создание асинхронного пула MySQL")
     except Exception as e:
         logger.error(f"❌ Ошибка создания асинхронного пула MySQL: {e}")
@@ -86,6 +134,17 @@ async def init_async_db():
     
 
 
+async def send_email_notifications(payloads: List[dict]) -> List[bool]:
+    """Пачка писем outbox - подряд через общие SMTP соединения"""
+    return await email_service.send_order_confirmations(payloads)
+
+
+
+async def send_telegram_notification(payload: dict) -> bool:
+    return await send_telegram_payment_async(**payload)
+
+
+
 async def get_async_db():
     return await async_db_pool.acquire()
 
@@ -93,13 +152,32 @@ async def get_async_db():
 
 async def release_async_db(conn):
     await async_db_pool.release(conn)
+
+
+
+def service_unavailable(error: str, retry_after: float) -> web.Response:
+    """503 с Retry-After: клиент повторит позже, а не сразу"""
+    return web.json_response(
+        {"success": False, "error": error},
+        status=503,
+        headers={'Retry-After': str(max(1, int(retry_after + 0.999)))}
+    )
     
     
 
 
 async def create_payment(request):
-    conn = None
-    cursor = None
+    """Оформление оплаты через ограничитель: при перегрузке - быстрый 503"""
+    try:
+        async with checkout_limiter.slot():
+            return await process_create_payment(request)
+    except Overloaded as e:
+        logger.warning(f"Checkout rejected: {e}")
+        return service_unavailable("Service busy, try again later", e.retry_after)
+
+
+
+async def process_create_payment(request):
     try:
         data = await request.json()
         if not data:
@@ -118,38 +196,18 @@ async def create_payment(request):
         if quantity <= 0:
             return web.json_response({"success": False, "error": "Quantity must be positive"}, status=400)
 
-        # Асинхронное подключение
-        conn = await async_db_pool.acquire()
-        cursor = await conn.cursor(aiomysql.DictCursor)
-        
-        # НАЧИНАЕМ ТРАНЗАКЦИЮ (БЕЗ БЛОКИРОВОК)
-        await conn.begin()
-        
-        # 1. АТОМАРНОЕ ВЫЧИТАНИЕ quantity БЕЗ БЛОКИРОВКИ
-        await cursor.execute(
-            "UPDATE journals SET quantity = quantity - %s WHERE id = %s AND quantity >= %s",
-            (quantity, journal_id, quantity)
-        )
-        
-        # Проверяем, получилось ли вычесть
-        if cursor.rowcount == 0:
-            await conn.rollback()
-            await async_db_pool.release(conn)
-            
-            # Узнаем текущее количество для информативного сообщения
-            await cursor.execute("SELECT quantity FROM journals WHERE id = %s", (journal_id,))
-            journal = await cursor.fetchone()
-            
-            if journal:
-                available = journal['quantity']
-                return web.json_response({
-                    "success": False,
-                    "error": f"Not enough items in stock. Available: {available}, requested: {quantity}"
-                }, status=400)
-            else:
+        # 1. РЕЗЕРВИРУЕМ ТОВАР: КОРОТКАЯ ТРАНЗАКЦИЯ, КОММИТ ДО ОБРАЩЕНИЯ К ЮKASSA
+        try:
+            reservation_id = await stock_reservations.reserve_stock(checkout_pool, journal_id, quantity, user_id)
+        except stock_reservations.OutOfStock as e:
+            if e.available is None:
                 return web.json_response({"success": False, "error": "Journal not found"}, status=404)
+            return web.json_response({
+                "success": False,
+                "error": f"Not enough items in stock. Available: {e.available}, requested: {quantity}"
+            }, status=400)
         
-        # 2. Создаем платеж в ЮKassa (асинхронно через aiohttp)
+        # 2. Создаем платеж в ЮKassa (БЕЗ СОЕДИНЕНИЯ С БД И БЛОКИРОВОК)
         payment_data = {
             "amount": {
                 "value": f"{amount:.2f}",
@@ -169,78 +227,43 @@ async def create_payment(request):
             "description": f"Оплата журнала ID {journal_id}"
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.yookassa.ru/v3/payments',
-                json=payment_data,
-                auth=aiohttp.BasicAuth(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY),
-                headers={'Idempotence-Key': str(uuid.uuid4())}
-            ) as response:
-                payment = await response.json()
-        
-        # 3. Сохраняем информацию о платеже
-        await cursor.execute(
-            """INSERT INTO payments 
-            (payment_id, user_id, journal_id, amount, status) 
-            VALUES (%s, %s, %s, %s, %s)""",
-            (payment['id'], user_id, journal_id, amount, 'pending')
-        )
-        
-        # 4. 🔥 АВТОМАТИЧЕСКОЕ ПОДТВЕРЖДЕНИЕ ПЛАТЕЖА
-        if payment['status'] == 'waiting_for_capture':
-            try:
+        capture_result = None
+        try:
+            # Один ключ на все повторы - ЮKassa не создаст второй платеж
+            payment = await yookassa_client.create_payment(payment_data, idempotence_key=str(uuid.uuid4()))
+            
+            if 'id' not in payment:
+                raise RuntimeError(f"YooKassa error: {payment}")
+            
+            # 🔥 АВТОМАТИЧЕСКОЕ ПОДТВЕРЖДЕНИЕ ПЛАТЕЖА
+            if payment['status'] == 'waiting_for_capture':
                 logger.info(f"Auto-capturing payment {payment['id']}")
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f'https://api.yookassa.ru/v3/payments/{payment["id"]}/capture',
-                        json={"amount": {"value": f"{amount:.2f}", "currency": "RUB"}},
-                        auth=aiohttp.BasicAuth(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY),
-                        headers={'Idempotence-Key': str(uuid.uuid4())}
-                    ) as response:
-                        capture_result = await response.json()
+                capture_result = await yookassa_client.capture_payment(payment['id'], amount)
                         
                 logger.info(f"Capture result: {capture_result['status']}")
                 
-                # Обновляем статус в БД
-                await cursor.execute(
-                    "UPDATE payments SET status = %s WHERE payment_id = %s",
-                    (capture_result['status'], payment['id'])
-                )
-                
-                # Если платеж успешен - создаем заказ
-                if capture_result['status'] == 'succeeded':
-                    await cursor.execute(
-                        """INSERT INTO orders (tg_user_id, fullname, city, postcode, 
-                            phone, email, product_id, quantity, amount, payment_id, status, currency)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'paid', 'RUB')""",
-                        (
-                            user_id,
-                            data.get('fullname', ''),
-                            data.get('city', ''),
-                            data.get('postcode', ''),
-                            data.get('phone', ''),
-                            data.get('email', ''),
-                            journal_id,
-                            quantity,
-                            amount,
-                            payment['id']
-                        )
-                    )
-                    
-            except Exception as e:
-                logger.error(f"Auto-capture failed: {str(e)}")
-                # Откатываем списание товара при ошибке
-                await cursor.execute(
-                    "UPDATE journals SET quantity = quantity + %s WHERE id = %s",
-                    (quantity, journal_id)
-                )
-                await conn.rollback()
-                await async_db_pool.release(conn)
-                return web.json_response({"success": False, "error": f"Payment capture failed: {str(e)}"}, status=500)
-        
-        await conn.commit()
-        await async_db_pool.release(conn)
+        except CircuitOpen as e:
+            # ЮKassa недоступна - не ждем таймаутов, сразу отпускаем резерв
+            logger.warning(f"Payment provider unavailable: {e}")
+            await release_reservation_safely(reservation_id)
+            return service_unavailable("Payment provider unavailable, try again later", e.retry_after)
+        except Exception as e:
+            # ВОЗВРАЩАЕМ ЗАРЕЗЕРВИРОВАННЫЙ ТОВАР
+            logger.error(f"Payment provider call failed: {str(e)}")
+            await release_reservation_safely(reservation_id)
+            return web.json_response({"success": False, "error": f"Payment creation failed: {str(e)}"}, status=500)
+        
+        status = capture_result['status'] if capture_result else payment['status']
+        
+        # 3. Сохраняем платеж и привязываем к нему резерв. Платеж в ЮKassa уже
+        # создан - запись не отбрасывается, а повторяется; не вышло - резерв возвращаем
+        try:
+            await record_payment(payment, status, reservation_id, data, amount)
+        except Exception as e:
+            logger.critical(f"Payment {payment['id']} created in YooKassa but not saved: {e}", exc_info=True)
+            await release_reservation_safely(reservation_id)
+            return web.json_response({"success": False, "error": "Payment could not be saved"}, status=500)
         
         return web.json_response({
             "success": True,
@@ -249,27 +272,141 @@ async def create_payment(request):
             "status": payment['status']
         })
 
+    except PoolExhausted as e:
+        # Только до обращения к ЮKassa (резервирование) - платежа еще нет
+        logger.warning(f"Checkout rejected: {e}")
+        return service_unavailable("Service busy, try again later", checkout_limiter.retry_after)
     except Exception as e:
-        if conn:
-            await conn.rollback()
-            await async_db_pool.release(conn)
         logger.error(f"Payment processing error: {str(e)}", exc_info=True)
         return web.json_response({"success": False, "error": str(e)}, status=500)
-    finally:
-        if cursor:
-            await cursor.close()
+
+
+
+async def record_payment(payment: dict, status: str, reservation_id: str, data: dict, amount: float):
+    """
+    Сохраняет платеж, созданный в ЮKassa, и привязывает к нему резерв.
+    Отдельный пул без acquire_timeout/max_waiters - запись ждет соединения,
+    а не отбрасывается; ошибки повторяются с паузой: без этой записи вебхук
+    оплаты не найдет платеж и заказ потеряется.
+    """
+    delay = PAYMENT_RECORD_RETRY_DELAY
+    for attempt in range(1, PAYMENT_RECORD_ATTEMPTS + 1):
+        try:
+            async with record_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await conn.begin()
+                    try:
+                        await save_payment(cursor, payment, status, reservation_id, data, amount)
+                        await conn.commit()
+                    except Exception:
+                        await conn.rollback()
+                        raise
+            return
+        except Exception as e:
+            if attempt == PAYMENT_RECORD_ATTEMPTS:
+                raise
+            logger.warning(f"Saving payment {payment['id']} failed (attempt {attempt}): {e}")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+
+async def save_payment(cursor, payment: dict, status: str, reservation_id: str, data: dict, amount: float):
+    # Повтор после потерянного ответа на COMMIT - платеж уже сохранен
+    await cursor.execute("SELECT 1 FROM payments WHERE payment_id = %s", (payment['id'],))
+    if await cursor.fetchone():
+        return
+    
+    await cursor.execute(
+        """INSERT INTO payments 
+        (payment_id, user_id, journal_id, amount, status) 
+        VALUES (%s, %s, %s, %s, %s)""",
+        (payment['id'], data['user_id'], data['journal_id'], amount, status)
+    )
+    await stock_reservations.attach_payment(cursor, reservation_id, payment['id'])
+    
+    # Если платеж успешен - создаем заказ и подтверждаем резерв
+    if status == 'succeeded':
+        await cursor.execute(
+            """INSERT INTO orders (tg_user_id, fullname, city, postcode, 
+                phone, email, product_id, quantity, amount, payment_id, status, currency)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'paid', 'RUB')""",
+            (
+                data['user_id'],
+                data.get('fullname', ''),
+                data.get('city', ''),
+                data.get('postcode', ''),
+                data.get('phone', ''),
+                data.get('email', ''),
+                data['journal_id'],
+                int(data['quantity']),
+                amount,
+                payment['id']
+            )
+        )
+        await stock_reservations.confirm_for_payment(cursor, payment['id'])
+
+
+
+async def release_reservation_safely(reservation_id: str):
+    """Возврат резерва после ошибки; если и он не удался - резерв вернет sweeper по TTL"""
+    try:
+        await stock_reservations.release_reservation(record_pool, reservation_id)
+    except Exception as e:
+        logger.error(f"Reservation {reservation_id} not released (sweeper will release it): {e}")
             
             
 
 
+async def return_goods(cursor, payment_id: str, journal_id: int, quantity: int):
+    """Возвращает товар на склад по резерву платежа (идемпотентно)"""
+    released = await stock_reservations.release_for_payment(cursor, payment_id)
+    if released is None:
+        # Платеж создан до появления резервов
+        await cursor.execute(
+            "UPDATE journals SET quantity = quantity + %s WHERE id = %s",
+            (quantity, journal_id)
+        )
+
+
+
+class PaymentNotFound(Exception):
+    """Платеж еще не сохранен в БД (вебхук обогнал create_payment) - повторим позже"""
+
+
+
 async def payment_webhook(request):
+    """Быстрый ответ ЮKassa: событие сохраняется в payment_events, обработка - в воркерах"""
     logger.info("Webhook received")
     
+    try:
+        event_json = await request.json()
+        payment_id = event_json['object']['id']
+        status = event_json['object']['status']
+    except Exception as e:
+        logger.error(f"Invalid webhook payload: {e}")
+        return web.json_response({"error": "Invalid payload"}, status=400)
+    
+    try:
+        inserted = await payment_events.store_event(webhook_pool, payment_id, status, event_json)
+    except Exception as e:
+        # Не удалось сохранить - ЮKassa повторит запрос
+        logger.error(f"Error storing webhook event {payment_id}/{status}: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+    
+    if inserted and event_processor:
+        event_processor.notify()
+    
+    return web.json_response({"status": "accepted" if inserted else "duplicate"}, status=200)
+
+
+
+async def process_payment_event(event_json: dict) -> str:
+    """Обработка события ЮKassa (вызывается воркерами PaymentEventProcessor)"""
     conn = None
     cursor = None
     
     try:
-        event_json = await request.json()
         payment = event_json['object']
         payment_id = payment['id']
         status = payment['status']
@@ -278,7 +415,7 @@ async def payment_webhook(request):
         logger.info(f"Payment {payment_id}, status: {status}")
         
         # Асинхронное подключение
-        conn = await async_db_pool.acquire()
+        conn = await webhook_pool.acquire()
         cursor = await conn.cursor(aiomysql.DictCursor)
         await conn.begin()
         
@@ -293,16 +430,17 @@ async def payment_webhook(request):
         
         if not existing_payment:
             await conn.rollback()
-            await async_db_pool.release(conn)
-            logger.error(f"Payment {payment_id} not found in database")
-            return web.json_response({"status": "payment not found"}, status=404)
+            await webhook_pool.release(conn)
+            conn = None
+            raise PaymentNotFound(f"Payment {payment_id} not found in database")
         
         # ЕСЛИ ПЛАТЕЖ УЖЕ ОБРАБОТАН - ВЫХОДИМ
         if existing_payment.get('processed'):
             await conn.rollback()
-            await async_db_pool.release(conn)
+            await webhook_pool.release(conn)
+            conn = None
             logger.info(f"Payment {payment_id} already processed - skipping")
-            return web.json_response({"status": "already_processed"}, status=200)
+            return "already_processed"
             
         # ЕСЛИ УЖЕ В КОНЕЧНОМ СТАТУСЕ - ОБНОВЛЯЕМ processed И ВЫХОДИМ
         if existing_payment['status'] in ['succeeded', 'canceled', 'failed']:
@@ -311,16 +449,18 @@ async def payment_webhook(request):
                 (payment_id,)
             )
             await conn.commit()
-            await async_db_pool.release(conn)
+            await webhook_pool.release(conn)
+            conn = None
             logger.info(f"Payment {payment_id} already finalized - marking processed")
-            return web.json_response({"status": "already_finalized"}, status=200)
+            return "already_finalized"
         
         # ПРОВЕРКА ОБЯЗАТЕЛЬНЫХ ДАННЫХ
         if not all(key in metadata for key in ['chat_id', 'journal_id', 'quantity']):
             await conn.rollback()
-            await async_db_pool.release(conn)
+            await webhook_pool.release(conn)
+            conn = None
             logger.error("Missing required metadata fields")
-            return web.json_response({"error": "Missing metadata"}, status=400)
+            return "missing_metadata"
 
         # ПОЛУЧАЕМ ДАННЫЕ ИЗ METADATA
         quantity = int(metadata['quantity'])
@@ -333,31 +473,25 @@ async def payment_webhook(request):
             logger.info(f"Payment {payment_id} waiting for capture - capturing...")
             
             try:
-                # Асинхронный захват платежа
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f'https://api.yookassa.ru/v3/payments/{payment_id}/capture',
-                        json={"amount": {"value": f"{amount:.2f}", "currency": "RUB"}},
-                        auth=aiohttp.BasicAuth(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY),
-                        headers={'Idempotence-Key': str(uuid.uuid4())}
-                    ) as response:
-                        capture_result = await response.json()
+                # Асинхронный захват платежа (общий клиент, ключ идемпотентности по payment_id)
+                capture_result = await yookassa_client.capture_payment(payment_id, amount)
                 logger.info(f"Payment captured: {capture_result['status']}")
                 
+            except CircuitOpen:
+                # ЮKassa недоступна - платеж не проваливаем, событие будет повторено
+                raise
             except Exception as e:
                 # ВОЗВРАЩАЕМ ТОВАР ПРИ ОШИБКЕ ЗАХВАТА
-                await cursor.execute(
-                    "UPDATE journals SET quantity = quantity + %s WHERE id = %s",
-                    (quantity, journal_id)
-                )
+                await return_goods(cursor, payment_id, journal_id, quantity)
                 await cursor.execute(
                     "UPDATE payments SET status = 'failed', processed = TRUE WHERE payment_id = %s",
                     (payment_id,)
                 )
                 await conn.commit()
-                await async_db_pool.release(conn)
+                await webhook_pool.release(conn)
+                conn = None
                 logger.error(f"Capture failed: {str(e)}")
-                return web.json_response({"error": f"Capture failed: {str(e)}"}, status=500)
+                return "capture_failed"
             
             # СОХРАНЯЕМ ЗАКАЗ
             await cursor.execute(
@@ -382,6 +516,7 @@ async def payment_webhook(request):
                 "UPDATE payments SET status = 'succeeded', processed = TRUE WHERE payment_id = %s",
                 (payment_id,)
             )
+            await stock_reservations.confirm_for_payment(cursor, payment_id)
             
         elif status == 'succeeded':
             logger.info(f"Payment {payment_id} already succeeded")
@@ -408,113 +543,67 @@ async def payment_webhook(request):
                 "UPDATE payments SET status = 'succeeded', processed = TRUE WHERE payment_id = %s",
                 (payment_id,)
             )
+            await stock_reservations.confirm_for_payment(cursor, payment_id)
             
         elif status in ['canceled', 'failed']:
             logger.info(f"Payment {payment_id} {status} - returning goods")
             
-            await cursor.execute(
-                "UPDATE journals SET quantity = quantity + %s WHERE id = %s",
-                (quantity, journal_id)
-            )
+            await return_goods(cursor, payment_id, journal_id, quantity)
             
             await cursor.execute(
                 "UPDATE payments SET status = %s, processed = TRUE WHERE payment_id = %s",
                 (status, payment_id)
             )
         
-        # КРИТИЧЕСКАЯ ЧАСТЬ: ОТПРАВКА УВЕДОМЛЕНИЯ С БЛОКИРОВКОЙ
-        # Еще раз проверяем под блокировкой, не отправили ли уже
-        await cursor.execute(
-            "SELECT notification_sent FROM payments WHERE payment_id = %s FOR UPDATE",
-            (payment_id,)
-        )
-        notification_check = await cursor.fetchone()
-        
-        if not notification_check or not notification_check.get('notification_sent'):
-            # ОТПРАВЛЯЕМ УВЕДОМЛЕНИЕ ТОЛЬКО ОДИН РАЗ
-            if status in ['succeeded', 'waiting_for_capture']:
-                success = await send_telegram_payment_async(
-                    chat_id=metadata['chat_id'],
-                    payment_id=payment_id,
-                    amount=amount,
-                    product_id=journal_id,
-                    customer_name=metadata.get('fullname'),
-                    delivery_city=metadata.get('city'),
-                    delivery_postcode=metadata.get('postcode')
-                )
-                
-                # 2. Отправляем на email через EmailService
-                email_success = await email_service.send_order_confirmation(
-                    payment_id=payment_id,
-                    amount=amount,
-                    product_id=journal_id,
-                    metadata=metadata
-                )
-                
-                if success or email_success:
-                    # Помечаем как отправленное
-                    await cursor.execute(
-                        "UPDATE payments SET notification_sent = TRUE WHERE payment_id = %s",
-                        (payment_id,)
-                    )
+        # УВЕДОМЛЕНИЯ - В OUTBOX В ЭТОЙ ЖЕ ТРАНЗАКЦИИ (ОТПРАВИТ ДИСПЕТЧЕР)
+        queued_notifications = False
+        if not existing_payment.get('notification_sent') and status in ['succeeded', 'waiting_for_capture']:
+            await notification_outbox.enqueue(cursor, payment_id, 'telegram', {
+                'chat_id': metadata['chat_id'],
+                'payment_id': payment_id,
+                'amount': amount,
+                'product_id': journal_id,
+                'customer_name': metadata.get('fullname'),
+                'delivery_city': metadata.get('city'),
+                'delivery_postcode': metadata.get('postcode')
+            })
+            await notification_outbox.enqueue(cursor, payment_id, 'email', {
+                'payment_id': payment_id,
+                'amount': amount,
+                'product_id': journal_id,
+                'metadata': metadata
+            })
+            queued_notifications = True
         
         await conn.commit()
-        await async_db_pool.release(conn)
+        await webhook_pool.release(conn)
+        conn = None
+        if queued_notifications and outbox_dispatcher:
+            outbox_dispatcher.notify()
         logger.info(f"Payment {payment_id} processed successfully")
-        return web.json_response({"status": "ok"}, status=200)
+        return "ok"
         
-    except Exception as e:
+    except Exception:
         if conn: 
             await conn.rollback()
-            await async_db_pool.release(conn)
-        logger.error(f"Webhook error: {str(e)}", exc_info=True)
-        return web.json_response({"error": str(e)}, status=500)
+            await webhook_pool.release(conn)
+        raise
     finally:
         if cursor: 
             await cursor.close()
             
 
 
-def capture_payment(payment_id, amount):
+async def capture_payment(payment_id, amount):
     """Подтверждает платеж в ЮKassa"""
+    logger.info(f"Capturing payment {payment_id} with amount {amount}")
     try:
-        shop_id = os.getenv('YOOKASSA_SHOP_ID')
-        secret_key = os.getenv('YOOKASSA_SECRET_KEY')
-        
-        if not shop_id or not secret_key:
-            raise ValueError("YKassa credentials not set")
-            
-        url = f"https://api.yookassa.ru/v3/payments/{payment_id}/capture"
-        
-        auth = (shop_id, secret_key)
-        headers = {
-            'Idempotence-Key': str(uuid.uuid4()),
-            'Content-Type': 'application/json'
-        }
-        
-        # Обязательно указываем amount для подтверждения
-        payload = {
-            "amount": {
-                "value": f"{amount:.2f}",
-                "currency": "RUB"
-            }
-        }
-        
-        logger.info(f"Capturing payment {payment_id} with amount {amount}")
-        
-        response = requests.post(url, auth=auth, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()
-        
-        result = response.json()
-        logger.info(f"Capture successful: {result['status']}")
-        return result
-        
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"HTTP error capturing payment: {e.response.status_code} - {e.response.text}")
-        raise
-    except Exception as e:
-        logger.error(f"Error capturing payment {payment_id}: {str(e)}")
+        result = await yookassa_client.capture_payment(payment_id, amount)
+    except YooKassaError as e:
+        logger.error(f"Error capturing payment {payment_id}: {e}")
         raise
+    logger.info(f"Capture successful: {result['status']}")
+    return result
         
         
 
@@ -625,6 +714,14 @@ async def cors_middleware(request, handler):
 app = web.Application(middlewares=[cors_middleware])
 
 
+async def metrics(request):
+    """Метрики сервиса платежей (очередь событий, outbox и т.д.) - по METRICS_TOKEN"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return web.Response(status=404, text="Not found")
+    return web.Response(text=registry.render(), content_type='text/plain')
+
+
+
 # Явный обработчик для OPTIONS запросов
 async def options_handler(request):
     return web.Response(status=200)
@@ -632,11 +729,30 @@ async def options_handler(request):
 
 async def main():
     await init_async_db()
+    await yookassa_client.start()
+    
+    # Освобождение просроченных резервов товара
+    asyncio.create_task(stock_reservations.run_expiry_sweeper(async_db_pool))
+    
+    # Отправка уведомлений из outbox
+    global outbox_dispatcher
+    outbox_dispatcher = notification_outbox.OutboxDispatcher.from_env(
+        async_db_pool,
+        {'telegram': send_telegram_notification},
+        batch_senders={'email': send_email_notifications}
+    )
+    outbox_dispatcher.start()
+    
+    # Обработка сохраненных вебхуков ЮKassa
+    global event_processor
+    event_processor = payment_events.PaymentEventProcessor.from_env(webhook_pool, process_payment_event)
+    event_processor.start()
     
     # Добавляем маршруты
     app.router.add_post('/create_payment', create_payment)
     app.router.add_post('/payment_webhook', payment_webhook)
     app.router.add_get('/debug/payment/{payment_ref}', debug_payment)
+    app.router.add_get('/metrics', metrics)
     
     # Добавляем OPTIONS handlers для всех маршрутов
     app.router.add_options('/create_payment', options_handler)
@@ -649,7 +765,15 @@ async def main():
     await site.start()
     
     logger.info("🚀 Сервер запущен на http://0.0.0.0:5005")
-    await asyncio.Future()
+    try:
+        await asyncio.Future()
+    finally:
+        await outbox_dispatcher.stop()
+        email_service.close()
+        await yookassa_client.close()
+        await storage.close()
+        await fsm_db.close()
+        await payment_db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
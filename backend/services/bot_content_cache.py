@@ -0,0 +1,136 @@
+from typing import Any, Dict, Optional
+
+from database import db
+from utils.metrics import registry
+
+import asyncio
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+BOT_CONTENT_VERSION = 'bot_content'
+
+
+content_reloads = registry.counter("bot_content_reloads_total", "Перезагрузки контента бота (описание/контакты)")
+
+
+# Контент, картинки и кнопки всех разделов за один запрос
+LOAD_QUERY = """
+    SELECT c.id AS content_id, c.content_type, c.text_content, c.updated_at,
+           'image' AS kind, i.id AS item_id, i.image_url, i.is_main,
+           NULL AS button_text, NULL AS button_url, NULL AS position
+    FROM bot_content c
+    LEFT JOIN bot_images i ON i.content_id = c.id
+    UNION ALL
+    SELECT c.id, c.content_type, c.text_content, c.updated_at,
+           'button', b.id, NULL, NULL,
+           b.button_text, b.button_url, b.position
+    FROM bot_content c
+    JOIN bot_buttons b ON b.content_id = c.id
+"""
+
+
+
+
+class BotContentCache:
+    """
+    Описание/контакты бота в памяти процесса.
+
+    Меняются только из админки (admin/bot_routes.py), которая увеличивает
+    версию 'bot_content'; кэш проверяет версию не чаще раза в check_interval
+    секунд и при изменении перечитывает все разделы одним запросом.
+    """
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self._version = None
+        self._content: Dict[str, Dict[str, Any]] = {}
+        self._checked_at = 0.0
+        self._lock = None
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(check_interval=float(os.getenv('BOT_CONTENT_CHECK_INTERVAL', '5')))
+
+
+    async def _load(self) -> Dict[str, Dict[str, Any]]:
+        rows = await db.fetch_all(LOAD_QUERY)
+
+        content: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            section = content.get(row['content_type'])
+            if section is None:
+                section = content[row['content_type']] = {
+                    "content": {
+                        "id": row['content_id'],
+                        "content_type": row['content_type'],
+                        "text_content": row['text_content'],
+                        "updated_at": row['updated_at']
+                    },
+                    "images": [],
+                    "buttons": []
+                }
+
+            if row['kind'] == 'image' and row['item_id'] is not None:
+                section['images'].append({
+                    "id": row['item_id'],
+                    "content_id": row['content_id'],
+                    "image_url": row['image_url'],
+                    "is_main": bool(row['is_main'])
+                })
+            elif row['kind'] == 'button':
+                section['buttons'].append({
+                    "id": row['item_id'],
+                    "content_id": row['content_id'],
+                    "button_text": row['button_text'],
+                    "button_url": row['button_url'],
+                    "position": row['position']
+                })
+
+        # Тот же порядок, что и в запросах админки (ORDER BY position: NULL - первыми, как в MySQL)
+        for section in content.values():
+            section['images'].sort(key=lambda img: (not img['is_main'], img['id']))
+            section['buttons'].sort(key=lambda btn: (btn['position'] is not None, btn['position'] or 0, btn['id']))
+        return content
+
+
+    async def _refresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._version is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+
+            version = await db.get_version(BOT_CONTENT_VERSION)
+            if version != self._version:
+                self._content = await self._load()
+                self._version = version
+                content_reloads.inc()
+                logger.info(f"📝 Bot content loaded: version {version}, sections {sorted(self._content)}")
+            self._checked_at = time.monotonic()
+
+
+    async def get(self, content_type: str) -> Optional[Dict[str, Any]]:
+        """{"content", "images", "buttons"} раздела или None"""
+        await self._refresh()
+        return self._content.get(content_type)
+
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+
+
+# Глобальный экземпляр
+bot_content_cache = BotContentCache.from_env()
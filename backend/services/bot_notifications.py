@@ -4,6 +4,7 @@ from aiogram.types import InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardB
 from typing import Optional, Dict
 
 from services.email_service import email_service
+from services.telegram_sender import telegram_queue, RetryAfter, TRANSACTIONAL, BULK
 from database import db
 
 import asyncio
@@ -77,10 +78,14 @@ async def send_shipping_notification(bot: Bot, order_id: int, track_number: str)
                     f"🔍 Отследить: https://www.pochta.ru/tracking#{track_number}"
                 )
                 
-                await bot.send_message(
-                    chat_id=order['tg_user_id'],
-                    text=message,
-                    parse_mode='HTML'
+                await telegram_queue.send(
+                    order['tg_user_id'],
+                    lambda: bot.send_message(
+                        chat_id=order['tg_user_id'],
+                        text=message,
+                        parse_mode='HTML'
+                    ),
+                    priority=BULK
                 )
                 telegram_sent = True
             except Exception as e:
@@ -142,24 +147,34 @@ async def send_telegram_notification(bot: Bot, order: dict, track_number: str):
             
             async with aiohttp.ClientSession() as session:
                 async with session.get(photo_url, timeout=5) as response:
-                    if response.status == 200:
-                        await bot.send_photo(
-                            chat_id=order['tg_user_id'],
-                            photo=photo_url,
-                            caption=message_text,
-                            reply_markup=keyboard,
-                            parse_mode='HTML'
-                        )
-                        return True
+                    photo_available = response.status == 200
+            
+            if photo_available:
+                await telegram_queue.send(
+                    order['tg_user_id'],
+                    lambda: bot.send_photo(
+                        chat_id=order['tg_user_id'],
+                        photo=photo_url,
+                        caption=message_text,
+                        reply_markup=keyboard,
+                        parse_mode='HTML'
+                    ),
+                    priority=BULK
+                )
+                return True
                         
         except Exception as photo_error:
             logger.warning(f"Photo send error: {photo_error}")
 
-        await bot.send_message(
-            chat_id=order['tg_user_id'],
-            text=message_text,
-            reply_markup=keyboard,
-            parse_mode='HTML'
+        await telegram_queue.send(
+            order['tg_user_id'],
+            lambda: bot.send_message(
+                chat_id=order['tg_user_id'],
+                text=message_text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            ),
+            priority=BULK
         )
         return True
     except Exception as e:
@@ -190,21 +205,21 @@ async def send_delivery_update_notification(
             f"Если вы не вносили эти изменения, свяжитесь с поддержкой."
         )
 
-        # Telegram уведомление с 3 попытками
+        # Telegram уведомление (повторы при сетевых ошибках и 429 - в очереди отправки)
         if tg_user_id:
-            for attempt in range(3):
-                try:
-                    await bot.send_message(
+            try:
+                await telegram_queue.send(
+                    tg_user_id,
+                    lambda: bot.send_message(
                         chat_id=tg_user_id,
                         text=message_text,
                         parse_mode='HTML'
-                    )
-                    results['telegram'] = True
-                    break
-                except Exception as e:
-                    logger.error(f"Attempt {attempt + 1} failed for order {order_id}: {str(e)}")
-                    if attempt < 2:  # Если это не последняя попытка
-                        await asyncio.sleep(2)  # Ждем 2 секунды перед повторной попыткой
+                    ),
+                    priority=TRANSACTIONAL
+                )
+                results['telegram'] = True
+            except Exception as e:
+                logger.error(f"Telegram send failed for order {order_id}: {str(e)}")
 
         # Email уведомление
         if email:
@@ -282,10 +297,14 @@ async def send_tracking_update_notification(
                     f"🔍 Отследить: https://www.pochta.ru/tracking#{new_tracking}"
                 )
                 
-                await bot.send_message(
-                    chat_id=order_data['tg_user_id'],
-                    text=message,
-                    parse_mode='HTML'
+                await telegram_queue.send(
+                    order_data['tg_user_id'],
+                    lambda: bot.send_message(
+                        chat_id=order_data['tg_user_id'],
+                        text=message,
+                        parse_mode='HTML'
+                    ),
+                    priority=BULK
                 )
                 results['telegram'] = True
                 logger.info(f"Telegram notification sent to {order_data['tg_user_id']}")
@@ -344,16 +363,22 @@ async def send_telegram_payment_async(
             'parse_mode': 'HTML'
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response_data = await response.json()
-                
-                if response.status == 200 and response_data.get('ok'):
-                    logger.info(f"Notification sent to chat {chat_id}. Response: {response_data}")
-                    return True
-                else:
-                    logger.error(f"Telegram API error: {response_data}")
-                    return False
+        async def post():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    response_data = await response.json()
+                    if response.status == 429:
+                        raise RetryAfter(response_data.get('parameters', {}).get('retry_after', 1))
+                    return response.status, response_data
+        
+        status, response_data = await telegram_queue.send(int(chat_id), post, priority=TRANSACTIONAL)
+        
+        if status == 200 and response_data.get('ok'):
+            logger.info(f"Notification sent to chat {chat_id}. Response: {response_data}")
+            return True
+        else:
+            logger.error(f"Telegram API error: {response_data}")
+            return False
                 
     except aiohttp.ClientError as e:
         logger.error(f"Telegram API request failed: {str(e)}")
@@ -0,0 +1,143 @@
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+from typing import Optional
+
+from utils.metrics import registry
+
+import asyncio
+import hmac
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+webhook_updates = registry.counter("bot_webhook_updates_total", "Апдейты, полученные через webhook")
+webhook_rejected = registry.counter("bot_webhook_rejected_total", "Отклоненные запросы webhook")
+webhook_processing = registry.histogram("bot_webhook_processing_seconds", "Обработка апдейта диспетчером")
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+
+
+class WebhookReceiver:
+    """
+    Прием апдейтов Telegram через webhook в существующем FastAPI приложении.
+
+    Запрос проверяется по secret token, апдейт передается диспетчеру в фоне,
+    Telegram сразу получает 200. Одновременно обрабатывается не больше
+    concurrency апдейтов; когда все слоты заняты, ответ задерживается до
+    освобождения слота и Telegram сам притормаживает доставку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: Optional[str], concurrency: int = 20):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.concurrency = concurrency
+        self.enabled = False  # включается, только если webhook действительно установлен
+        self._semaphore = None
+        self._tasks = set()
+
+        registry.gauge("bot_webhook_in_flight", "Апдейты в обработке",
+                       func=lambda: len(self._tasks))
+
+
+    @classmethod
+    def from_env(cls, dp: Dispatcher, bot: Bot):
+        return cls(
+            dp,
+            bot,
+            secret=os.getenv('WEBHOOK_SECRET'),
+            concurrency=int(os.getenv('BOT_WEBHOOK_CONCURRENCY', '20'))
+        )
+
+
+    async def handle(self, request: Request) -> Response:
+        # В режиме polling апдейты через этот роут не принимаем
+        if not self.enabled:
+            return Response(status_code=404)
+
+        # Без секрета webhook не включается; заголовок проверяется всегда
+        received = request.headers.get(SECRET_HEADER, '')
+        if not self.secret or not hmac.compare_digest(received, self.secret):
+            webhook_rejected.inc(reason='secret')
+            return Response(status_code=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            webhook_rejected.inc(reason='payload')
+            logger.warning(f"Invalid webhook update: {e}")
+            return Response(status_code=400)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        await self._semaphore.acquire()
+
+        webhook_updates.inc()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return JSONResponse({"ok": True})
+
+
+    async def _process(self, update: Update):
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+        finally:
+            webhook_processing.observe(time.perf_counter() - started)
+            self._semaphore.release()
+
+
+    async def drain(self, timeout: float = 10.0):
+        """Дожидается обработки принятых апдейтов (при остановке)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+
+
+async def start_updates(dp: Dispatcher, bot: Bot, mode: str, webhook_url: Optional[str],
+                        secret: Optional[str], max_connections: int = 40) -> str:
+    """
+    Включает доставку апдейтов: webhook, если он настроен (URL и секрет) и
+    Telegram его принял, иначе - long polling. Возвращает фактический режим.
+    """
+    if mode == 'webhook' and webhook_url and not secret:
+        # Без секрета любой, кто знает адрес, может подделать апдейт
+        logger.error("BOT_MODE=webhook, но WEBHOOK_SECRET не задан - используем polling")
+    elif mode == 'webhook' and webhook_url:
+        try:
+            await bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=max_connections
+            )
+            logger.info(f"🤖 Бот запущен в режиме webhook: {webhook_url}")
+            return 'webhook'
+        except Exception as e:
+            logger.error(f"❌ Не удалось установить webhook ({e}), переключаемся на polling")
+    elif mode == 'webhook':
+        logger.warning("BOT_MODE=webhook, но WEBHOOK_URL не задан - используем polling")
+
+    # Webhook и getUpdates взаимоисключающие
+    try:
+        await bot.delete_webhook(drop_pending_updates=False)
+    except Exception as e:
+        logger.error(f"Не удалось удалить webhook: {e}")
+    asyncio.create_task(dp.start_polling(bot))
+    logger.info("🤖 Бот запущен в режиме polling")
+    return 'polling'
@@ -0,0 +1,211 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import db
+from utils.metrics import registry
+
+import asyncio
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+CATALOG_VERSION = 'catalog'
+
+
+catalog_reloads = registry.counter("catalog_snapshot_reloads_total", "Перезагрузки снимка каталога")
+catalog_reads = registry.counter("catalog_snapshot_reads_total", "Чтения каталога из памяти")
+
+
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    version: int
+    journals: Tuple[Dict[str, Any], ...] = ()
+    by_id: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    images: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    bot_images: Dict[str, Tuple[Dict[str, Any], ...]] = field(default_factory=dict)
+
+
+
+class CatalogSnapshot:
+    """
+    Каталог журналов в памяти процесса.
+
+    Журналы, journal_images и journal_bot_images загружаются одним снимком и
+    заменяются атомарно, когда админка увеличивает версию 'catalog'
+    (проверка версии - не чаще раза в check_interval секунд).
+    Остатки (quantity) обновляются отдельно, с коротким TTL.
+    """
+
+    def __init__(self, check_interval: float = 2.0, stock_ttl: float = 5.0):
+        self.check_interval = check_interval
+        self.stock_ttl = stock_ttl
+
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._reload_lock = None
+
+        self._stock: Dict[str, int] = {}
+        self._stock_loaded_at = 0.0
+        self._stock_lock = None
+
+        registry.gauge("catalog_snapshot_version", "Версия загруженного каталога",
+                       func=lambda: self._snapshot.version if self._snapshot else -1)
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            check_interval=float(os.getenv('CATALOG_CHECK_INTERVAL', '2')),
+            stock_ttl=float(os.getenv('CATALOG_STOCK_TTL', '5'))
+        )
+
+
+    async def _load(self, version: int) -> _Snapshot:
+        journals = await db.fetch_all("""
+            SELECT id, title, description, price, year, photo_path, photo_url, quantity
+            FROM journals
+            ORDER BY year DESC
+        """)
+        images = await db.fetch_all(
+            "SELECT journal_id, image_url FROM journal_images WHERE show_in_app ORDER BY is_main DESC, id"
+        )
+        # Строки с source_image_id - роль канонического изображения: URL берется из journal_images
+        bot_images = await db.fetch_all("""
+            SELECT b.id, b.journal_id, COALESCE(i.image_url, b.image_url) AS image_url,
+                   b.is_main, b.source_image_id
+            FROM journal_bot_images b
+            LEFT JOIN journal_images i ON i.id = b.source_image_id
+            ORDER BY b.is_main DESC, b.id
+        """)
+
+        images_by_journal: Dict[str, List[str]] = {}
+        for row in images:
+            images_by_journal.setdefault(str(row['journal_id']), []).append(row['image_url'])
+
+        bot_images_by_journal: Dict[str, List[Dict[str, Any]]] = {}
+        for row in bot_images:
+            bot_images_by_journal.setdefault(str(row['journal_id']), []).append({
+                'id': row['id'],
+                'image_url': row['image_url'],
+                'is_main': bool(row['is_main']),
+                'source_image_id': row['source_image_id']
+            })
+
+        # Остатки из того же запроса - свежие на момент загрузки
+        self._stock = {str(j['id']): int(j['quantity'] or 0) for j in journals}
+        self._stock_loaded_at = time.monotonic()
+
+        return _Snapshot(
+            version=version,
+            journals=tuple(journals),
+            by_id={str(j['id']): j for j in journals},
+            images={k: tuple(v) for k, v in images_by_journal.items()},
+            bot_images={k: tuple(v) for k, v in bot_images_by_journal.items()}
+        )
+
+
+    async def _current(self) -> _Snapshot:
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.check_interval:
+            return self._snapshot
+
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            # Другой запрос мог уже проверить версию, пока мы ждали lock
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+
+            version = await db.get_version(CATALOG_VERSION)
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = await self._load(version)
+                catalog_reloads.inc()
+                logger.info(f"📚 Catalog snapshot loaded: version {version}, {len(self._snapshot.journals)} journals")
+            self._checked_at = time.monotonic()
+
+        return self._snapshot
+
+
+    async def _current_stock(self) -> Dict[str, int]:
+        if time.monotonic() - self._stock_loaded_at < self.stock_ttl:
+            return self._stock
+
+        if self._stock_lock is None:
+            self._stock_lock = asyncio.Lock()
+
+        async with self._stock_lock:
+            if time.monotonic() - self._stock_loaded_at >= self.stock_ttl:
+                rows = await db.fetch_all("SELECT id, quantity FROM journals")
+                self._stock = {str(row['id']): int(row['quantity'] or 0) for row in rows}
+                self._stock_loaded_at = time.monotonic()
+
+        return self._stock
+
+
+    async def current_version(self) -> int:
+        """Версия каталога (для кэшей, собранных поверх снимка)"""
+        snapshot = await self._current()
+        return snapshot.version
+
+
+    async def get_all_journals(self) -> List[Dict[str, Any]]:
+        """Все журналы (без остатков), порядок - год по убыванию"""
+        snapshot = await self._current()
+        catalog_reads.inc()
+        return list(snapshot.journals)
+
+
+    async def get_journal(self, journal_id) -> Optional[Dict[str, Any]]:
+        """Журнал с актуальным (в пределах stock_ttl) остатком"""
+        snapshot = await self._current()
+        catalog_reads.inc()
+
+        journal = snapshot.by_id.get(str(journal_id))
+        if journal is None:
+            return None
+
+        stock = await self._current_stock()
+        return {**journal, 'quantity': stock.get(str(journal_id), 0)}
+
+
+    async def get_stock(self, journal_id) -> int:
+        stock = await self._current_stock()
+        return stock.get(str(journal_id), 0)
+
+
+    async def get_journal_images(self, journal_id) -> List[str]:
+        """URL изображений мини-приложения (главное - первым)"""
+        snapshot = await self._current()
+        catalog_reads.inc()
+        return list(snapshot.images.get(str(journal_id), ()))
+
+
+    async def get_bot_images(self, journal_id) -> List[Dict[str, Any]]:
+        """Изображения бота: id, image_url, is_main, source_image_id (главное - первым)"""
+        snapshot = await self._current()
+        catalog_reads.inc()
+        return list(snapshot.bot_images.get(str(journal_id), ()))
+
+
+    async def get_main_bot_image(self, journal_id) -> Optional[Dict[str, Any]]:
+        """Главное изображение бота (или первое, если главное не отмечено)"""
+        images = await self.get_bot_images(journal_id)
+        return images[0] if images else None
+
+
+    def invalidate(self):
+        """Принудительная проверка версии при следующем чтении (для записи в этом же процессе)"""
+        self._checked_at = 0.0
+
+
+
+# Глобальный экземпляр
+catalog = CatalogSnapshot.from_env()
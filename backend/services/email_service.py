@@ -3,9 +3,12 @@ from email.mime.multipart import MIMEMultipart
 
 from dotenv import load_dotenv
 
+from typing import List, Optional, Tuple
+
+from services.smtp_pool import SmtpConnectionPool
+
 import logging
 import os
-import smtplib
 
 
 
@@ -25,28 +28,61 @@ class EmailService:
         self.from_email = os.getenv('EMAIL_FROM', os.getenv('EMAIL_USER'))
         self.use_tls = os.getenv('EMAIL_USE_TLS', 'True').lower() == 'true'
         
+        # Теплые SMTP соединения, отправка в отдельных потоках (не блокирует event loop)
+        self.pool = SmtpConnectionPool(
+            self.host,
+            self.port,
+            self.user,
+            self.password,
+            use_tls=self.use_tls,
+            size=int(os.getenv('EMAIL_POOL_SIZE', '2')),
+            timeout=float(os.getenv('EMAIL_TIMEOUT', '10')),
+            idle_timeout=float(os.getenv('EMAIL_IDLE_TIMEOUT', '60'))
+        )
+        
         
         
     
+    def _build_message(self, to_email: str, subject: str, html_content: str) -> str:
+        msg = MIMEMultipart()
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(html_content, 'html'))
+        return msg.as_string()
+    
+    
+    
+    
     async def send_email(self, to_email: str, subject: str, html_content: str):
         """Общий метод для отправки email"""
         try:
-            msg = MIMEMultipart()
-            msg['From'] = self.from_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            msg.attach(MIMEText(html_content, 'html'))
-
-            with smtplib.SMTP(self.host, self.port) as server:
-                if self.use_tls:
-                    server.starttls()
-                server.login(self.user, self.password)
-                server.send_message(msg)
-            
-            return True
+            message = self._build_message(to_email, subject, html_content)
+            return await self.pool.send(self.from_email, to_email, message)
         except Exception as e:
             logger.error(f"Error sending email: {e}")
             return False
+    
+    
+    
+    
+    async def send_many(self, messages: List[Tuple[str, str, str]]) -> List[bool]:
+        """Пакетная отправка [(to_email, subject, html), ...] через общие соединения"""
+        try:
+            envelopes = [
+                (self.from_email, to_email, self._build_message(to_email, subject, html))
+                for to_email, subject, html in messages
+            ]
+            return await self.pool.send_many(envelopes)
+        except Exception as e:
+            logger.error(f"Error sending email batch: {e}")
+            return [False] * len(messages)
+    
+    
+    
+    
+    def close(self):
+        self.pool.close()
 
 
 
@@ -63,11 +99,7 @@ class EmailService:
                 logger.error("Missing email credentials")
                 return False
 
-            # Создаем сообщение
-            msg = MIMEMultipart()
-            msg['From'] = self.from_email
-            msg['To'] = order['email']
-            msg['Subject'] = f"Ваш заказ #{order['id']} отправлен"
+            subject = f"Ваш заказ #{order['id']} отправлен"
 
             html = f"""
             <html>
@@ -82,30 +114,11 @@ class EmailService:
             </html>
             """
 
-            msg.attach(MIMEText(html, 'html'))
-
-            # Настройка SMTP с обработкой ошибок
-            try:
-                with smtplib.SMTP(self.host, self.port, timeout=10) as server:
-                    server.ehlo()
-                    if self.use_tls:
-                        server.starttls()
-                        server.ehlo()
-                    
-                    # Аутентификация
-                    server.login(self.user, self.password)
-                    
-                    # Отправка письма
-                    server.sendmail(self.from_email, order['email'], msg.as_string())
-                
+            # Отправка через пул соединений (ошибки SMTP логируются в пуле)
+            sent = await self.pool.send(self.from_email, order['email'], self._build_message(order['email'], subject, html))
+            if sent:
                 logger.info(f"Email sent to {order['email']}")
-                return True
-            except smtplib.SMTPAuthenticationError as auth_error:
-                logger.error(f"SMTP Authentication Error: {auth_error}")
-                return False
-            except Exception as smtp_error:
-                logger.error(f"SMTP Error: {smtp_error}")
-                return False
+            return sent
 
         except Exception as e:
             logger.error(f"Email sending error: {e}")
@@ -115,47 +128,80 @@ class EmailService:
         
     
     # ОТПРАВКА УВЕДОМЛЕНИЯ О ПОКУПКЕ ЖУРНАЛА 
+    def _order_confirmation(self, payment_id: str, amount: float, product_id: int, metadata: dict) -> Optional[Tuple[str, str, str]]:
+        """Письмо-подтверждение заказа: (to_email, subject, html) или None, если email не указан"""
+        customer_email = metadata.get('email')
+        if not customer_email:
+            logger.warning(f"No email for payment {payment_id}")
+            return None
+
+        subject = f"Подтверждение заказа #{payment_id}"
+        html_content = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; line-height: 1.6;">
+                <h2 style="color: #333;">Спасибо за ваш заказ!</h2>
+                
+                <div style="background: #f9f9f9; padding: 20px; border-radius: 5px; margin: 20px 0;">
+                    <h3 style="color: #555;">Детали заказа:</h3>
+                    <p><strong>Номер заказа:</strong> {payment_id}</p>
+                    <p><strong>Сумма:</strong> {amount:.2f} RUB</p>
+                    <p><strong>Товар:</strong> Журнал #{product_id}</p>
+                </div>
+                
+                <div style="background: #f0f8ff; padding: 20px; border-radius: 5px; margin: 20px 0;">
+                    <h3 style="color: #555;">Данные доставки:</h3>
+                    <p><strong>ФИО:</strong> {metadata.get('fullname', '')}</p>
+                    <p><strong>Телефон:</strong> {metadata.get('phone', '')}</p>
+                    <p><strong>Город:</strong> {metadata.get('city', '')}</p>
+                    <p><strong>Индекс:</strong> {metadata.get('postcode', '')}</p>
+                    <p><strong>Email:</strong> {customer_email}</p>
+                </div>
+                
+                <p>Мы свяжемся с вами для уточнения деталей доставки.</p>
+                <p>С уважением,<br>Команда магазина</p>
+            </body>
+        </html>
+        """
+        return customer_email, subject, html_content
+    
+    
+    
+    
     async def send_order_confirmation(self, payment_id: str, amount: float, product_id: int, metadata: dict) -> bool:
         """Отправляет подтверждение заказа на email"""
         try:
-            customer_email = metadata.get('email')
-            if not customer_email:
-                logger.warning(f"No email for payment {payment_id}")
+            message = self._order_confirmation(payment_id, amount, product_id, metadata)
+            if message is None:
                 return False
-
-            subject = f"Подтверждение заказа #{payment_id}"
-            html_content = f"""
-            <html>
-                <body style="font-family: Arial, sans-serif; line-height: 1.6;">
-                    <h2 style="color: #333;">Спасибо за ваш заказ!</h2>
-                    
-                    <div style="background: #f9f9f9; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                        <h3 style="color: #555;">Детали заказа:</h3>
-                        <p><strong>Номер заказа:</strong> {payment_id}</p>
-                        <p><strong>Сумма:</strong> {amount:.2f} RUB</p>
-                        <p><strong>Товар:</strong> Журнал #{product_id}</p>
-                    </div>
-                    
-                    <div style="background: #f0f8ff; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                        <h3 style="color: #555;">Данные доставки:</h3>
-                        <p><strong>ФИО:</strong> {metadata.get('fullname', '')}</p>
-                        <p><strong>Телефон:</strong> {metadata.get('phone', '')}</p>
-                        <p><strong>Город:</strong> {metadata.get('city', '')}</p>
-                        <p><strong>Индекс:</strong> {metadata.get('postcode', '')}</p>
-                        <p><strong>Email:</strong> {customer_email}</p>
-                    </div>
-                    
-                    <p>Мы свяжемся с вами для уточнения деталей доставки.</p>
-                    <p>С уважением,<br>Команда магазина</p>
-                </body>
-            </html>
-            """
-            
-            return await self.send_email(customer_email, subject, html_content)
+            return await self.send_email(*message)
             
         except Exception as e:
             logger.error(f"Order confirmation email failed: {str(e)}")
             return False
+    
+    
+    
+    
+    async def send_order_confirmations(self, orders: List[dict]) -> List[bool]:
+        """
+        Пакет подтверждений [{payment_id, amount, product_id, metadata}, ...]
+        через общие соединения (send_many); результаты - в том же порядке
+        """
+        results = [False] * len(orders)
+        messages, indexes = [], []
+        for i, order in enumerate(orders):
+            try:
+                message = self._order_confirmation(**order)
+            except Exception as e:
+                logger.error(f"Order confirmation email failed: {str(e)}")
+                continue
+            if message is not None:
+                messages.append(message)
+                indexes.append(i)
+
+        for i, sent in zip(indexes, await self.send_many(messages)):
+            results[i] = sent
+        return results
         
         
         
@@ -0,0 +1,254 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from typing import Any, Dict, Optional, Tuple
+
+from utils.metrics import registry
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+
+
+logger = logging.getLogger(__name__)
+
+
+fsm_cache_hits = registry.counter("fsm_cache_hits_total", "Чтения FSM из памяти процесса")
+fsm_cache_misses = registry.counter("fsm_cache_misses_total", "Чтения FSM из MySQL")
+fsm_revalidations = registry.counter("fsm_cache_revalidations_total", "Сверки ревизии записи FSM с MySQL (fresh/stale)")
+fsm_flush = registry.histogram("fsm_flush_seconds", "Запись пачки изменений FSM в MySQL")
+
+
+
+
+def _key_id(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id,
+        key.thread_id or "",
+        getattr(key, 'business_connection_id', None) or "",
+        key.destiny
+    ))
+
+
+
+class MySQLStorage(BaseStorage):
+    """
+    FSM в MySQL (таблица fsm_storage) с кэшем в памяти процесса.
+
+    У каждой записи есть ревизия, ее меняет каждая запись. Проверенная
+    запись кэша отдается без обращения к БД cache_ttl секунд (несколько
+    чтений за один апдейт), дальше ревизия сверяется с БД одним запросом
+    по первичному ключу: если апдейт этого пользователя обработала другая
+    реплика, ревизия не совпадет и запись перечитается. Изменения сразу
+    попадают в кэш и пишутся в БД пачками раз в flush_interval секунд
+    одним INSERT ... ON DUPLICATE KEY UPDATE - другие реплики видят их
+    с задержкой до flush_interval. Записи, не менявшиеся дольше ttl,
+    периодически удаляются.
+    """
+
+    def __init__(self, db, flush_interval: float = 0.05, cache_ttl: float = 1.0,
+                 ttl: int = 7 * 24 * 3600, cleanup_interval: float = 3600.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+
+        # key_id -> (state, data, revision, checked_at)
+        self._cache: Dict[str, Tuple[Optional[str], Dict[str, Any], Optional[str], float]] = {}
+        # key_id -> (state, data, revision); _flushing - пачка, которая сейчас пишется
+        self._dirty: Dict[str, Tuple[Optional[str], Dict[str, Any], str]] = {}
+        self._flushing: Dict[str, Tuple[Optional[str], Dict[str, Any], str]] = {}
+        self._flusher = None
+        self._cleaner = None
+        self._flush_lock = None
+
+        registry.gauge("fsm_dirty_keys", "Изменения FSM, ожидающие записи в БД",
+                       func=lambda: len(self._dirty))
+
+
+    def _ensure_tasks(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if self._cleaner is None or self._cleaner.done():
+            self._cleaner = asyncio.create_task(self._cleanup_loop())
+
+
+    def _pending(self, key_id: str) -> bool:
+        """Локальное изменение еще не в БД - кэш новее любой ревизии там"""
+        return key_id in self._dirty or key_id in self._flushing
+
+
+    async def _load(self, key_id: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cache.get(key_id)
+        if cached is not None and (self._pending(key_id) or time.monotonic() - cached[3] < self.cache_ttl):
+            fsm_cache_hits.inc()
+            return cached[0], cached[1]
+
+        if cached is not None:
+            # Сверка ревизии - без передачи данных
+            row = await self.db.fetch_one(
+                "SELECT revision FROM fsm_storage WHERE storage_key = %s",
+                (key_id,)
+            )
+            cached = self._cache.get(key_id, cached)
+            if self._pending(key_id) or (row['revision'] if row else None) == cached[2]:
+                fsm_revalidations.inc(result='fresh')
+                self._cache[key_id] = (cached[0], cached[1], cached[2], time.monotonic())
+                return cached[0], cached[1]
+            fsm_revalidations.inc(result='stale')
+
+        fsm_cache_misses.inc()
+        row = await self.db.fetch_one(
+            "SELECT state, data, revision FROM fsm_storage WHERE storage_key = %s",
+            (key_id,)
+        )
+        if self._pending(key_id):
+            # Пока ждали БД, этот процесс записал новое значение
+            cached = self._cache[key_id]
+            return cached[0], cached[1]
+
+        state = row['state'] if row else None
+        data = json.loads(row['data']) if row and row['data'] else {}
+        self._cache[key_id] = (state, data, row['revision'] if row else None, time.monotonic())
+        return state, data
+
+
+    def _store(self, key_id: str, state: Optional[str], data: Dict[str, Any]):
+        revision = uuid.uuid4().hex
+        self._cache[key_id] = (state, data, revision, time.monotonic())
+        self._dirty[key_id] = (state, data, revision)
+        self._ensure_tasks()
+
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key_id = _key_id(key)
+        _, data = await self._load(key_id)
+        self._store(key_id, state.state if isinstance(state, State) else state, data)
+
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_key_id(key))
+        return state
+
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key_id = _key_id(key)
+        state, _ = await self._load(key_id)
+        self._store(key_id, state, data.copy())
+
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_key_id(key))
+        return data.copy()
+
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            batch, self._dirty = self._dirty, {}
+            if not batch:
+                return
+            self._flushing = batch
+
+            rows = [
+                (key_id, state, json.dumps(data, ensure_ascii=False, default=str), revision)
+                for key_id, (state, data, revision) in batch.items()
+            ]
+            try:
+                with fsm_flush.time():
+                    async with self.db.transaction() as cursor:
+                        await cursor.executemany(
+                            """INSERT INTO fsm_storage (storage_key, state, data, revision) VALUES (%s, %s, %s, %s)
+                            ON DUPLICATE KEY UPDATE state = VALUES(state), data = VALUES(data),
+                                revision = VALUES(revision)""",
+                            rows
+                        )
+            except Exception:
+                # Не теряем изменения: вернем их в очередь (более новые не перетираем)
+                for key_id, value in batch.items():
+                    self._dirty.setdefault(key_id, value)
+                raise
+            finally:
+                self._flushing = {}
+
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"FSM flush error: {e}")
+
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.db.execute(
+                    "DELETE FROM fsm_storage WHERE updated_at < NOW() - INTERVAL %s SECOND",
+                    (self.ttl,)
+                )
+                now = time.monotonic()
+                for key_id in [k for k, (_, _, _, checked) in self._cache.items()
+                               if now - checked > self.cleanup_interval and not self._pending(k)]:
+                    del self._cache[key_id]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"FSM cleanup error: {e}")
+
+
+    async def close(self) -> None:
+        for task in (self._flusher, self._cleaner):
+            if task:
+                task.cancel()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"FSM flush on close failed: {e}")
+
+
+
+def create_fsm_storage(db=None) -> BaseStorage:
+    """
+    Хранилище FSM по FSM_STORAGE:
+      memory (по умолчанию) - в памяти процесса, теряется при рестарте;
+      mysql - общая таблица fsm_storage (через db), кэш + пакетная запись;
+      redis - aiogram RedisStorage по REDIS_URL (нужен пакет redis).
+    """
+    backend = os.getenv('FSM_STORAGE', 'memory').lower()
+    ttl = int(os.getenv('FSM_TTL', str(7 * 24 * 3600)))
+
+    if backend == 'mysql':
+        if db is None:
+            from database import db
+        return MySQLStorage(
+            db,
+            flush_interval=float(os.getenv('FSM_FLUSH_INTERVAL', '0.05')),
+            cache_ttl=float(os.getenv('FSM_CACHE_TTL', '1')),
+            ttl=ttl
+        )
+
+    if backend == 'redis':
+        # Опциональная зависимость - импортируем только при выборе redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+            state_ttl=ttl,
+            data_ttl=ttl
+        )
+
+    return MemoryStorage()
@@ -0,0 +1,326 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from utils.metrics import registry
+from utils.singleflight import SingleFlight
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+
+logger = logging.getLogger(__name__)
+
+
+cache_hits = registry.counter("image_cache_hits_total", "Отдано из дискового кэша")
+cache_misses = registry.counter("image_cache_misses_total", "Промахи дискового кэша")
+cache_revalidations = registry.counter("image_cache_revalidations_total", "Проверки устаревших записей в MinIO")
+cache_evictions = registry.counter("image_cache_evictions_total", "Вытеснено записей по LRU")
+upstream_fetches = registry.counter("image_cache_upstream_fetches_total", "Реальные загрузки из MinIO")
+coalesced_fetches = registry.counter("image_cache_coalesced_total", "Загрузки, сэкономленные объединением запросов")
+
+
+# .tmp старше этого - остаток упавшей записи (живая запись столько не длится)
+STALE_TMP_SECONDS = 600
+
+
+
+
+class ObjectNotFound(Exception):
+    """Объекта нет в хранилище"""
+
+
+
+@dataclass
+class CacheEntry:
+    digest: str
+    path: str
+    size: int
+    content_type: str
+    etag: Optional[str]
+    fetched_at: float
+
+
+
+# fetcher(bucket, key) -> (chunks, content_type, etag)
+Fetcher = Callable[[str, str], Tuple[Iterable[bytes], str, Optional[str]]]
+# stat(bucket, key) -> etag (ObjectNotFound если объекта нет)
+Stat = Callable[[str, str], Optional[str]]
+
+
+
+
+class DiskImageCache:
+    """
+    Дисковый кэш объектов MinIO с бюджетом по размеру и LRU-вытеснением.
+
+    Файлы адресуются sha256 от "bucket/key", рядом лежит .json с метаданными.
+    После истечения TTL бакета запись сверяется с MinIO по etag.
+
+    Папка общая для всех воркеров: индекс процесса периодически
+    (rescan_interval) перечитывается с диска, так что бюджет max_bytes
+    считается по всем файлам, а не только по загруженным этим процессом.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, default_ttl: int, bucket_ttls: Dict[str, int] = None,
+                 rescan_interval: float = 30.0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.bucket_ttls = bucket_ttls or {}
+        self.rescan_interval = rescan_interval
+
+        self._index: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+        logger.info(f"Image cache: {len(self._index)} entries, {self._total_bytes} bytes in {self.cache_dir}")
+
+        registry.gauge("image_cache_bytes", "Занято кэшем", func=lambda: self._total_bytes)
+        registry.gauge("image_cache_entries", "Записей в кэше", func=lambda: len(self._index))
+        registry.gauge("image_cache_fetches_in_flight", "Загрузки из MinIO в процессе", func=self._flights.in_flight)
+
+
+    @classmethod
+    def from_env(cls):
+        bucket_ttls = {}
+        for item in os.getenv('IMAGE_CACHE_BUCKET_TTLS', '').split(','):
+            if '=' in item:
+                bucket, ttl = item.split('=', 1)
+                bucket_ttls[bucket.strip()] = int(ttl)
+
+        return cls(
+            cache_dir=os.getenv('IMAGE_CACHE_DIR', '/tmp/minio_cache'),
+            max_bytes=int(os.getenv('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024,
+            default_ttl=int(os.getenv('IMAGE_CACHE_TTL', '3600')),
+            bucket_ttls=bucket_ttls,
+            rescan_interval=float(os.getenv('IMAGE_CACHE_RESCAN_INTERVAL', '30'))
+        )
+
+
+    @staticmethod
+    def digest(bucket: str, key: str) -> str:
+        return hashlib.sha256(f"{bucket}/{key}".encode('utf-8')).hexdigest()
+
+
+    def _paths(self, digest: str):
+        folder = os.path.join(self.cache_dir, digest[:2])
+        return folder, os.path.join(folder, digest), os.path.join(folder, f"{digest}.json")
+
+
+    def _load_index(self):
+        """
+        Восстанавливает индекс с диска (порядок LRU - по времени доступа).
+        Недописанные .tmp старше STALE_TMP_SECONDS (упавшая запись) удаляются.
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    tmp_path = os.path.join(root, name)
+                    try:
+                        if now - os.stat(tmp_path).st_mtime > STALE_TMP_SECONDS:
+                            os.remove(tmp_path)
+                    except OSError:
+                        pass
+                    continue
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(root, name), 'r') as f:
+                        meta = json.load(f)
+                    digest = name[:-len('.json')]
+                    _, data_path, _ = self._paths(digest)
+                    stat = os.stat(data_path)
+                    entries.append((stat.st_atime, CacheEntry(
+                        digest=digest,
+                        path=data_path,
+                        size=stat.st_size,
+                        content_type=meta.get('content_type', 'application/octet-stream'),
+                        etag=meta.get('etag'),
+                        fetched_at=meta.get('fetched_at', 0)
+                    )))
+                except (OSError, ValueError):
+                    continue
+
+        index = OrderedDict()
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            index[entry.digest] = entry
+
+        with self._lock:
+            self._index = index
+            self._total_bytes = sum(entry.size for entry in index.values())
+            self._scanned_at = time.monotonic()
+
+
+    def ttl_for(self, bucket: str) -> int:
+        return self.bucket_ttls.get(bucket, self.default_ttl)
+
+
+    def lookup(self, bucket: str, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._index.get(self.digest(bucket, key))
+            if entry is not None:
+                self._index.move_to_end(entry.digest)
+            return entry
+
+
+    def _is_fresh(self, bucket: str, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl_for(bucket)
+
+
+    def get(self, bucket: str, key: str, fetcher: Fetcher, stat: Stat = None) -> CacheEntry:
+        """Возвращает запись из кэша, при промахе/устаревании - загружает из MinIO"""
+        entry = self.lookup(bucket, key)
+
+        if entry is not None and self._is_fresh(bucket, entry):
+            cache_hits.inc(bucket=bucket)
+            return entry
+
+        cache_misses.inc(bucket=bucket)
+
+        # Одновременные промахи по одному объекту - одна загрузка из MinIO,
+        # остальные запросы ждут ее и отдают тот же файл
+        entry, shared = self._flights.do(
+            self.digest(bucket, key),
+            lambda: self._refresh(bucket, key, fetcher, stat)
+        )
+        if shared:
+            coalesced_fetches.inc(bucket=bucket)
+        return entry
+
+
+    def _refresh(self, bucket: str, key: str, fetcher: Fetcher, stat: Stat = None) -> CacheEntry:
+        # Пока ждали очереди, запись могла обновить предыдущая загрузка
+        entry = self.lookup(bucket, key)
+        if entry is not None and self._is_fresh(bucket, entry):
+            return entry
+
+        # Запись устарела - сверяем etag вместо полной перезагрузки
+        if entry is not None and stat is not None and entry.etag:
+            cache_revalidations.inc(bucket=bucket)
+            try:
+                etag = stat(bucket, key)
+            except ObjectNotFound:
+                self.invalidate(bucket, key)
+                raise
+            if etag == entry.etag:
+                self._touch(entry)
+                return entry
+
+        upstream_fetches.inc(bucket=bucket)
+        chunks, content_type, etag = fetcher(bucket, key)
+        return self.put(bucket, key, chunks, content_type, etag)
+
+
+    def put(self, bucket: str, key: str, chunks: Iterable[bytes], content_type: str, etag: Optional[str]) -> CacheEntry:
+        digest = self.digest(bucket, key)
+        folder, data_path, meta_path = self._paths(digest)
+        os.makedirs(folder, exist_ok=True)
+
+        # Пишем во временный файл и атомарно переименовываем
+        tmp_path = f"{data_path}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        size += len(chunk)
+
+            fetched_at = time.time()
+            with open(f"{meta_path}.tmp", 'w') as f:
+                json.dump({'bucket': bucket, 'key': key, 'content_type': content_type,
+                           'etag': etag, 'fetched_at': fetched_at}, f)
+
+            os.replace(tmp_path, data_path)
+            os.replace(f"{meta_path}.tmp", meta_path)
+        except Exception:
+            for path in (tmp_path, f"{meta_path}.tmp"):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        entry = CacheEntry(digest, data_path, size, content_type, etag, fetched_at)
+
+        # Бюджет общий для всех воркеров - периодически сверяем индекс с диском
+        if time.monotonic() - self._scanned_at > self.rescan_interval:
+            self._load_index()
+
+        with self._lock:
+            previous = self._index.pop(digest, None)
+            if previous is not None:
+                self._total_bytes -= previous.size
+            self._index[digest] = entry
+            self._total_bytes += size
+            self._evict()
+
+        return entry
+
+
+    def forget(self, bucket: str, key: str):
+        """
+        Убирает запись из индекса, не трогая файлы: файл удалил другой
+        воркер (общая папка), следующий get загрузит объект заново.
+        """
+        digest = self.digest(bucket, key)
+        with self._lock:
+            entry = self._index.pop(digest, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+
+    def invalidate(self, bucket: str, key: str):
+        digest = self.digest(bucket, key)
+        with self._lock:
+            entry = self._index.pop(digest, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+                self._remove_files(entry)
+
+
+    def _touch(self, entry: CacheEntry):
+        entry.fetched_at = time.time()
+        _, _, meta_path = self._paths(entry.digest)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            meta['fetched_at'] = entry.fetched_at
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Image cache: failed to update metadata {meta_path}: {e}")
+
+
+    def _evict(self):
+        """Вытесняет самые старые записи пока не уложимся в бюджет (под lock)"""
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            _, entry = self._index.popitem(last=False)
+            self._total_bytes -= entry.size
+            self._remove_files(entry)
+            cache_evictions.inc()
+
+
+    def _remove_files(self, entry: CacheEntry):
+        _, data_path, meta_path = self._paths(entry.digest)
+        for path in (data_path, meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+
+# Глобальный экземпляр
+image_cache = DiskImageCache.from_env()
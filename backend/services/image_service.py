@@ -1,33 +1,264 @@
-# from .minio_service import minio_service
-# from werkzeug.utils import secure_filename
-
-# import os
-
-
-
-# def save_journal_images(journal_id, image_files):
-#     """Сохраняет изображения в MinIO"""
-#     saved_images = []
-    
-#     for i, image_file in enumerate(image_files):
-#         if image_file and image_file.filename != '':
-#             # Генерируем имя файла
-#             file_extension = os.path.splitext(image_file.filename)[1].lower()
-#             filename = f"{i + 1}{file_extension}"
-            
-#             # Загружаем в MinIO
-#             image_url = minio_service.upload_image(journal_id, image_file, filename)
-            
-#             if image_url:
-#                 saved_images.append({
-#                     'filename': filename,
-#                     'url': image_url
-#                 })
-    
-#     return saved_images
-
-
-
-# def delete_journal_image(journal_id, filename):
-#     """Удаляет изображение из MinIO"""
-#     return minio_service.delete_image(journal_id, filename)
\ No newline at end of file
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from utils.metrics import registry
+
+from .storage import storage
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+variant_render_seconds = registry.histogram("image_variant_render_seconds", "Построение вариантов изображения")
+variant_bytes = registry.counter("image_variant_bytes_total", "Размер сохраненных вариантов изображений")
+variant_errors = registry.counter("image_variant_errors_total", "Ошибки построения/сохранения вариантов")
+
+
+# Варианты изображения: имя -> (максимальная ширина, формат)
+VARIANTS: Dict[str, Tuple[int, str]] = {
+    'thumb': (240, 'WEBP'),
+    'card': (640, 'WEBP'),
+    'full': (1600, 'WEBP'),
+    'telegram': (1280, 'JPEG'),   # Telegram пережимает фото сам; JPEG принимается без конвертации
+}
+
+# Варианты для ?w= (по возрастанию ширины)
+WIDTH_VARIANTS = ('thumb', 'card', 'full')
+
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+
+
+
+
+def variant_key(object_name: str, size: str) -> str:
+    """journal_3/20240101_ab12cd34.png -> journal_3/20240101_ab12cd34__card.webp"""
+    stem, _ = posixpath.splitext(object_name)
+    return f"{stem}__{size}{EXTENSIONS[VARIANTS[size][1]]}"
+
+
+
+def variant_content_type(size: str) -> str:
+    return CONTENT_TYPES[VARIANTS[size][1]]
+
+
+
+def pick_variant(width: Optional[int] = None, size: Optional[str] = None) -> Optional[str]:
+    """
+    Вариант по именованному размеру (?size=card) или требуемой ширине (?w=500):
+    наименьший вариант не уже запрошенного. None - отдавать оригинал.
+    """
+    if size:
+        return size if size in VARIANTS else None
+    if width and width > 0:
+        for name in WIDTH_VARIANTS:
+            if VARIANTS[name][0] >= width:
+                return name
+        return WIDTH_VARIANTS[-1]
+    return None
+
+
+
+def spool_to_file(fileobj: BinaryIO) -> str:
+    """
+    Копирует поток загрузки (с начала) во временный файл частями - для
+    процесса пула, который откроет его сам. Удаляет файл вызывающий.
+    """
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix='variants_', delete=False) as tmp:
+        shutil.copyfileobj(fileobj, tmp, 1024 * 1024)
+        return tmp.name
+
+
+
+def render_variants(source: Union[bytes, str]) -> Dict[str, bytes]:
+    """
+    Строит все варианты (выполняется в процессе пула - CPU-bound).
+    source - путь к файлу (читает процесс пула) или bytes.
+    Изображения меньше варианта не увеличиваются.
+    """
+    largest = max(width for width, _ in VARIANTS.values())
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as opened:
+        # JPEG декодируется сразу в уменьшенном масштабе (не меньше самого большого варианта)
+        opened.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+
+    results = {}
+    for size, (max_width, image_format) in VARIANTS.items():
+        variant = image
+        if image.width > max_width:
+            variant = image.resize(
+                (max_width, max(1, round(image.height * max_width / image.width))),
+                Image.LANCZOS
+            )
+
+        buffer = io.BytesIO()
+        if image_format == 'JPEG':
+            if variant.mode in ('RGBA', 'LA', 'P'):
+                # Прозрачность - на белый фон
+                variant = variant.convert('RGBA')
+                background = Image.new('RGB', variant.size, (255, 255, 255))
+                background.paste(variant, mask=variant.getchannel('A'))
+                variant = background
+            elif variant.mode != 'RGB':
+                variant = variant.convert('RGB')
+            variant.save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+        else:
+            if variant.mode not in ('RGB', 'RGBA'):
+                variant = variant.convert('RGBA' if variant.mode in ('LA', 'P') else 'RGB')
+            variant.save(buffer, 'WEBP', quality=80, method=4)
+        results[size] = buffer.getvalue()
+
+    return results
+
+
+
+class ImageVariants:
+    """
+    Варианты изображений (thumb/card/full в WebP, telegram в JPEG),
+    которые строятся при загрузке и лежат в том же бакете рядом с
+    оригиналом под производными ключами (variant_key). Pillow работает в
+    пуле процессов - построение не занимает event loop и GIL процесса.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_workers=int(os.getenv('IMAGE_WORKERS', '2')))
+
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Не fork: в процессе уже есть потоки (loop API, пул хранилища, uvicorn), и
+            # копия захваченных ими блокировок (logging, пул urllib3) вешает воркер.
+            # Воркеры порождает forkserver - чистый процесс с уже импортированным Pillow
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([render_variants.__module__])
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._executor
+
+
+    async def render(self, source: Union[bytes, str]) -> Dict[str, bytes]:
+        loop = asyncio.get_running_loop()
+        with variant_render_seconds.time():
+            return await loop.run_in_executor(self._pool(), render_variants, source)
+
+
+    async def create(self, client, bucket: str, object_name: str, source: Union[bytes, BinaryIO]) -> Dict[str, str]:
+        """
+        Строит и сохраняет варианты (через AsyncStorage). source - bytes
+        или поток загрузки: поток копируется во временный файл, и процесс
+        пула читает его сам - загрузка целиком в память не попадает.
+        Ошибки не пробрасываются: без вариантов прокси отдаст оригинал.
+        Возвращает {size: ключ объекта}.
+        """
+        loop = asyncio.get_running_loop()
+        path = None
+        try:
+            if not isinstance(source, bytes):
+                path = await loop.run_in_executor(None, spool_to_file, source)
+            rendered = await self.render(path or source)
+        except Exception as e:
+            variant_errors.inc(stage='render')
+            logger.warning(f"Image variants for {bucket}/{object_name} not built: {e}")
+            return {}
+        finally:
+            if path:
+                os.unlink(path)
+
+        keys = {size: variant_key(object_name, size) for size in rendered}
+        results = await asyncio.gather(
+            *(
+                storage.put_object(client, bucket, keys[size], payload, variant_content_type(size))
+                for size, payload in rendered.items()
+            ),
+            return_exceptions=True
+        )
+
+        stored = {}
+        for (size, payload), result in zip(rendered.items(), results):
+            if isinstance(result, BaseException):
+                variant_errors.inc(stage='upload')
+                logger.warning(f"Image variant {bucket}/{keys[size]} not stored: {result}")
+                continue
+            variant_bytes.inc(len(payload), size=size)
+            stored[size] = keys[size]
+        return stored
+
+
+    def create_blocking(self, client, bucket: str, object_name: str, source: Union[bytes, BinaryIO]) -> Dict[str, str]:
+        """То же для синхронного кода (Flask)"""
+        started = time.perf_counter()
+        path = None
+        try:
+            if not isinstance(source, bytes):
+                path = spool_to_file(source)
+            rendered = self._pool().submit(render_variants, path or source).result()
+        except Exception as e:
+            variant_errors.inc(stage='render')
+            logger.warning(f"Image variants for {bucket}/{object_name} not built: {e}")
+            return {}
+        finally:
+            if path:
+                os.unlink(path)
+        variant_render_seconds.observe(time.perf_counter() - started)
+
+        stored = {}
+        for size, payload in rendered.items():
+            key = variant_key(object_name, size)
+            try:
+                client.put_object(bucket, key, io.BytesIO(payload), len(payload),
+                                  content_type=variant_content_type(size))
+            except Exception as e:
+                variant_errors.inc(stage='upload')
+                logger.warning(f"Image variant {bucket}/{key} not stored: {e}")
+                continue
+            variant_bytes.inc(len(payload), size=size)
+            stored[size] = key
+        return stored
+
+
+    async def delete(self, client, bucket: str, object_name: str):
+        """Удаляет все варианты объекта (отсутствующие игнорируются)"""
+        await asyncio.gather(
+            *(storage.remove_object(client, bucket, variant_key(object_name, size)) for size in VARIANTS),
+            return_exceptions=True
+        )
+
+
+    def delete_blocking(self, client, bucket: str, object_name: str):
+        """То же для синхронного кода (Flask)"""
+        for size in VARIANTS:
+            try:
+                client.remove_object(bucket, variant_key(object_name, size))
+            except Exception:
+                pass
+
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+
+# Глобальный экземпляр (пул процессов создается при первой загрузке)
+image_variants = ImageVariants.from_env()
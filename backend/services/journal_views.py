@@ -0,0 +1,161 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from services.catalog_snapshot import catalog
+from utils.metrics import registry
+
+import logging
+import os
+import time
+import urllib.parse
+
+
+
+logger = logging.getLogger(__name__)
+
+
+view_builds = registry.counter("bot_journal_views_built_total", "Пересборки клавиатур/карточек журналов")
+
+
+SHOP_URL = "https://tottotdanetot.github.io/iglaboq/frontend/templates/miniapp/shop.html"
+
+# Публичный адрес API (прокси изображений MinIO)
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', 'https://dismally-familiar-sharksucker.cloudpub.ru')
+
+# Маркеры URL канонических изображений (journal_images, бакет journals)
+CANONICAL_IMAGE_MARKERS = ('minio_proxy/journals/', 'fast_image/')
+
+
+BACK_TO_JOURNALS_ROW = [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_journals")]
+
+
+
+
+def journal_photo_url(journal_id, image: Dict[str, Any]) -> str:
+    """URL фото журнала через кэширующий роут прокси (вариант, подготовленный для Telegram)"""
+    image_path = image['image_url'].split('?', 1)[0]
+
+    # Роль канонического изображения (бакет journals): варианты общие с мини-приложением
+    if image.get('source_image_id'):
+        for marker in CANONICAL_IMAGE_MARKERS:
+            if marker in image_path:
+                return f'{PUBLIC_BASE_URL}/fast_image/{image_path.split(marker, 1)[1]}?size=telegram'
+
+    # Старые строки journal_bot_images - своя копия в journals-bot
+    image_filename = image_path.split('/')[-1]
+    return f'{PUBLIC_BASE_URL}/fast_bot_journal/journal_{journal_id}/{image_filename}?size=telegram'
+
+
+
+@dataclass(frozen=True)
+class JournalCard:
+    """Неизменяемая часть карточки журнала; остаток подставляется при отправке"""
+    journal_id: int
+    caption_head: str
+    shop_url_prefix: str
+    photo_url: Optional[str]
+    out_of_stock_kb: InlineKeyboardMarkup
+
+
+    def render(self, quantity: int) -> Tuple[str, InlineKeyboardMarkup]:
+        if quantity <= 0:
+            return f"{self.caption_head}❌ Нет в наличии\n\n", self.out_of_stock_kb
+
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="🛒 Купить сейчас",
+                web_app=WebAppInfo(url=f"{self.shop_url_prefix}quantity={quantity}&v={int(time.time())}")
+            )],
+            BACK_TO_JOURNALS_ROW
+        ])
+        return f"{self.caption_head}🛒 В наличии: {quantity} шт.\n\n", kb
+
+
+
+class JournalViews:
+    """
+    Готовые клавиатуры и карточки журналов для бота.
+
+    Собираются один раз на версию каталога (CatalogSnapshot) и
+    пересобираются только после изменений в админке.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._list_kb: Optional[InlineKeyboardMarkup] = None
+        self._cards: Dict[int, Optional[JournalCard]] = {}
+
+
+    async def _sync(self):
+        version = await catalog.current_version()
+        if version != self._version:
+            self._version = version
+            self._list_kb = None
+            self._cards = {}
+
+
+    async def journals_keyboard(self) -> Optional[InlineKeyboardMarkup]:
+        """Клавиатура списка журналов (None - журналов нет)"""
+        await self._sync()
+        if self._list_kb is None:
+            journals = await catalog.get_all_journals()
+            if not journals:
+                return None
+
+            rows = [
+                [InlineKeyboardButton(
+                    text=f"{journal['title']} ({journal['year']}) - {journal['price']}₽",
+                    callback_data=f"journal_{journal['id']}"
+                )]
+                for journal in journals
+            ]
+            rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main")])
+            self._list_kb = InlineKeyboardMarkup(inline_keyboard=rows)
+            view_builds.inc(view='list')
+        return self._list_kb
+
+
+    async def card(self, journal_id: int) -> Optional[JournalCard]:
+        await self._sync()
+        if journal_id not in self._cards:
+            self._cards[journal_id] = await self._build_card(journal_id)
+        return self._cards[journal_id]
+
+
+    async def _build_card(self, journal_id: int) -> Optional[JournalCard]:
+        journal = await catalog.get_journal(journal_id)
+        if not journal:
+            return None
+
+        main_image = await catalog.get_main_bot_image(journal_id)
+        photo_url = journal_photo_url(journal_id, main_image) if main_image else None
+
+        caption_head = (
+            f"<b>{journal['title']}</b>\n"
+            f"Год: {journal['year']}\n"
+            f"Цена: {float(journal['price'])}₽\n"
+        )
+        shop_url_prefix = (
+            f"{SHOP_URL}?"
+            f"journal={journal_id}&"
+            f"title={urllib.parse.quote(journal.get('title', ''))}&"
+            f"year={journal.get('year', '')}&"
+            f"price={journal.get('price', '')}&"
+            f"description={urllib.parse.quote(journal.get('description') or '')}&"
+        )
+
+        view_builds.inc(view='card')
+        return JournalCard(
+            journal_id=journal_id,
+            caption_head=caption_head,
+            shop_url_prefix=shop_url_prefix,
+            photo_url=photo_url,
+            out_of_stock_kb=InlineKeyboardMarkup(inline_keyboard=[BACK_TO_JOURNALS_ROW])
+        )
+
+
+
+# Глобальный экземпляр
+journal_views = JournalViews()
@@ -2,6 +2,9 @@ from minio import Minio
 from minio.error import S3Error
 from config import Config
 
+from .storage import PART_SIZE
+
+import io
 import json
 import os 
 import logging
@@ -68,14 +71,13 @@ class MinioService:
             print(f"❌ Error making bucket public: {e}")
             return False
     
-    def upload_image(self, journal_id: str, file_contents: bytes, filename: str):
-        """Загружает изображение в MinIO с уникальным именем"""
+    def upload_image(self, journal_id: str, file_contents, filename: str):
+        """Загружает изображение в MinIO с уникальным именем (bytes или поток с read())"""
         
-        print(f"📤 Uploading image: journal_id={journal_id}, filename={filename}, size={len(file_contents)} bytes")
+        print(f"📤 Uploading image: journal_id={journal_id}, filename={filename}")
         
         import uuid
         import datetime
-        import io 
         
         file_extension = os.path.splitext(filename)[1].lower()
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -84,13 +86,7 @@ class MinioService:
         object_name = f"journal_{journal_id}/{unique_filename}"
         
         try:
-            self.client.put_object(
-                self.bucket_name,
-                object_name,
-                io.BytesIO(file_contents),  # ← ПЕРЕДАЕМ bytes
-                len(file_contents),
-                content_type=self._get_content_type(filename)
-            )
+            self._put(self.bucket_name, object_name, file_contents, filename)
             
             public_url = f"https://dismally-familiar-sharksucker.cloudpub.ru/minio_proxy/{self.bucket_name}/{object_name}"
             
@@ -103,13 +99,12 @@ class MinioService:
         
         
         
-    def upload_bot_image(self, journal_id: str, file_contents: bytes, filename: str):
-        """Загружает изображение для бота в отдельный bucket"""
-        print(f"📤 Uploading bot image: journal_id={journal_id}, filename={filename}, size={len(file_contents)} bytes")
+    def upload_bot_image(self, journal_id: str, file_contents, filename: str):
+        """Загружает изображение для бота в отдельный bucket (bytes или поток с read())"""
+        print(f"📤 Uploading bot image: journal_id={journal_id}, filename={filename}")
         
         import uuid
         import datetime
-        import io 
         
         file_extension = os.path.splitext(filename)[1].lower()
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -118,13 +113,7 @@ class MinioService:
         object_name = f"journal_{journal_id}/{unique_filename}"
         
         try:
-            self.client.put_object(
-                "journals-bot",  # ОТДЕЛЬНЫЙ BUCKET ДЛЯ БОТА
-                object_name,
-                io.BytesIO(file_contents),
-                len(file_contents),
-                content_type=self._get_content_type(filename)
-            )
+            self._put("journals-bot", object_name, file_contents, filename)  # ОТДЕЛЬНЫЙ BUCKET ДЛЯ БОТА
             
             public_url = f"https://dismally-familiar-sharksucker.cloudpub.ru/fast_image_bot/{object_name}"
             
@@ -189,6 +178,20 @@ class MinioService:
             return False
         
         
+    def _put(self, bucket: str, object_name: str, data, filename: str):
+        """bytes - одним запросом; поток - multipart частями по PART_SIZE (файл не буферизуется целиком)"""
+        if isinstance(data, (bytes, bytearray)):
+            self.client.put_object(
+                bucket, object_name, io.BytesIO(data), len(data),
+                content_type=self._get_content_type(filename)
+            )
+        else:
+            self.client.put_object(
+                bucket, object_name, data, -1,
+                part_size=PART_SIZE, content_type=self._get_content_type(filename)
+            )
+        
+        
     def _get_content_type(self, filename: str):
         """Определяет content type по расширению файла"""
         if filename.lower().endswith('.png'):
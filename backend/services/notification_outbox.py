@@ -0,0 +1,245 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.metrics import registry
+
+import aiomysql
+import asyncio
+import json
+import logging
+import os
+
+
+
+logger = logging.getLogger(__name__)
+
+
+outbox_sent = registry.counter("notification_outbox_sent_total", "Отправленные уведомления")
+outbox_failed = registry.counter("notification_outbox_failed_total", "Неудачные попытки отправки")
+outbox_batch = registry.histogram("notification_outbox_batch_seconds", "Время обработки пачки")
+
+
+# channel -> async sender(payload) -> bool
+Sender = Callable[[dict], Awaitable[bool]]
+
+# channel -> async batch_sender([payload, ...]) -> [bool, ...] (в том же порядке)
+BatchSender = Callable[[List[dict]], Awaitable[List[bool]]]
+
+
+
+
+async def enqueue(cursor, payment_id: str, channel: str, payload: dict):
+    """
+    Добавляет уведомление в outbox в транзакции вызывающего.
+    Повторная постановка того же (payment_id, channel) игнорируется.
+    """
+    await cursor.execute(
+        "INSERT IGNORE INTO notification_outbox (payment_id, channel, payload) VALUES (%s, %s, %s)",
+        (payment_id, channel, json.dumps(payload, ensure_ascii=False, default=str))
+    )
+
+
+
+class OutboxDispatcher:
+    """
+    Фоновый воркер outbox: забирает пачку записей под аренду (locked_until),
+    отправляет параллельно и фиксирует результат.
+
+    Каждая запись отмечается 'sent' ровно один раз; если процесс упадет
+    между отправкой и фиксацией, после истечения аренды запись будет
+    отправлена повторно (доставка at-least-once).
+
+    Для каналов из batch_senders вся пачка канала уходит одним вызовом
+    (например, письма - подряд через общие SMTP соединения).
+    """
+
+    def __init__(self, pool, senders: Dict[str, Sender], batch_size: int = 20,
+                 poll_interval: float = 1.0, lease_seconds: int = 60,
+                 max_attempts: int = 8, base_backoff: int = 5,
+                 batch_senders: Optional[Dict[str, BatchSender]] = None):
+        self.pool = pool
+        self.senders = senders
+        self.batch_senders = batch_senders or {}
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+
+    @classmethod
+    def from_env(cls, pool, senders: Dict[str, Sender],
+                 batch_senders: Optional[Dict[str, BatchSender]] = None):
+        return cls(
+            pool,
+            senders,
+            batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', '20')),
+            poll_interval=float(os.getenv('OUTBOX_POLL_INTERVAL', '1')),
+            max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8')),
+            batch_senders=batch_senders
+        )
+
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    def notify(self):
+        """Будит воркер сразу после коммита новых записей"""
+        self._wakeup.set()
+
+
+    async def _run(self):
+        logger.info("📬 Notification outbox dispatcher started")
+        while True:
+            try:
+                processed = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox dispatcher error: {e}", exc_info=True)
+                processed = 0
+
+            # Полная пачка - сразу берем следующую
+            if processed >= self.batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+    async def _claim(self) -> List[dict]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await conn.begin()
+                await cursor.execute(
+                    """SELECT id, payment_id, channel, payload, attempts
+                    FROM notification_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                       OR (status = 'sending' AND locked_until < NOW())
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED""",
+                    (self.batch_size,)
+                )
+                rows = await cursor.fetchall()
+
+                if rows:
+                    ids = [row['id'] for row in rows]
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    await cursor.execute(
+                        f"""UPDATE notification_outbox
+                        SET status = 'sending', attempts = attempts + 1,
+                            locked_until = NOW() + INTERVAL %s SECOND
+                        WHERE id IN ({placeholders})""",
+                        (self.lease_seconds, *ids)
+                    )
+                await conn.commit()
+        return rows
+
+
+    async def _send(self, row: dict):
+        sender = self.senders.get(row['channel'])
+        if sender is None:
+            return False, f"Unknown channel {row['channel']}"
+        try:
+            ok = await sender(json.loads(row['payload']))
+            return bool(ok), None if ok else "sender returned False"
+        except Exception as e:
+            return False, str(e)
+
+
+    async def _send_batch(self, channel: str, rows: List[dict]) -> List[Tuple[bool, Optional[str]]]:
+        try:
+            oks = await self.batch_senders[channel]([json.loads(row['payload']) for row in rows])
+        except Exception as e:
+            return [(False, str(e))] * len(rows)
+        return [(bool(ok), None if ok else "sender returned False") for ok in oks]
+
+
+    async def _send_all(self, rows: List[dict]) -> List[Tuple[bool, Optional[str]]]:
+        """Результаты в порядке rows: пакетные каналы - одним вызовом, остальные - параллельно"""
+        results: List[Optional[Tuple[bool, Optional[str]]]] = [None] * len(rows)
+        batches: Dict[str, List[int]] = {}
+        for i, row in enumerate(rows):
+            if row['channel'] in self.batch_senders:
+                batches.setdefault(row['channel'], []).append(i)
+
+        async def send_batch(channel: str, indexes: List[int]):
+            for i, result in zip(indexes, await self._send_batch(channel, [rows[i] for i in indexes])):
+                results[i] = result
+
+        async def send_one(i: int):
+            results[i] = await self._send(rows[i])
+
+        await asyncio.gather(
+            *(send_batch(channel, indexes) for channel, indexes in batches.items()),
+            *(send_one(i) for i, row in enumerate(rows) if row['channel'] not in self.batch_senders)
+        )
+        return results
+
+
+    async def dispatch_once(self) -> int:
+        rows = await self._claim()
+        if not rows:
+            return 0
+
+        with outbox_batch.time():
+            results = await self._send_all(rows)
+
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await conn.begin()
+                    for row, (ok, error) in zip(rows, results):
+                        attempts = row['attempts'] + 1
+                        if ok:
+                            outbox_sent.inc(channel=row['channel'])
+                            await cursor.execute(
+                                """UPDATE notification_outbox
+                                SET status = 'sent', sent_at = NOW(), locked_until = NULL, last_error = NULL
+                                WHERE id = %s""",
+                                (row['id'],)
+                            )
+                            await cursor.execute(
+                                "UPDATE payments SET notification_sent = TRUE WHERE payment_id = %s",
+                                (row['payment_id'],)
+                            )
+                            continue
+
+                        outbox_failed.inc(channel=row['channel'])
+                        if attempts >= self.max_attempts:
+                            logger.error(f"Outbox {row['id']} ({row['channel']}) gave up after {attempts} attempts: {error}")
+                            await cursor.execute(
+                                "UPDATE notification_outbox SET status = 'failed', locked_until = NULL, last_error = %s WHERE id = %s",
+                                (error, row['id'])
+                            )
+                        else:
+                            # Экспоненциальная задержка: 5s, 10s, 20s ... (не больше часа)
+                            backoff = min(self.base_backoff * 2 ** (attempts - 1), 3600)
+                            logger.warning(f"Outbox {row['id']} ({row['channel']}) attempt {attempts} failed, retry in {backoff}s: {error}")
+                            await cursor.execute(
+                                """UPDATE notification_outbox
+                                SET status = 'pending', locked_until = NULL, last_error = %s,
+                                    next_attempt_at = NOW() + INTERVAL %s SECOND
+                                WHERE id = %s""",
+                                (error, backoff, row['id'])
+                            )
+                    await conn.commit()
+
+        return len(rows)
@@ -0,0 +1,236 @@
+from typing import Awaitable, Callable, List
+
+from utils.metrics import registry
+
+import aiomysql
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+
+
+
+logger = logging.getLogger(__name__)
+
+
+events_received = registry.counter("payment_events_received_total", "Принятые вебхуки (duplicate - повторы ЮKassa)")
+events_processed = registry.counter("payment_events_processed_total", "Обработанные события по результату")
+events_lag = registry.histogram("payment_events_lag_seconds", "От получения вебхука до конца обработки",
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+events_processing = registry.histogram("payment_events_processing_seconds", "Время обработки одного события")
+events_pending = registry.gauge("payment_events_pending", "Необработанные события в БД")
+
+
+# handler(event_json) -> строка-результат; исключение - повторить позже
+Handler = Callable[[dict], Awaitable[str]]
+
+
+
+
+async def store_event(pool, payment_id: str, status: str, event_json: dict) -> bool:
+    """Сохраняет сырое событие; False - такое (payment_id, status) уже было"""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "INSERT IGNORE INTO payment_events (payment_id, status, payload) VALUES (%s, %s, %s)",
+                (payment_id, status, json.dumps(event_json, ensure_ascii=False))
+            )
+            inserted = cursor.rowcount == 1
+        await conn.commit()
+
+    events_received.inc(result='new' if inserted else 'duplicate')
+    return inserted
+
+
+
+class PaymentEventProcessor:
+    """
+    Пул воркеров для событий ЮKassa.
+
+    Диспетчер забирает пачку событий под аренду и раскладывает их по очередям
+    воркеров по хэшу payment_id - события одного платежа обрабатываются
+    одним воркером строго по порядку получения. Событие не забирается, пока
+    у его платежа есть более раннее незавершенное (в т.ч. отложенное на повтор).
+    """
+
+    def __init__(self, pool, handler: Handler, workers: int = 4, batch_size: int = 50,
+                 poll_interval: float = 1.0, lease_seconds: int = 120,
+                 max_attempts: int = 10, base_backoff: int = 2):
+        self.pool = pool
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+
+        self._queues: List[asyncio.Queue] = []
+        self._in_flight = set()
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+        registry.gauge("payment_events_queue_depth", "События в очередях воркеров",
+                       func=lambda: sum(q.qsize() for q in self._queues))
+
+
+    @classmethod
+    def from_env(cls, pool, handler: Handler):
+        return cls(
+            pool,
+            handler,
+            workers=int(os.getenv('PAYMENT_EVENT_WORKERS', '4')),
+            batch_size=int(os.getenv('PAYMENT_EVENT_BATCH_SIZE', '50')),
+            poll_interval=float(os.getenv('PAYMENT_EVENT_POLL_INTERVAL', '1'))
+        )
+
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        self._tasks.append(asyncio.create_task(self._dispatch_loop()))
+        logger.info(f"💳 Payment event processor started ({self.workers} workers)")
+
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+    def notify(self):
+        """Будит диспетчер сразу после сохранения нового события"""
+        self._wakeup.set()
+
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                # Обратное давление: не набираем больше, чем воркеры успевают
+                if len(self._in_flight) < self.batch_size:
+                    claimed = await self._claim(self.batch_size - len(self._in_flight))
+                    for row in claimed:
+                        self._in_flight.add(row['id'])
+                        index = zlib.crc32(row['payment_id'].encode()) % self.workers
+                        self._queues[index].put_nowait(row)
+                await self._refresh_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Payment event dispatcher error: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+    async def _claim(self, limit: int) -> List[dict]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await conn.begin()
+                await cursor.execute(
+                    """SELECT id, payment_id, status, payload, attempts,
+                              UNIX_TIMESTAMP(received_at) AS received_ts
+                    FROM payment_events e
+                    WHERE ((e.state = 'pending' AND e.next_attempt_at <= NOW())
+                        OR (e.state = 'processing' AND e.locked_until < NOW()))
+                      -- События одного платежа строго по порядку: пока раннее не завершено
+                      -- (в т.ч. ждет повтора), позднее (succeeded после waiting_for_capture) не берем
+                      AND NOT EXISTS (
+                          SELECT 1 FROM payment_events prev
+                          WHERE prev.payment_id = e.payment_id
+                            AND prev.id < e.id
+                            AND prev.state IN ('pending', 'processing')
+                      )
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED""",
+                    (limit,)
+                )
+                rows = [row for row in await cursor.fetchall() if row['id'] not in self._in_flight]
+
+                if rows:
+                    ids = [row['id'] for row in rows]
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    await cursor.execute(
+                        f"""UPDATE payment_events
+                        SET state = 'processing', attempts = attempts + 1,
+                            locked_until = NOW() + INTERVAL %s SECOND
+                        WHERE id IN ({placeholders})""",
+                        (self.lease_seconds, *ids)
+                    )
+                await conn.commit()
+        return rows
+
+
+    async def _refresh_pending(self):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT COUNT(*) FROM payment_events WHERE state IN ('pending', 'processing')")
+                (count,) = await cursor.fetchone()
+            await conn.commit()
+        events_pending.set(count)
+
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            row = await queue.get()
+            try:
+                await self._process(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error finalizing payment event {row['id']}: {e}", exc_info=True)
+            finally:
+                self._in_flight.discard(row['id'])
+                queue.task_done()
+
+
+    async def _process(self, row: dict):
+        attempts = row['attempts'] + 1
+        started = time.perf_counter()
+        try:
+            result = await self.handler(json.loads(row['payload']))
+            error = None
+        except Exception as e:
+            result = None
+            error = str(e)
+            logger.error(f"Payment event {row['id']} ({row['payment_id']}/{row['status']}) failed: {e}", exc_info=True)
+        events_processing.observe(time.perf_counter() - started)
+
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                if error is None:
+                    await cursor.execute(
+                        """UPDATE payment_events
+                        SET state = 'done', result = %s, last_error = NULL,
+                            locked_until = NULL, processed_at = NOW(3)
+                        WHERE id = %s""",
+                        (result, row['id'])
+                    )
+                    events_processed.inc(result=result or 'ok')
+                    events_lag.observe(max(0.0, time.time() - float(row['received_ts'])))
+                elif attempts >= self.max_attempts:
+                    await cursor.execute(
+                        "UPDATE payment_events SET state = 'failed', last_error = %s, locked_until = NULL WHERE id = %s",
+                        (error, row['id'])
+                    )
+                    events_processed.inc(result='failed')
+                else:
+                    backoff = min(self.base_backoff * 2 ** (attempts - 1), 600)
+                    await cursor.execute(
+                        """UPDATE payment_events
+                        SET state = 'pending', last_error = %s, locked_until = NULL,
+                            next_attempt_at = NOW() + INTERVAL %s SECOND
+                        WHERE id = %s""",
+                        (error, backoff, row['id'])
+                    )
+                    events_processed.inc(result='retry')
+            await conn.commit()
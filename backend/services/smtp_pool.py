@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from utils.metrics import registry
+
+import asyncio
+import logging
+import queue
+import smtplib
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+smtp_connects = registry.counter("smtp_connects_total", "Новые SMTP соединения (connect + TLS + login)")
+smtp_messages = registry.counter("smtp_messages_total", "Отправленные письма по результату")
+smtp_send_latency = registry.histogram("smtp_send_seconds", "Время отправки пачки писем (включая ожидание соединения)")
+
+
+# (from, to, сообщение в виде строки)
+Envelope = Tuple[str, str, str]
+
+
+
+
+class SmtpConnectionPool:
+    """
+    Пул авторизованных SMTP соединений.
+
+    smtplib блокирующий, поэтому вся работа с сокетом идет в отдельном
+    пуле потоков (по потоку на соединение) - event loop вызывающего
+    сервиса не блокируется. Соединения после отправки возвращаются в пул
+    и переиспользуются без повторного STARTTLS/LOGIN; простаивавшие дольше
+    idle_timeout проверяются NOOP перед использованием.
+    """
+
+    def __init__(self, host: str, port: int, user: Optional[str], password: Optional[str],
+                 use_tls: bool = True, size: int = 2, timeout: float = 10.0,
+                 idle_timeout: float = 60.0, max_messages: int = 100):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='smtp')
+
+        registry.gauge("smtp_idle_connections", "Свободные SMTP соединения в пуле",
+                       func=lambda: self._idle.qsize())
+
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.use_tls:
+                server.starttls()
+                server.ehlo()
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        smtp_connects.inc()
+        server._sent_count = 0
+        return server
+
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if time.monotonic() - last_used < self.idle_timeout:
+                return server
+
+            # Сервер мог закрыть простаивающее соединение - проверяем
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except Exception:
+                pass
+            self._close(server)
+
+
+    def _checkin(self, server: smtplib.SMTP):
+        # Некоторые серверы ограничивают число писем на соединение
+        if server._sent_count >= self.max_messages:
+            self._close(server)
+            return
+        self._idle.put((server, time.monotonic()))
+
+
+    def _send_batch(self, envelopes: List[Envelope]) -> List[bool]:
+        """Отправляет пачку писем через одно соединение (выполняется в потоке пула)"""
+        results = []
+        server = None
+        try:
+            for from_addr, to_addr, message in envelopes:
+                for attempt in range(2):
+                    try:
+                        if server is None:
+                            server = self._checkout()
+                        server.sendmail(from_addr, to_addr, message)
+                        server._sent_count += 1
+                        results.append(True)
+                        smtp_messages.inc(result='sent')
+                        break
+                    except smtplib.SMTPAuthenticationError as e:
+                        logger.error(f"SMTP Authentication Error: {e}")
+                        results.append(False)
+                        smtp_messages.inc(result='failed')
+                        break
+                    except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+                        error = e
+                    except smtplib.SMTPException as e:
+                        # Отказ по конкретному письму - соединение остается рабочим
+                        logger.error(f"SMTP error sending to {to_addr}: {e}")
+                        results.append(False)
+                        smtp_messages.inc(result='rejected')
+                        break
+                    except OSError as e:
+                        error = e
+
+                    # Соединение потеряно - закрываем и пробуем еще раз с новым
+                    if server is not None:
+                        self._close(server)
+                        server = None
+                    if attempt == 0:
+                        logger.warning(f"SMTP connection lost ({type(error).__name__}: {error}), reconnecting")
+                        continue
+                    logger.error(f"SMTP error sending to {to_addr}: {error}")
+                    results.append(False)
+                    smtp_messages.inc(result='failed')
+        finally:
+            if server is not None:
+                self._checkin(server)
+        return results
+
+
+    async def send(self, from_addr: str, to_addr: str, message: str) -> bool:
+        results = await self.send_many([(from_addr, to_addr, message)])
+        return results[0]
+
+
+    async def send_many(self, envelopes: List[Envelope]) -> List[bool]:
+        """
+        Отправляет пачку писем: делит ее между соединениями пула,
+        каждая часть уходит подряд через одно соединение.
+        """
+        if not envelopes:
+            return []
+
+        loop = asyncio.get_running_loop()
+        chunks = max(1, min(self.size, len(envelopes)))
+        parts = [envelopes[i::chunks] for i in range(chunks)]
+
+        with smtp_send_latency.time():
+            part_results = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, self._send_batch, part) for part in parts
+            ))
+
+        # Возвращаем результаты в исходном порядке
+        results = [False] * len(envelopes)
+        for i, part in enumerate(part_results):
+            for j, ok in enumerate(part):
+                results[i + j * chunks] = ok
+        return results
+
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(server)
+        self._executor.shutdown(wait=False)
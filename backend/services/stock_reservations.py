@@ -0,0 +1,205 @@
+from typing import Optional
+
+from utils.metrics import registry
+
+import aiomysql
+import asyncio
+import logging
+import os
+import uuid
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# Сколько живет резерв без подтвержденной оплаты
+RESERVATION_TTL_MINUTES = int(os.getenv('STOCK_RESERVATION_TTL_MINUTES', '60'))
+
+
+stock_oversold = registry.counter("stock_oversold_total", "Оплаченные резервы, для которых не хватило остатка")
+
+
+
+
+class OutOfStock(Exception):
+    """Недостаточно товара (available=None - журнал не найден)"""
+
+    def __init__(self, available: Optional[int]):
+        super().__init__(f"Not enough items in stock. Available: {available}")
+        self.available = available
+
+
+
+async def reserve_stock(pool, journal_id, quantity: int, user_id) -> str:
+    """
+    Списывает остаток и создает резерв в короткой транзакции.
+    Коммитится ДО обращения к платежному провайдеру.
+    """
+    reservation_id = str(uuid.uuid4())
+
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await conn.begin()
+            try:
+                await cursor.execute(
+                    "UPDATE journals SET quantity = quantity - %s WHERE id = %s AND quantity >= %s",
+                    (quantity, journal_id, quantity)
+                )
+
+                if cursor.rowcount == 0:
+                    await conn.rollback()
+                    await cursor.execute("SELECT quantity FROM journals WHERE id = %s", (journal_id,))
+                    journal = await cursor.fetchone()
+                    raise OutOfStock(journal['quantity'] if journal else None)
+
+                await cursor.execute(
+                    """INSERT INTO stock_reservations
+                    (reservation_id, journal_id, quantity, user_id, expires_at)
+                    VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s MINUTE)""",
+                    (reservation_id, journal_id, quantity, user_id, RESERVATION_TTL_MINUTES)
+                )
+                await conn.commit()
+            except OutOfStock:
+                raise
+            except Exception:
+                await conn.rollback()
+                raise
+
+    logger.info(f"Reserved {quantity} x journal {journal_id}: {reservation_id}")
+    return reservation_id
+
+
+
+async def attach_payment(cursor, reservation_id: str, payment_id: str):
+    """Привязывает платеж к резерву (в транзакции сохранения платежа)"""
+    await cursor.execute(
+        "UPDATE stock_reservations SET payment_id = %s WHERE reservation_id = %s",
+        (payment_id, reservation_id)
+    )
+
+
+
+async def confirm_for_payment(cursor, payment_id: str) -> bool:
+    """
+    Подтверждает резерв оплаченного платежа (в транзакции вызывающего).
+    Если резерв уже истек и товар вернулся на склад - списывает повторно;
+    если остатка уже нет, остаток не уходит в минус, а записывается
+    перепродажа (stock_oversells).
+    """
+    await cursor.execute(
+        "SELECT reservation_id, journal_id, quantity, status FROM stock_reservations WHERE payment_id = %s FOR UPDATE",
+        (payment_id,)
+    )
+    reservation = await cursor.fetchone()
+    if not reservation:
+        return False
+
+    if reservation['status'] == 'released':
+        logger.warning(f"Reservation {reservation['reservation_id']} expired before payment {payment_id} succeeded - re-taking stock")
+        await cursor.execute(
+            "UPDATE journals SET quantity = quantity - %s WHERE id = %s AND quantity >= %s",
+            (reservation['quantity'], reservation['journal_id'], reservation['quantity'])
+        )
+        if cursor.rowcount == 0:
+            stock_oversold.inc()
+            logger.error(
+                f"Oversell: payment {payment_id} paid for {reservation['quantity']} x journal "
+                f"{reservation['journal_id']}, but the stock is already gone"
+            )
+            await cursor.execute(
+                """INSERT INTO stock_oversells (reservation_id, payment_id, journal_id, quantity)
+                VALUES (%s, %s, %s, %s)""",
+                (reservation['reservation_id'], payment_id, reservation['journal_id'], reservation['quantity'])
+            )
+
+    if reservation['status'] != 'confirmed':
+        await cursor.execute(
+            "UPDATE stock_reservations SET status = 'confirmed' WHERE reservation_id = %s",
+            (reservation['reservation_id'],)
+        )
+    return True
+
+
+
+async def _release(cursor, where: str, args) -> Optional[bool]:
+    await cursor.execute(
+        f"SELECT reservation_id, journal_id, quantity, status FROM stock_reservations WHERE {where} FOR UPDATE",
+        args
+    )
+    reservation = await cursor.fetchone()
+    if not reservation:
+        return None
+    if reservation['status'] != 'active':
+        return False
+
+    await cursor.execute(
+        "UPDATE journals SET quantity = quantity + %s WHERE id = %s",
+        (reservation['quantity'], reservation['journal_id'])
+    )
+    await cursor.execute(
+        "UPDATE stock_reservations SET status = 'released' WHERE reservation_id = %s",
+        (reservation['reservation_id'],)
+    )
+    logger.info(f"Released reservation {reservation['reservation_id']}")
+    return True
+
+
+
+async def release_for_payment(cursor, payment_id: str) -> Optional[bool]:
+    """
+    Возвращает товар по резерву платежа (в транзакции вызывающего).
+    None - резерва нет (старый платеж), False - уже подтвержден/возвращен.
+    """
+    return await _release(cursor, "payment_id = %s", (payment_id,))
+
+
+
+async def release_reservation(pool, reservation_id: str):
+    """Возвращает товар по резерву в отдельной транзакции (ошибка провайдера)"""
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await conn.begin()
+            try:
+                await _release(cursor, "reservation_id = %s", (reservation_id,))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+
+
+async def release_expired(pool, batch_size: int = 100) -> int:
+    """Возвращает на склад товар из просроченных резервов"""
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(
+                "SELECT reservation_id FROM stock_reservations WHERE status = 'active' AND expires_at < NOW() LIMIT %s",
+                (batch_size,)
+            )
+            expired = await cursor.fetchall()
+            await conn.commit()
+
+    released = 0
+    for row in expired:
+        try:
+            await release_reservation(pool, row['reservation_id'])
+            released += 1
+        except Exception as e:
+            logger.error(f"Error releasing expired reservation {row['reservation_id']}: {e}")
+    return released
+
+
+
+async def run_expiry_sweeper(pool, interval: float = 60):
+    """Фоновая задача: периодически освобождает просроченные резервы"""
+    while True:
+        try:
+            released = await release_expired(pool)
+            if released:
+                logger.info(f"Released {released} expired stock reservations")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reservation sweeper error: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from utils.metrics import registry
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+storage_latency = registry.histogram(
+    "storage_operation_seconds", "Операции с объектным хранилищем (MinIO)",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+storage_wait = registry.histogram(
+    "storage_queue_wait_seconds", "Ожидание свободного слота для операции с хранилищем",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+storage_timeouts = registry.counter("storage_timeouts_total", "Операции с хранилищем, превысившие таймаут")
+storage_orphans_removed = registry.counter(
+    "storage_orphans_removed_total", "Объекты, дописанные после таймаута и удаленные (result: ok/error)"
+)
+storage_uploaded_bytes = registry.counter("storage_uploaded_bytes_total", "Байты, переданные в хранилище потоком")
+
+
+# Размер части multipart-загрузки (минимум S3 - 5 МБ): столько максимум держим в памяти на загрузку
+PART_SIZE = max(5 * 1024 * 1024, int(os.getenv('STORAGE_PART_SIZE', str(5 * 1024 * 1024))))
+
+# Предел размера загружаемого файла по умолчанию
+MAX_UPLOAD_SIZE = int(os.getenv('STORAGE_MAX_UPLOAD_SIZE', str(20 * 1024 * 1024)))
+
+
+
+
+class StorageTimeout(Exception):
+    """Операция с хранилищем не завершилась за отведенное время"""
+
+
+
+class UploadTooLarge(Exception):
+    """Поток превысил допустимый размер (загрузка прервана)"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"File is too large (max {limit / (1024 * 1024):g}MB)")
+        self.limit = limit
+
+
+
+class HashingReader:
+    """
+    Файлоподобная обертка над потоком загрузки (UploadFile.file,
+    werkzeug FileStorage.stream): по мере чтения считает размер и sha256
+    и прерывает чтение, как только размер превысил max_size. SDK minio
+    читает из нее частями по PART_SIZE - файл целиком в памяти не бывает.
+    """
+
+    def __init__(self, fileobj, max_size: Optional[int] = MAX_UPLOAD_SIZE):
+        self._fileobj = fileobj
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._fileobj.read(size)
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        self._hash.update(chunk)
+        storage_uploaded_bytes.inc(len(chunk))
+        return chunk
+
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+
+
+class AsyncStorage:
+    """
+    Асинхронный фасад над блокирующим SDK minio.
+
+    Вызовы SDK выполняются в собственном пуле потоков, event loop админки
+    (и бота в том же процессе) не блокируется. Одновременно выполняется не
+    больше max_concurrent операций; слот освобождается только когда поток
+    действительно закончил работу, поэтому зависшие запросы не копятся
+    сверх лимита. Ожидание результата ограничено timeout секундами.
+
+    Загрузка, по которой вызывающий уже получил StorageTimeout, может все же
+    дойти до конца - объект в хранилище есть, а в БД на него ничего не
+    ссылается. Для таких операций передается cleanup(result): его вызовут в
+    пуле потоков, если операция завершится успешно уже после таймаута.
+
+        url, filename = await storage.run('upload_image', minio_service.upload_image, ...)
+        await storage.put_stream(minio_client, 'bot-content', name, upload.file, 'image/jpeg')
+    """
+
+    def __init__(self, max_concurrent: int = 8, timeout: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='storage')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        registry.gauge("storage_in_flight", "Операции с хранилищем в работе",
+                       func=lambda: self.in_flight)
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrent=int(os.getenv('STORAGE_MAX_CONCURRENT', '8')),
+            timeout=float(os.getenv('STORAGE_TIMEOUT', '30'))
+        )
+
+
+    async def run(self, operation: str, func: Callable[..., Any], *args,
+                  timeout: Optional[float] = None,
+                  cleanup: Optional[Callable[[Any], Any]] = None, **kwargs) -> Any:
+        """
+        Выполняет блокирующий вызов func(*args, **kwargs) в пуле потоков.
+        cleanup(result) - удаление результата, если он появится после таймаута.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        loop = asyncio.get_running_loop()
+        with storage_wait.time(operation=operation):
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        try:
+            future = loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+        except BaseException:
+            self.in_flight -= 1
+            self._semaphore.release()
+            raise
+        future.add_done_callback(self._on_done)
+
+        result = 'ok'
+        started = time.perf_counter()
+        try:
+            # shield: по таймауту перестаем ждать, но слот держим до конца работы потока
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout or self.timeout)
+        except asyncio.TimeoutError:
+            result = 'timeout'
+            storage_timeouts.inc(operation=operation)
+            logger.error(f"Storage {operation} timed out after {timeout or self.timeout}s")
+            if cleanup is not None:
+                future.add_done_callback(lambda f: self._cleanup_late(operation, cleanup, f))
+            raise StorageTimeout(f"Storage {operation} timed out")
+        except Exception:
+            result = 'error'
+            raise
+        finally:
+            storage_latency.observe(time.perf_counter() - started, operation=operation, result=result)
+
+
+    def _on_done(self, future):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+    def _cleanup_late(self, operation: str, cleanup: Callable[[Any], Any], future):
+        """Операция завершилась после таймаута: успешный результат удаляем"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+
+        def remove():
+            try:
+                cleanup(result)
+                storage_orphans_removed.inc(operation=operation, result='ok')
+                logger.warning(f"Storage {operation} finished after timeout, result removed")
+            except Exception as e:
+                storage_orphans_removed.inc(operation=operation, result='error')
+                logger.error(f"Storage {operation} finished after timeout, cleanup failed: {e}")
+
+        try:
+            self._executor.submit(remove)
+        except RuntimeError:
+            # Пул уже остановлен (close) - объект останется
+            logger.error(f"Storage {operation} finished after timeout, executor closed: orphan left")
+
+
+    async def put_object(self, client, bucket: str, object_name: str, data: bytes,
+                         content_type: str = 'application/octet-stream'):
+        return await self.run(
+            'put_object', client.put_object,
+            bucket, object_name, io.BytesIO(data), len(data),
+            content_type=content_type,
+            cleanup=lambda _: client.remove_object(bucket, object_name)
+        )
+
+
+    async def put_stream(self, client, bucket: str, object_name: str, fileobj,
+                         content_type: str = 'application/octet-stream',
+                         max_size: Optional[int] = MAX_UPLOAD_SIZE) -> HashingReader:
+        """
+        Потоковая загрузка (multipart, части по PART_SIZE). Возвращает
+        HashingReader с итоговыми size и sha256.
+        """
+        reader = fileobj if isinstance(fileobj, HashingReader) else HashingReader(fileobj, max_size)
+        await self.run(
+            'put_object', client.put_object,
+            bucket, object_name, reader, -1,
+            part_size=PART_SIZE, content_type=content_type,
+            cleanup=lambda _: client.remove_object(bucket, object_name)
+        )
+        return reader
+
+
+    async def remove_object(self, client, bucket: str, object_name: str):
+        return await self.run('remove_object', client.remove_object, bucket, object_name)
+
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+
+# Глобальный экземпляр (общий лимит для всех загрузок/удалений процесса)
+storage = AsyncStorage.from_env()
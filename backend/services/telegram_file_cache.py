@@ -0,0 +1,216 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message, URLInputFile
+
+from typing import Optional
+
+from database import db
+from utils.metrics import registry
+
+import asyncio
+import logging
+import os
+import time
+import urllib.parse
+
+
+
+logger = logging.getLogger(__name__)
+
+
+file_id_hits = registry.counter("telegram_file_id_hits_total", "Фото отправлено по сохраненному file_id")
+file_id_misses = registry.counter("telegram_file_id_misses_total", "Фото отправлено по URL (file_id еще нет)")
+
+
+# Чат (служебный канал), куда админка заранее загружает новые фото, чтобы получить file_id
+CACHE_CHAT_ID = os.getenv('TELEGRAM_CACHE_CHAT_ID')
+
+# Версия в content_versions: invalidate в любом процессе сбрасывает память остальных
+FILE_IDS_VERSION = 'telegram_file_ids'
+VERSION_CHECK_INTERVAL = float(os.getenv('TELEGRAM_FILE_ID_CHECK_INTERVAL', '2'))
+
+# Параметры URL, выбирающие вариант изображения (разные файлы - разные file_id)
+VARIANT_PARAMS = ('size', 'w')
+
+
+# Префикс роута прокси -> бакет MinIO
+ROUTE_BUCKETS = (
+    ('fast_bot_journal/', 'journals-bot'),
+    ('fast_image_bot/', 'journals-bot'),
+    ('fast_bot_content/', 'bot-content'),
+    ('minio_proxy/journals/', 'journals'),
+    ('fast_image/', 'journals'),
+)
+
+
+
+
+def cache_key_for_url(image_url: str) -> str:
+    """
+    Ключ кэша - объект в MinIO ("bucket/path"), а не URL:
+    один и тот же объект доступен через разные роуты прокси.
+    Вариант (?size=telegram, ?w=640) входит в ключ: "bucket/path#size=telegram".
+    """
+    path, _, query = image_url.partition('?')
+    params = urllib.parse.parse_qs(query)
+    variant = '&'.join(f"{name}={params[name][0]}" for name in VARIANT_PARAMS if params.get(name))
+
+    for marker, bucket in ROUTE_BUCKETS:
+        if marker in path:
+            key = f"{bucket}/{path.split(marker, 1)[1]}"
+            return f"{key}#{variant}" if variant else key
+    return image_url
+
+
+
+class TelegramFileCache:
+    """Кэш file_id, которые Telegram возвращает после первой отправки фото"""
+
+    def __init__(self):
+        self._memory = {}
+        self._version = None
+        self._checked_at = 0.0
+        # Фоновые предзагрузки: loop держит задачи только слабой ссылкой
+        self._tasks = set()
+
+
+    async def _sync(self):
+        """Не чаще VERSION_CHECK_INTERVAL сверяет версию; изменилась - память сбрасывается"""
+        now = time.monotonic()
+        if not db.pool or now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            version = await db.get_version(FILE_IDS_VERSION)
+        except Exception as e:
+            logger.error(f"Error checking file_id cache version: {e}")
+            return
+        if version != self._version:
+            if self._version is not None:
+                self._memory.clear()
+            self._version = version
+
+
+    async def get(self, key: str) -> Optional[str]:
+        await self._sync()
+        file_id = self._memory.get(key)
+        if file_id:
+            return file_id
+
+        if not db.pool:
+            return None
+
+        try:
+            row = await db.fetch_one(
+                "SELECT file_id FROM telegram_file_ids WHERE cache_key = %s",
+                (key,)
+            )
+        except Exception as e:
+            logger.error(f"Error reading file_id for {key}: {e}")
+            return None
+
+        if row:
+            self._memory[key] = row['file_id']
+            return row['file_id']
+        return None
+
+
+    async def set(self, key: str, file_id: str):
+        self._memory[key] = file_id
+        try:
+            await db.execute(
+                """INSERT INTO telegram_file_ids (cache_key, file_id) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE file_id = VALUES(file_id)""",
+                (key, file_id)
+            )
+        except Exception as e:
+            logger.error(f"Error saving file_id for {key}: {e}")
+
+
+    async def invalidate(self, image_url: str):
+        """
+        Сбрасывает file_id объекта и всех его вариантов при удалении/замене
+        изображения в админке; остальные процессы видят это по версии.
+        """
+        key = cache_key_for_url(image_url.split('?', 1)[0])
+        for cached in [k for k in self._memory if k == key or k.startswith(f"{key}#")]:
+            del self._memory[cached]
+        pattern = key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        try:
+            await db.execute(
+                "DELETE FROM telegram_file_ids WHERE cache_key = %s OR cache_key LIKE %s",
+                (key, f"{pattern}#%")
+            )
+            await db.bump_version(FILE_IDS_VERSION)
+        except Exception as e:
+            logger.error(f"Error invalidating file_id for {key}: {e}")
+
+
+    async def answer_photo(self, message: Message, photo_url: str, **kwargs) -> Message:
+        """answer_photo с переиспользованием file_id; при первой отправке сохраняет его"""
+        key = cache_key_for_url(photo_url)
+
+        file_id = await self.get(key)
+        if file_id:
+            try:
+                sent = await message.answer_photo(photo=file_id, **kwargs)
+                file_id_hits.inc()
+                return sent
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached file_id for {key} rejected ({e}), resending by URL")
+                self._memory.pop(key, None)
+
+        file_id_misses.inc()
+        sent = await message.answer_photo(photo=photo_url, **kwargs)
+        await self.remember(key, sent)
+        return sent
+
+
+    async def remember(self, key: str, sent: Message):
+        """Сохраняет file_id самого большого варианта фото из отправленного сообщения"""
+        if sent and sent.photo:
+            await self.set(key, sent.photo[-1].file_id)
+
+
+    async def preupload(self, bot: Bot, image_url: str, contents: Optional[bytes] = None,
+                        filename: Optional[str] = None):
+        """
+        Заранее загружает новое фото в служебный чат и сохраняет file_id,
+        чтобы даже первый пользователь получил фото без скачивания по URL.
+        Без contents фото передается потоком из хранилища по image_url.
+        """
+        if not CACHE_CHAT_ID or bot is None:
+            return
+
+        key = cache_key_for_url(image_url)
+        try:
+            sent = await bot.send_photo(
+                chat_id=CACHE_CHAT_ID,
+                photo=(
+                    BufferedInputFile(contents, filename=filename) if contents is not None
+                    else URLInputFile(image_url, filename=filename)
+                ),
+                disable_notification=True
+            )
+            await self.remember(key, sent)
+            print(f"✅ Pre-uploaded photo to Telegram: {key}")
+
+            # file_id остается валидным и после удаления сообщения
+            try:
+                await bot.delete_message(chat_id=CACHE_CHAT_ID, message_id=sent.message_id)
+            except Exception:
+                pass
+        except Exception as e:
+            logger.error(f"Error pre-uploading photo {key}: {e}")
+
+
+    def preupload_in_background(self, bot: Bot, image_url: str, **kwargs):
+        """preupload в фоне; задача хранится до завершения (ошибки логирует сам preupload)"""
+        task = asyncio.create_task(self.preupload(bot, image_url, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+
+# Глобальный экземпляр
+telegram_file_cache = TelegramFileCache()
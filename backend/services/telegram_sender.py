@@ -0,0 +1,320 @@
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.metrics import registry
+
+import aiohttp
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# Приоритеты: меньше - раньше
+TRANSACTIONAL = 0   # оплата, изменение данных заказа
+BULK = 10           # массовые рассылки (отправка заказов, трек-номера)
+
+
+telegram_sent = registry.counter("telegram_send_total", "Исходящие сообщения Telegram по результату")
+telegram_retry_after = registry.counter("telegram_retry_after_total", "Ответы 429 (retry_after) от Telegram")
+telegram_wait = registry.histogram("telegram_send_wait_seconds", "Ожидание в очереди до отправки",
+                                   buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+
+# Временные ошибки, которые очередь повторяет сама
+TRANSIENT_ERRORS = (TelegramNetworkError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+
+
+class RetryAfter(Exception):
+    """429 от Bot API при прямом HTTP вызове (аналог TelegramRetryAfter для не-aiogram отправки)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Flood control exceeded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def delay(self) -> float:
+        """Сколько ждать до появления токена (0 - можно отправлять)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+
+class SharedTokenBucket:
+    """
+    Лимит одного токена бота, общий для всех процессов (админка, платежи):
+    процесс резервирует в таблице telegram_rate_limits окно под batch
+    отправок и тратит его равномерно. Окна не пересекаются, поэтому в сумме
+    процессы не превышают rate сообщений/с. Одна транзакция на batch отправок.
+    """
+
+    def __init__(self, db, name: str, rate: float, batch: int = 5):
+        self.db = db
+        self.name = name
+        self.rate = rate
+        self.batch = batch
+        self._tokens = 0
+        self._next_send = 0.0
+        self._window_end = 0.0
+
+
+    async def _reserve_batch(self) -> float:
+        """Резервирует окно под batch отправок; возвращает, через сколько оно начнется"""
+        async with self.db.transaction() as cursor:
+            await cursor.execute(
+                "INSERT IGNORE INTO telegram_rate_limits (name, next_at) VALUES (%s, 0)",
+                (self.name,)
+            )
+            await cursor.execute(
+                """SELECT next_at, UNIX_TIMESTAMP(NOW(6)) AS now
+                FROM telegram_rate_limits WHERE name = %s FOR UPDATE""",
+                (self.name,)
+            )
+            row = await cursor.fetchone()
+            now = float(row['now'])
+            start = max(float(row['next_at']), now)
+            await cursor.execute(
+                "UPDATE telegram_rate_limits SET next_at = %s WHERE name = %s",
+                (start + self.batch / self.rate, self.name)
+            )
+        return start - now
+
+
+    async def acquire(self):
+        """Ждет права на одну отправку"""
+        now = time.monotonic()
+        if self._tokens <= 0 or now > self._window_end:
+            # Остаток просроченного окна не используем - это время уже отдано другим
+            wait = await self._reserve_batch()
+            now = time.monotonic()
+            self._tokens = self.batch
+            self._next_send = now + wait
+            self._window_end = self._next_send + self.batch / self.rate
+
+        delay = self._next_send - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._tokens -= 1
+        self._next_send = max(self._next_send, time.monotonic()) + 1 / self.rate
+
+
+
+class _Job:
+    __slots__ = ('chat_id', 'send', 'future', 'attempts', 'enqueued_at')
+
+    def __init__(self, chat_id, send, future):
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+
+class TelegramSendQueue:
+    """
+    Общая очередь исходящих сообщений бота.
+
+    Ограничения Bot API соблюдаются двумя видами token bucket: глобальный
+    (global_rate сообщений/с) и по чату (per_chat_rate). Сообщение, чей чат
+    еще "остывает", откладывается и не задерживает остальные чаты.
+    429 приостанавливает всю отправку на retry_after; сетевые ошибки
+    повторяются с задержкой. Транзакционные сообщения идут раньше массовых.
+
+    Глобальный лимит - на токен бота, а отправляют несколько процессов:
+    после share_limit(db) он общий через БД (SharedTokenBucket), без
+    этого - только в пределах процесса.
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1,
+                 concurrency: int = 10, max_attempts: int = 5):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._shared: Optional[SharedTokenBucket] = None
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+
+        self._loop = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._task = None
+        self._semaphore = None
+
+        registry.gauge("telegram_send_queue_depth", "Сообщения в очереди отправки",
+                       func=lambda: self._queue.qsize() if self._queue else 0)
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', '30')),
+            per_chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', '1')),
+            concurrency=int(os.getenv('TELEGRAM_SEND_CONCURRENCY', '10'))
+        )
+
+
+    def share_limit(self, db, token: Optional[str] = None):
+        """Глобальный лимит общий для всех процессов, отправляющих от этого токена"""
+        bot_id = (token or os.getenv('BOT_TOKEN', '')).split(':', 1)[0]
+        self._shared = SharedTokenBucket(
+            db, f"bot:{bot_id}", self.global_rate,
+            batch=int(os.getenv('TELEGRAM_RATE_BATCH', '5'))
+        )
+
+
+    def _ensure_started(self):
+        # Очередь привязана к event loop; сервисы с временными loop (sync-обертки) получают свою
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = loop.create_task(self._dispatch())
+
+
+    async def send(self, chat_id, send: Callable[[], Awaitable[Any]], priority: int = BULK):
+        """
+        Ставит отправку в очередь и ждет результата.
+        send - фабрика корутины (вызывается заново при повторе).
+        """
+        self._ensure_started()
+        job = _Job(chat_id, send, self._loop.create_future())
+        self._queue.put_nowait((priority, next(self._seq), job))
+        return await job.future
+
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+
+    def _prune_chats(self):
+        # Полностью восстановившиеся ведра ничем не отличаются от новых
+        for chat_id in [c for c, b in self._chats.items() if b.delay() == 0]:
+            del self._chats[chat_id]
+
+
+    def _requeue_later(self, delay: float, item):
+        self._loop.call_later(delay, self._queue.put_nowait, item)
+
+
+    async def _dispatch(self):
+        while True:
+            item = await self._queue.get()
+            priority, _, job = item
+            if job.future.done():
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            chat_delay = self._chat_bucket(job.chat_id).delay()
+            if chat_delay > 0:
+                self._requeue_later(chat_delay, item)
+                continue
+
+            await self._acquire_global()
+            self._chats[job.chat_id].consume()
+
+            await self._semaphore.acquire()
+            self._loop.create_task(self._run(item))
+
+
+    async def _acquire_global(self):
+        if self._shared is not None:
+            try:
+                await self._shared.acquire()
+                return
+            except Exception as e:
+                logger.error(f"Shared Telegram rate limit unavailable ({e}), using the local one")
+
+        global_delay = self._global.delay()
+        if global_delay > 0:
+            await asyncio.sleep(global_delay)
+        self._global.consume()
+
+
+    async def _run(self, item):
+        priority, seq, job = item
+        try:
+            job.attempts += 1
+            if job.attempts == 1:
+                telegram_wait.observe(time.monotonic() - job.enqueued_at)
+            try:
+                result = await job.send()
+            except (TelegramRetryAfter, RetryAfter) as e:
+                telegram_retry_after.inc()
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Telegram flood control: pausing sends for {e.retry_after}s (chat {job.chat_id})")
+                self._retry_or_fail(item, e, e.retry_after)
+                return
+            except TRANSIENT_ERRORS as e:
+                self._retry_or_fail(item, e, min(2 ** job.attempts, 30))
+                return
+            except Exception as e:
+                telegram_sent.inc(result='error')
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+
+            telegram_sent.inc(result='sent')
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._semaphore.release()
+
+
+    def _retry_or_fail(self, item, error: Exception, delay: float):
+        job = item[2]
+        if job.attempts >= self.max_attempts:
+            telegram_sent.inc(result='error')
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        logger.warning(f"Telegram send to {job.chat_id} failed ({type(error).__name__}), retry {job.attempts} in {delay}s")
+        self._requeue_later(delay, item)
+
+
+
+# Глобальный экземпляр
+telegram_queue = TelegramSendQueue.from_env()
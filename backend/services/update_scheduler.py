@@ -0,0 +1,146 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from utils.metrics import registry
+
+import asyncio
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+update_wait = registry.histogram("bot_update_queue_wait_seconds", "Ожидание апдейта до начала обработки",
+                                 buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+update_duplicates = registry.counter("bot_update_duplicates_total", "Отброшенные повторные нажатия кнопок")
+handler_latency = registry.histogram("bot_handler_seconds", "Время выполнения хендлера")
+
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer-middleware апдейтов: параллельная обработка с ограничением.
+
+    - не больше max_concurrent апдейтов обрабатываются одновременно;
+    - апдейты одного чата идут строго по очереди (FIFO-lock на чат);
+    - повторное нажатие той же кнопки в течение dedup_window секунд
+      отбрасывается (callback подтверждается, хендлер не вызывается).
+    """
+
+    def __init__(self, max_concurrent: int = 50, dedup_window: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.dedup_window = dedup_window
+        self._semaphore = None
+        self._chat_locks: Dict[Any, Tuple[asyncio.Lock, int]] = {}
+        self._recent_callbacks: Dict[Tuple, float] = {}
+        self._active = 0
+        self._waiting = 0
+
+        registry.gauge("bot_updates_in_progress", "Апдейты в обработке",
+                       func=lambda: self._active)
+        registry.gauge("bot_updates_waiting", "Апдейты, ожидающие своей очереди",
+                       func=lambda: self._waiting)
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrent=int(os.getenv('BOT_MAX_CONCURRENT_UPDATES', '50')),
+            dedup_window=float(os.getenv('BOT_CALLBACK_DEDUP_WINDOW', '1.0'))
+        )
+
+
+    def _is_duplicate(self, update: Update) -> bool:
+        callback = update.callback_query
+        if callback is None or self.dedup_window <= 0:
+            return False
+
+        now = time.monotonic()
+        if len(self._recent_callbacks) > 1000:
+            self._recent_callbacks = {k: t for k, t in self._recent_callbacks.items() if now - t < self.dedup_window}
+
+        message_id = callback.message.message_id if callback.message else None
+        key = (callback.from_user.id, message_id, callback.data)
+        last = self._recent_callbacks.get(key)
+        self._recent_callbacks[key] = now
+        return last is not None and now - last < self.dedup_window
+
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update) and self._is_duplicate(event):
+            update_duplicates.inc()
+            try:
+                await event.callback_query.answer()
+            except Exception:
+                pass
+            return None
+
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        chat_key = chat.id if chat else (user.id if user else None)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        received = time.perf_counter()
+        if chat_key is None:
+            return await self._run(handler, event, data, received)
+
+        lock, waiters = self._chat_locks.get(chat_key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._chat_locks[chat_key] = (lock, waiters + 1)
+        try:
+            async with lock:
+                return await self._run(handler, event, data, received)
+        finally:
+            lock, waiters = self._chat_locks[chat_key]
+            if waiters <= 1:
+                del self._chat_locks[chat_key]
+            else:
+                self._chat_locks[chat_key] = (lock, waiters - 1)
+
+
+    async def _run(self, handler: Handler, event: TelegramObject, data: Dict[str, Any], received: float) -> Any:
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        update_wait.observe(time.perf_counter() - received)
+
+        self._active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner-middleware: время выполнения каждого хендлера (метка - имя функции)"""
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        with handler_latency.time(handler=name):
+            return await handler(event, data)
+
+
+
+def setup_update_scheduler(dp) -> UpdateScheduler:
+    scheduler = UpdateScheduler.from_env()
+    dp.update.outer_middleware(scheduler)
+    dp.message.middleware(HandlerTimer())
+    dp.callback_query.middleware(HandlerTimer())
+    return scheduler
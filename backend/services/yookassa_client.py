@@ -0,0 +1,195 @@
+from typing import Optional
+
+from utils.circuit_breaker import CircuitBreaker
+from utils.metrics import registry
+
+import aiohttp
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+
+
+logger = logging.getLogger(__name__)
+
+
+request_latency = registry.histogram("yookassa_request_seconds", "Время запроса к API ЮKassa (одна попытка)")
+call_latency = registry.histogram("yookassa_call_seconds", "Время вызова ЮKassa с учетом повторов")
+request_retries = registry.counter("yookassa_retries_total", "Повторы запросов к ЮKassa")
+request_errors = registry.counter("yookassa_errors_total", "Ошибки запросов к ЮKassa")
+
+
+# Статусы, при которых запрос можно безопасно повторить с тем же Idempotence-Key
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+
+
+class YooKassaError(Exception):
+    """Ошибка API ЮKassa (status=None - сетевая ошибка или таймаут)"""
+
+    def __init__(self, message: str, status: Optional[int] = None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+
+class YooKassaClient:
+    """
+    Общий HTTP-клиент ЮKassa на весь процесс платежного сервиса.
+
+    Одна aiohttp-сессия с пулом keep-alive соединений и кэшем DNS:
+    TCP/TLS рукопожатие с api.yookassa.ru выполняется один раз, а не на
+    каждый платеж. Повторы идут с тем же Idempotence-Key, поэтому ЮKassa
+    не создаст второй платеж/захват, если первый ответ просто потерялся.
+
+    Сетевые ошибки и 429/5xx (после всех повторов) размыкают предохранитель:
+    пока ЮKassa недоступна, вызовы сразу получают CircuitOpen.
+    """
+
+    def __init__(self, shop_id: str, secret_key: str,
+                 base_url: str = 'https://api.yookassa.ru/v3',
+                 connect_timeout: float = 3.0, timeout: float = 10.0,
+                 retries: int = 2, backoff: float = 0.3,
+                 pool_size: int = 20, dns_ttl: int = 300,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.dns_ttl = dns_ttl
+        self.breaker = breaker or CircuitBreaker('yookassa')
+        self._session: Optional[aiohttp.ClientSession] = None
+
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('YOOKASSA_SHOP_ID'),
+            os.getenv('YOOKASSA_SECRET_KEY'),
+            base_url=os.getenv('YOOKASSA_API_URL', 'https://api.yookassa.ru/v3'),
+            connect_timeout=float(os.getenv('YOOKASSA_CONNECT_TIMEOUT', '3')),
+            timeout=float(os.getenv('YOOKASSA_TIMEOUT', '10')),
+            retries=int(os.getenv('YOOKASSA_RETRIES', '2')),
+            pool_size=int(os.getenv('YOOKASSA_POOL_SIZE', '20')),
+            breaker=CircuitBreaker(
+                'yookassa',
+                failure_threshold=int(os.getenv('YOOKASSA_BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('YOOKASSA_BREAKER_RESET', '30'))
+            )
+        )
+
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=60
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(self.shop_id or '', self.secret_key or ''),
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout),
+            raise_for_status=False
+        )
+        logger.info(f"💳 YooKassa client started ({self.base_url}, pool {self.pool_size})")
+
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    async def _request(self, operation: str, method: str, path: str,
+                       payload: Optional[dict] = None,
+                       idempotence_key: Optional[str] = None,
+                       timeout: Optional[float] = None) -> dict:
+        self.breaker.before_call()
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        headers = {}
+        if idempotence_key:
+            headers['Idempotence-Key'] = idempotence_key
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+
+        last_error = None
+        with call_latency.time(operation=operation):
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    request_retries.inc(operation=operation)
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+                started = time.perf_counter()
+                try:
+                    async with self._session.request(
+                        method, f"{self.base_url}{path}",
+                        json=payload, headers=headers, timeout=request_timeout
+                    ) as response:
+                        try:
+                            body = await response.json(content_type=None)
+                        except ValueError:
+                            body = {'raw': await response.text()}
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    request_latency.observe(time.perf_counter() - started, operation=operation, status='error')
+                    last_error = YooKassaError(f"YooKassa {operation} failed: {type(e).__name__}: {e}")
+                    logger.warning(f"YooKassa {operation} attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+                    continue
+
+                request_latency.observe(time.perf_counter() - started, operation=operation, status=str(status))
+
+                if status < 400:
+                    self.breaker.record_success()
+                    return body
+
+                last_error = YooKassaError(f"YooKassa {operation} error {status}: {body}", status=status, body=body)
+                if status not in RETRY_STATUSES:
+                    break
+                logger.warning(f"YooKassa {operation} attempt {attempt + 1} got {status}")
+
+        request_errors.inc(operation=operation)
+        if last_error.status is None or last_error.status in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            # Ошибка запроса (4xx) - сам сервис доступен
+            self.breaker.record_success()
+        raise last_error
+
+
+    async def create_payment(self, payment_data: dict, idempotence_key: Optional[str] = None) -> dict:
+        return await self._request(
+            'create', 'POST', '/payments', payment_data,
+            idempotence_key=idempotence_key or str(uuid.uuid4())
+        )
+
+
+    async def capture_payment(self, payment_id: str, amount: float, idempotence_key: Optional[str] = None) -> dict:
+        """
+        Захват платежа. Ключ по умолчанию выводится из payment_id, поэтому
+        повторная обработка того же вебхука не приводит к двойному захвату.
+        """
+        return await self._request(
+            'capture', 'POST', f'/payments/{payment_id}/capture',
+            {"amount": {"value": f"{amount:.2f}", "currency": "RUB"}},
+            idempotence_key=idempotence_key or f"capture-{payment_id}"
+        )
+
+
+    async def get_payment(self, payment_id: str) -> dict:
+        return await self._request('get', 'GET', f'/payments/{payment_id}')
+
+
+
+# Глобальный экземпляр (сессия открывается в main платежного сервиса)
+yookassa_client = YooKassaClient.from_env()
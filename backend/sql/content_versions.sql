@@ -0,0 +1,9 @@
+-- Однократно, до выкладки версии с кэшами каталога и контента бота.
+-- content_versions: штампы версий (каталог, контент бота, file_id Telegram);
+-- запись увеличивает версию, процессы по ней сбрасывают свои кэши.
+
+CREATE TABLE IF NOT EXISTS content_versions (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
@@ -0,0 +1,13 @@
+-- Однократно, перед включением FSM_STORAGE=mysql (бот, сервис платежей).
+-- fsm_storage: состояние и данные FSM по ключу бот/чат/пользователь;
+-- revision меняется при каждой записи - по ней реплики проверяют свой кэш.
+-- Записи, не менявшиеся дольше FSM_TTL, удаляет само хранилище.
+
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    storage_key VARCHAR(255) NOT NULL PRIMARY KEY,
+    state VARCHAR(255) NULL,
+    data TEXT NULL,
+    revision CHAR(32) NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_updated (updated_at)
+);
@@ -0,0 +1,8 @@
+-- Однократно, до выкладки версии с единой загрузкой изображений журналов.
+-- journal_bot_images.source_image_id: строка бота - роль канонического
+-- изображения из journal_images (объект и варианты общие с мини-приложением).
+-- NULL - старые строки со своей копией в бакете journals-bot.
+
+ALTER TABLE journal_bot_images
+    ADD COLUMN source_image_id INT NULL,
+    ADD INDEX idx_journal_bot_images_source (source_image_id);
@@ -0,0 +1,7 @@
+-- Однократно, вместе с journal_bot_images_source_image_id.sql.
+-- journal_images.show_in_app: FALSE - изображение загружено только для бота
+-- (new_bot_images, загрузка изображения бота) и в мини-приложении не
+-- показывается; строка живет, пока на нее ссылается роль в боте.
+
+ALTER TABLE journal_images
+    ADD COLUMN show_in_app BOOLEAN NOT NULL DEFAULT TRUE;
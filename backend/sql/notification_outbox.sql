@@ -0,0 +1,19 @@
+-- Однократно, до выкладки версии с outbox уведомлений (сервис платежей).
+-- notification_outbox: уведомления (telegram, email) пишутся в транзакции
+-- заказа и отправляются диспетчером; (payment_id, channel) - одно на канал.
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    payment_id VARCHAR(64) NOT NULL,
+    channel VARCHAR(16) NOT NULL,
+    payload TEXT NOT NULL,
+    status ENUM('pending', 'sending', 'sent', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until DATETIME NULL,
+    last_error TEXT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at DATETIME NULL,
+    UNIQUE KEY uniq_payment_channel (payment_id, channel),
+    KEY idx_status_next (status, next_attempt_at)
+);
@@ -0,0 +1,20 @@
+-- Однократно, до выкладки версии с очередью событий ЮKassa (сервис платежей).
+-- payment_events: вебхук сохраняется и сразу подтверждается, событие
+-- обрабатывают воркеры; (payment_id, status) - защита от повторов ЮKassa.
+
+CREATE TABLE IF NOT EXISTS payment_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    payment_id VARCHAR(64) NOT NULL,
+    status VARCHAR(32) NOT NULL,
+    payload TEXT NOT NULL,
+    state ENUM('pending', 'processing', 'done', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    result VARCHAR(64) NULL,
+    last_error TEXT NULL,
+    next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until DATETIME NULL,
+    received_at TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3),
+    processed_at DATETIME(3) NULL,
+    UNIQUE KEY uniq_payment_status (payment_id, status),
+    KEY idx_state_next (state, next_attempt_at)
+);
@@ -0,0 +1,29 @@
+-- Однократно, до выкладки версии с резервированием остатка (сервис платежей).
+-- stock_reservations: остаток, списанный до обращения к ЮKassa; просроченные
+-- активные резервы возвращает sweeper.
+-- stock_oversells: оплата пришла после истечения резерва, а товар уже
+-- продан - разбирает менеджер.
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    reservation_id CHAR(36) NOT NULL PRIMARY KEY,
+    journal_id INT NOT NULL,
+    quantity INT NOT NULL,
+    user_id BIGINT NULL,
+    payment_id VARCHAR(64) NULL,
+    status ENUM('active', 'confirmed', 'released') NOT NULL DEFAULT 'active',
+    expires_at DATETIME NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_payment (payment_id),
+    KEY idx_status_expires (status, expires_at)
+);
+
+CREATE TABLE IF NOT EXISTS stock_oversells (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    reservation_id CHAR(36) NOT NULL,
+    payment_id VARCHAR(64) NOT NULL,
+    journal_id INT NOT NULL,
+    quantity INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_payment (payment_id)
+);
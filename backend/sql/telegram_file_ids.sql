@@ -0,0 +1,9 @@
+-- Однократно, до выкладки версии с кэшем file_id Telegram.
+-- telegram_file_ids: file_id фото, уже отправленных ботом, по ключу
+-- объекта (и варианта размера), чтобы не загружать фото повторно.
+
+CREATE TABLE IF NOT EXISTS telegram_file_ids (
+    cache_key VARCHAR(255) NOT NULL PRIMARY KEY,
+    file_id VARCHAR(255) NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
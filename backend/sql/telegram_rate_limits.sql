@@ -0,0 +1,9 @@
+-- Однократно, до выкладки версии с общим лимитом отправки Telegram.
+-- telegram_rate_limits: для каждого токена бота - момент, с которого
+-- свободно следующее окно отправок (общее для админки и сервиса платежей).
+-- Строка для токена создается при первой отправке.
+
+CREATE TABLE IF NOT EXISTS telegram_rate_limits (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    next_at DOUBLE NOT NULL DEFAULT 0
+);
@@ -2,6 +2,8 @@ from flask import Flask
 from flask_cors import CORS
 from database import db
 
+from utils import async_loop
+
 import asyncio
 import logging
 import os
@@ -12,31 +14,48 @@ import os
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Создаем глобальный event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+
+# Режим работы с event loop:
+#   threaded - loop крутится в отдельном потоке, Flask-потоки отправляют
+#              в него корутины через run_coroutine_threadsafe (параллельно)
+#   legacy   - старый режим: один loop + run_until_complete (последовательно)
+API_LOOP_MODE = os.getenv('API_LOOP_MODE', 'threaded').lower()
+
+
+if API_LOOP_MODE == 'legacy':
+    # Создаем глобальный event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    # Глобальная функция run_async
+    def run_async(coro):
+        """Синхронная обертка для асинхронных функций"""
+        return loop.run_until_complete(coro)
+else:
+    # Общий loop в фоновом потоке - на нем живет пул соединений БД
+    loop = async_loop.get_flask_loop()
+    run_async = async_loop.run_async
+
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('ADMIN_SECRET_KEY')
+# Отдача кэшированных изображений через X-Sendfile (если перед Flask стоит nginx)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 
 
-# Инициализация базы данных
-try:
-    loop.run_until_complete(db.connect())
-    test = loop.run_until_complete(db.fetch_one("SELECT 1 AS test"))
-    print("✅ Database connection successful:", test)
-except Exception as e:
-    print(f"❌ Database connection failed: {e}")
-    exit(1)
-
-
+# Инициализация базы данных (кроме воркеров пула изображений: они
+# импортируют этот модуль заново как __mp_main__)
+if __name__ != '__mp_main__':
+    try:
+        run_async(db.connect(service='api'))
+        test = run_async(db.fetch_one("SELECT 1 AS test"))
+        print("✅ Database connection successful:", test)
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}")
+        exit(1)
 
-# Глобальная функция run_async
-def run_async(coro):
-    """Синхронная обертка для асинхронных функций"""
-    return loop.run_until_complete(coro)
 
 
 # Добавляем run_async в контекст приложения
@@ -61,16 +80,15 @@ def home():
 
 if __name__ == '__main__':
     try:
-        print("🟢 Starting server on http://localhost:5007")
-        app.run(host='0.0.0.0', port=5007, debug=True)
+        print(f"🟢 Starting server on http://localhost:5007 (loop mode: {API_LOOP_MODE})")
+        # В legacy-режиме запросы к общему loop нельзя выполнять параллельно
+        app.run(host='0.0.0.0', port=5007, debug=True, threaded=API_LOOP_MODE != 'legacy')
     except Exception as e:
         print(f"❌ Server startup failed: {e}")
     finally:
         # Закрытие соединений при завершении
         try:
-            loop.run_until_complete(db.close())
+            run_async(db.close())
             print("✅ Database connection closed")
         except Exception as e:
             print(f"❌ Error closing database: {e}")
-            
-            
\ No newline at end of file
@@ -0,0 +1,133 @@
+from typing import Dict, Optional
+
+from utils.metrics import registry
+
+import asyncio
+import logging
+import os
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+admission_wait = registry.histogram(
+    "admission_wait_seconds", "Ожидание места в ограничителе запросов",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+admission_rejected = registry.counter("admission_rejected_total", "Запросы, отклоненные ограничителем (503)")
+
+
+# Все ограничители процесса (имя -> ограничитель) - для метрик
+limiters: Dict[str, "AdmissionLimiter"] = {}
+
+
+registry.gauge("admission_in_flight", "Запросы в обработке",
+               func=lambda: {(('limiter', name),): l.in_flight for name, l in list(limiters.items())})
+registry.gauge("admission_queued", "Запросы в очереди ограничителя",
+               func=lambda: {(('limiter', name),): l.queued for name, l in list(limiters.items())})
+registry.gauge("admission_max_concurrent", "Предел одновременных запросов",
+               func=lambda: {(('limiter', name),): l.max_concurrent for name, l in list(limiters.items())})
+
+
+
+
+class Overloaded(Exception):
+    """Нет мест: вернуть клиенту 503 с Retry-After"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+
+class AdmissionLimiter:
+    """
+    Ограничитель конкурентности с очередью ограниченной длины.
+
+    Одновременно выполняются не больше max_concurrent запросов; еще
+    max_queue ждут не дольше queue_timeout секунд. Остальные сразу получают
+    Overloaded - быстрый 503 вместо зависшего соединения, которое клиент
+    все равно оборвет по таймауту и повторит.
+
+        async with checkout_limiter.slot():
+            ...
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 20, max_queue: int = 50,
+                 queue_timeout: float = 2.0, retry_after: float = 2.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        limiters[name] = self
+
+
+    @classmethod
+    def from_env(cls, name: str, **defaults):
+        """Параметры из <NAME>_MAX_CONCURRENT, _MAX_QUEUE, _QUEUE_TIMEOUT, _RETRY_AFTER"""
+        limiter = cls(name, **defaults)
+        prefix = name.upper()
+        limiter.max_concurrent = int(os.getenv(f'{prefix}_MAX_CONCURRENT', str(limiter.max_concurrent)))
+        limiter.max_queue = int(os.getenv(f'{prefix}_MAX_QUEUE', str(limiter.max_queue)))
+        limiter.queue_timeout = float(os.getenv(f'{prefix}_QUEUE_TIMEOUT', str(limiter.queue_timeout)))
+        limiter.retry_after = float(os.getenv(f'{prefix}_RETRY_AFTER', str(limiter.retry_after)))
+        return limiter
+
+
+    def slot(self) -> "_Slot":
+        return _Slot(self)
+
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        if not self._semaphore.locked():
+            # Есть свободное место - без ожидания
+            await self._semaphore.acquire()
+            admission_wait.observe(0, limiter=self.name)
+            self.in_flight += 1
+            return
+
+        if self.queued >= self.max_queue:
+            admission_rejected.inc(limiter=self.name, reason='queue_full')
+            raise Overloaded(f"'{self.name}' is over capacity", self.retry_after)
+
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            admission_rejected.inc(limiter=self.name, reason='timeout')
+            raise Overloaded(f"'{self.name}': no slot within {self.queue_timeout}s", self.retry_after)
+        finally:
+            self.queued -= 1
+
+        admission_wait.observe(time.perf_counter() - started, limiter=self.name)
+        self.in_flight += 1
+
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+
+class _Slot:
+    def __init__(self, limiter: AdmissionLimiter):
+        self._limiter = limiter
+
+
+    async def __aenter__(self):
+        await self._limiter.acquire()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._limiter.release()
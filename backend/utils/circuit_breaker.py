@@ -0,0 +1,112 @@
+from typing import Dict
+
+from utils.metrics import registry
+
+import logging
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+circuit_transitions = registry.counter("circuit_breaker_transitions_total", "Переходы состояний предохранителя")
+circuit_rejected = registry.counter("circuit_breaker_rejected_total", "Вызовы, отклоненные открытым предохранителем")
+
+
+# Все предохранители процесса (имя -> предохранитель) - для метрик
+breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+registry.gauge("circuit_breaker_state", "Состояние предохранителя (0 closed, 1 half_open, 2 open)",
+               func=lambda: {(('breaker', name),): STATE_VALUES[b.state] for name, b in list(breakers.items())})
+
+
+
+
+class CircuitOpen(Exception):
+    """Внешний сервис считается недоступным - вызов не выполнялся"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для вызовов внешнего сервиса.
+
+    После failure_threshold ошибок подряд размыкается на reset_timeout
+    секунд: вызовы сразу получают CircuitOpen, не занимая соединения и
+    воркеры. Затем пропускается до half_open_calls пробных вызовов -
+    успех замыкает цепь, ошибка снова размыкает.
+
+        breaker.before_call()   # CircuitOpen, если цепь разомкнута
+        ... вызов ...
+        breaker.record_success() / breaker.record_failure()
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._probes_started = 0.0
+        breakers[name] = self
+
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit '{self.name}': {self.state} -> {state}")
+        circuit_transitions.inc(breaker=self.name, state=state)
+        self.state = state
+
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+
+    def before_call(self):
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                circuit_rejected.inc(breaker=self.name)
+                raise CircuitOpen(self.name, self.retry_after())
+            self._set_state(HALF_OPEN)
+            self._probes = 0
+
+        if self.state == HALF_OPEN:
+            # Пробный вызов мог быть отменен, не сообщив результат - разрешаем новый
+            if self._probes and time.monotonic() - self._probes_started > self.reset_timeout:
+                self._probes = 0
+            if self._probes >= self.half_open_calls:
+                circuit_rejected.inc(breaker=self.name)
+                raise CircuitOpen(self.name, 1.0)
+            if not self._probes:
+                self._probes_started = time.monotonic()
+            self._probes += 1
+
+
+    def record_success(self):
+        self.failures = 0
+        self._set_state(CLOSED)
+
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
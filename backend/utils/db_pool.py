@@ -0,0 +1,264 @@
+from typing import Dict, Optional
+
+from utils.metrics import registry
+
+import aiomysql
+import asyncio
+import logging
+import os
+import time
+import traceback
+
+
+
+logger = logging.getLogger(__name__)
+
+
+db_acquire_wait = registry.histogram(
+    "db_pool_acquire_wait_seconds", "Ожидание свободного соединения из пула",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+db_pings = registry.counter("db_pool_pings_total", "Проверки (ping) соединений после простоя")
+db_leaks = registry.counter("db_pool_leaks_total", "Соединения, удерживаемые дольше порога")
+db_rejected = registry.counter("db_pool_rejected_total", "Отказы в соединении (очередь полна или таймаут)")
+
+
+# Все пулы процесса (имя -> пул) - для метрик
+pools: Dict[str, "InstrumentedPool"] = {}
+
+
+registry.gauge("db_pool_in_use", "Выданные соединения",
+               func=lambda: {(('pool', name),): pool.in_use for name, pool in list(pools.items())})
+registry.gauge("db_pool_idle", "Свободные соединения",
+               func=lambda: {(('pool', name),): pool.freesize for name, pool in list(pools.items())})
+registry.gauge("db_pool_max", "Максимальный размер пула",
+               func=lambda: {(('pool', name),): pool.maxsize for name, pool in list(pools.items())})
+registry.gauge("db_pool_waiting", "Запросы, ожидающие соединения",
+               func=lambda: {(('pool', name),): pool.waiting for name, pool in list(pools.items())})
+
+
+
+
+class PoolExhausted(Exception):
+    """Нет свободного соединения: очередь пула заполнена или истек acquire_timeout"""
+
+
+
+
+class PoolSettings:
+    """
+    Параметры пула. Значения по умолчанию задаются сервисом, переопределяются
+    переменными окружения: сначала DB_POOL_<SERVICE>_<NAME>, затем DB_POOL_<NAME>
+    (MIN, MAX, RECYCLE, PING_AFTER, LEAK_SECONDS, ACQUIRE_TIMEOUT, MAX_WAITERS).
+
+    acquire_timeout/max_waiters = 0 - ждать без ограничений (как aiomysql).
+    """
+
+    def __init__(self, minsize: int = 1, maxsize: int = 5, pool_recycle: int = 1800,
+                 ping_after: float = 30.0, leak_seconds: float = 30.0, autocommit: bool = True,
+                 acquire_timeout: float = 0, max_waiters: int = 0):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pool_recycle = pool_recycle
+        self.ping_after = ping_after
+        self.leak_seconds = leak_seconds
+        self.autocommit = autocommit
+        self.acquire_timeout = acquire_timeout
+        self.max_waiters = max_waiters
+
+
+    @classmethod
+    def from_env(cls, service: Optional[str] = None, **defaults):
+        settings = cls(**defaults)
+
+        def setting(name, default, cast):
+            keys = [f'DB_POOL_{name}']
+            if service:
+                keys.insert(0, f'DB_POOL_{service.upper()}_{name}')
+            for key in keys:
+                value = os.getenv(key)
+                if value is not None:
+                    return cast(value)
+            return default
+
+        settings.minsize = setting('MIN', settings.minsize, int)
+        settings.maxsize = max(settings.minsize, setting('MAX', settings.maxsize, int))
+        settings.pool_recycle = setting('RECYCLE', settings.pool_recycle, int)
+        settings.ping_after = setting('PING_AFTER', settings.ping_after, float)
+        settings.leak_seconds = setting('LEAK_SECONDS', settings.leak_seconds, float)
+        settings.acquire_timeout = setting('ACQUIRE_TIMEOUT', settings.acquire_timeout, float)
+        settings.max_waiters = setting('MAX_WAITERS', settings.max_waiters, int)
+        return settings
+
+
+
+class _AcquireContext:
+    """Как у aiomysql: и `await pool.acquire()`, и `async with pool.acquire() as conn`"""
+
+    def __init__(self, pool: "InstrumentedPool"):
+        self._pool = pool
+        self._conn = None
+
+
+    def __await__(self):
+        return self._pool._acquire().__await__()
+
+
+    async def __aenter__(self):
+        self._conn = await self._pool._acquire()
+        return self._conn
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        conn, self._conn = self._conn, None
+        await self._pool.release(conn)
+
+
+
+class InstrumentedPool:
+    """
+    Обертка над aiomysql.Pool с тем же интерфейсом (acquire/release/close).
+
+    - время ожидания соединения пишется в гистограмму;
+    - соединение, простоявшее в пуле дольше ping_after, проверяется ping
+      (с переподключением) до выдачи - без зависаний на мертвых сокетах;
+    - соединения, удерживаемые дольше leak_seconds, логируются один раз
+      вместе со стеком места, где их взяли.
+    """
+
+    def __init__(self, name: str, pool: aiomysql.Pool, settings: PoolSettings):
+        self.name = name
+        self.settings = settings
+        self._pool = pool
+        self._held = {}         # id(conn) -> [conn, acquired_at, stack, reported]
+        self._released_at = {}  # id(conn) -> время возврата в пул
+        self._waiting = 0
+        self._watchdog = None
+
+
+    @classmethod
+    async def create(cls, name: str, settings: PoolSettings, **connect_kwargs) -> "InstrumentedPool":
+        pool = await aiomysql.create_pool(
+            minsize=settings.minsize,
+            maxsize=settings.maxsize,
+            pool_recycle=settings.pool_recycle,
+            autocommit=settings.autocommit,
+            **connect_kwargs
+        )
+        instance = cls(name, pool, settings)
+        pools[name] = instance
+        logger.info(f"✅ Пул БД '{name}': {settings.minsize}..{settings.maxsize}, recycle {settings.pool_recycle}s")
+        return instance
+
+
+    @property
+    def size(self) -> int:
+        return self._pool.size
+
+
+    @property
+    def freesize(self) -> int:
+        return self._pool.freesize
+
+
+    @property
+    def maxsize(self) -> int:
+        return self._pool.maxsize
+
+
+    @property
+    def in_use(self) -> int:
+        return len(self._held)
+
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+
+    def acquire(self) -> _AcquireContext:
+        return _AcquireContext(self)
+
+
+    async def _acquire(self):
+        started = time.perf_counter()
+
+        # Собственная очередь пула: при переполнении отказываем сразу, а не копим ожидающих
+        if self.settings.max_waiters and self._pool.freesize == 0 and self._waiting >= self.settings.max_waiters:
+            db_rejected.inc(pool=self.name, reason='queue_full')
+            raise PoolExhausted(f"Pool '{self.name}' queue is full ({self._waiting} waiting)")
+
+        self._waiting += 1
+        try:
+            if self.settings.acquire_timeout:
+                conn = await asyncio.wait_for(self._pool.acquire(), timeout=self.settings.acquire_timeout)
+            else:
+                conn = await self._pool.acquire()
+        except asyncio.TimeoutError:
+            db_rejected.inc(pool=self.name, reason='timeout')
+            raise PoolExhausted(f"Pool '{self.name}': no connection within {self.settings.acquire_timeout}s")
+        finally:
+            self._waiting -= 1
+
+        idle_since = self._released_at.pop(id(conn), None)
+        if idle_since is not None and time.monotonic() - idle_since > self.settings.ping_after:
+            try:
+                await conn.ping(reconnect=True)
+                db_pings.inc(pool=self.name, result='ok')
+            except Exception as e:
+                db_pings.inc(pool=self.name, result='failed')
+                logger.warning(f"Pool '{self.name}': stale connection dropped ({e})")
+                conn.close()
+                self._pool.release(conn)
+                conn = await self._pool.acquire()
+
+        db_acquire_wait.observe(time.perf_counter() - started, pool=self.name)
+
+        self._held[id(conn)] = [conn, time.monotonic(), traceback.extract_stack(limit=12)[:-2], False]
+        self._ensure_watchdog()
+        return conn
+
+
+    def release(self, conn):
+        self._held.pop(id(conn), None)
+        self._released_at[id(conn)] = time.monotonic()
+        return self._pool.release(conn)
+
+
+    def _ensure_watchdog(self):
+        if self.settings.leak_seconds <= 0:
+            return
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch_leaks())
+
+
+    async def _watch_leaks(self):
+        interval = max(1.0, self.settings.leak_seconds / 2)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for entry in list(self._held.values()):
+                conn, acquired_at, stack, reported = entry
+                if reported or now - acquired_at < self.settings.leak_seconds:
+                    continue
+                entry[3] = True
+                db_leaks.inc(pool=self.name)
+                logger.warning(
+                    f"Pool '{self.name}': connection held for {now - acquired_at:.1f}s, acquired at:\n"
+                    + "".join(traceback.format_list(stack))
+                )
+
+            # Соединения, закрытые пулом (recycle), больше не вернутся
+            if len(self._released_at) > self.maxsize * 4:
+                self._released_at.clear()
+
+
+    def close(self):
+        if self._watchdog:
+            self._watchdog.cancel()
+        pools.pop(self.name, None)
+        self._pool.close()
+
+
+    async def wait_closed(self):
+        await self._pool.wait_closed()
@@ -0,0 +1,208 @@
+from typing import Optional
+
+import bisect
+import hmac
+import os
+import threading
+import time
+
+
+
+class Counter:
+    """Монотонный счетчик"""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+
+class Gauge:
+    """Текущее значение (можно задать функцию для ленивого чтения)"""
+
+    def __init__(self, name: str, description: str = "", func=None):
+        self.name = name
+        self.description = description
+        self._func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+
+    def samples(self):
+        if self._func is not None:
+            result = self._func()
+            if isinstance(result, dict):
+                return [(self.name, dict(key), value) for key, value in result.items()]
+            return [(self.name, {}, result)]
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (секунды по умолчанию)"""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, description: str = "", buckets=None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._series = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'counts': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+
+    def time(self, **labels):
+        """Контекстный менеджер: замеряет время выполнения блока"""
+        return _Timer(self, labels)
+
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, series in self._series.items():
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series['counts']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    result.append((f"{self.name}_bucket", {**labels, 'le': le}, cumulative))
+                result.append((f"{self.name}_sum", labels, series['sum']))
+                result.append((f"{self.name}_count", labels, series['count']))
+        return result
+
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._register(Counter, name, description)
+
+
+    def gauge(self, name: str, description: str = "", func=None) -> Gauge:
+        return self._register(Gauge, name, description, func=func)
+
+
+    def histogram(self, name: str, description: str = "", buckets=None) -> Histogram:
+        return self._register(Histogram, name, description, buckets=buckets)
+
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            if metric.description:
+                lines.append(f"# HELP {metric.name} {metric.description}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{rendered}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+
+def metrics_authorized(authorization: Optional[str]) -> bool:
+    """
+    Доступ к /metrics: заголовок "Authorization: Bearer <METRICS_TOKEN>".
+    Без METRICS_TOKEN эндпоинт закрыт - метрики не светятся на публичных хостах.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return False
+    return hmac.compare_digest(authorization or '', f"Bearer {token}")
+
+
+
+# Глобальный реестр метрик процесса
+registry = Registry()
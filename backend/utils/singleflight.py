@@ -0,0 +1,56 @@
+import threading
+
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом:
+    функция выполняется один раз, остальные потоки ждут и получают тот же результат.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+
+    def do(self, key, fn):
+        """Возвращает (result, shared) - shared=True если результат получен чужим вызовом"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+        return call.result, False
+
+
+    def in_flight(self) -> int:
+        return len(self._calls)